@@ -0,0 +1,107 @@
+"""
+配列のバイナリコーデックのベンチマーク
+
+様々なdtype、形状、メモリ配置の配列とそのリストがcodecで元に戻ることを確認した上で、
+検出結果、YOLOXの出力、画像の配列ごとに、エンコード後のサイズとエンコード・デコードの速度を
+common.npy2b64str/b64str2npy(Base64)と比較する。lz4とzstandardはインストールされている場合のみ計測する。
+元に戻らない場合は終了コード1で終了する。
+
+実行方法:
+    python benchmarks/bench_codec.py [--repeat 20]
+"""
+from pth2onnx.app import codec, common
+import argparse
+import numpy as np
+import sys
+import time
+
+
+def roundtrip_cases(rng:np.random.Generator) -> list:
+    return [
+        rng.random((3, 4)).astype(np.float32),
+        np.asfortranarray(rng.random((5, 7))),
+        rng.random((6, 8))[::2, 1::3],
+        np.array(3.5),
+        np.zeros((0, 6), dtype=np.float32),
+        np.arange(10, dtype='>i4'),
+        np.array(['2020-01-01'], dtype='M8[D]'),
+        rng.integers(0, 2, 9).astype(bool),
+        rng.integers(0, 256, (17, 31, 3), dtype=np.uint8),
+    ]
+
+
+def check_roundtrip(rng:np.random.Generator, compressions:list) -> bool:
+    cases = roundtrip_cases(rng)
+    ok = True
+    for comp in compressions:
+        decoded = [codec.decode(codec.encode(a, compression=comp)) for a in cases]
+        decoded_batch = codec.decode_batch(codec.encode_batch(cases, compression=comp))
+        for a, b, c in zip(cases, decoded, decoded_batch):
+            for x in (b, c):
+                if x.dtype != a.dtype or x.shape != a.shape or not np.array_equal(x, a):
+                    print(f"Round-trip failed. compression={comp}, dtype={a.dtype}, shape={a.shape}")
+                    ok = False
+    for a in cases:
+        if not np.array_equal(codec.from_b64(codec.to_b64(a)), a):
+            print(f"Base64 round-trip failed. dtype={a.dtype}, shape={a.shape}")
+            ok = False
+    return ok
+
+
+def measure(func, repeat:int) -> float:
+    func()
+    best = None
+    for _ in range(repeat):
+        tm = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - tm
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the binary array codec.')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    compressions = [None]
+    for name in ('lz4', 'zstd'):
+        try:
+            codec.encode(np.zeros(1), compression=name)
+            compressions.append(name)
+        except ValueError:
+            print(f"{name} is not installed. Skip.")
+    ok = check_roundtrip(rng, compressions)
+    print(f"round-trip: {'ok' if ok else 'failed'}")
+
+    dets = np.concatenate([rng.uniform(0, 640, (100, 4)), rng.random((100, 1)), rng.integers(0, 80, (100, 1))], 1).astype(np.float32)
+    yolox_out = rng.standard_normal((1, 3549, 85)).astype(np.float32)
+    image = np.repeat(rng.integers(0, 256, (720, 1280, 1), dtype=np.uint8), 3, axis=2)
+    batch = [dets[:rng.integers(1, 100)] for _ in range(16)]
+    print(f"{'data':>16} {'method':>12} {'bytes':>10} {'ratio':>6} {'enc MB/s':>9} {'dec MB/s':>9}")
+    for name, arr in (('detections', dets), ('yolox_output', yolox_out), ('image', image), ('batch16_dets', batch)):
+        arrays = arr if isinstance(arr, list) else [arr]
+        raw = sum(a.nbytes for a in arrays)
+        methods = [('base64', lambda: [common.npy2b64str(a) for a in arrays],
+                    lambda enc: [common.b64str2npy(s, a.shape, a.dtype) for s, a in zip(enc, arrays)])]
+        for comp in compressions:
+            label = comp or 'binary'
+            if isinstance(arr, list):
+                methods.append((label, lambda comp=comp: codec.encode_batch(arrays, compression=comp),
+                                lambda enc: codec.decode_batch(enc)))
+            else:
+                methods.append((label, lambda comp=comp: codec.encode(arr, compression=comp), lambda enc: codec.decode(enc)))
+        if not isinstance(arr, list):
+            methods.append(('binary+b64', lambda: codec.to_b64(arr), lambda enc: codec.from_b64(enc)))
+        for method, enc_func, dec_func in methods:
+            enc = enc_func()
+            size = sum(len(e) for e in enc) if isinstance(enc, list) else len(enc)
+            t_enc = measure(enc_func, args.repeat)
+            t_dec = measure(lambda: dec_func(enc), args.repeat)
+            print(f"{name:>16} {method:>12} {size:>10} {size / raw:>6.2f} {raw / t_enc / 1e6:>9.0f} {raw / t_dec / 1e6:>9.0f}")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+モデルファイルのダウンローダー(pth2onnx.app.download)のベンチマーク
+
+Rangeヘッダに対応したhttp.serverをこのプロセス内で起動し、乱数で作成したファイルをダウンロードする。
+サーバーは接続ごとの転送速度を--rate_mb(MB/秒)に制限できるため、区間を並行してダウンロードする効果を確認できる。
+以下の場合について、所要時間、転送速度、SHA-256が一致したか、再開したバイト数を表示する。
+- segments=N: N個の区間を並行してダウンロード
+- resume: 1回目の接続を途中で切断し、再試行で続きからダウンロード
+- no range: Rangeに対応しないサーバーから1つの接続でダウンロード
+- cached: キャッシュにあるファイルの取得
+
+実行方法:
+    python benchmarks/bench_download.py [--size_mb 64] [--segments 1,4] [--rate_mb 0]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pth2onnx.app import download
+import argparse
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # serverにbody、rate、ranges、fail_afterを設定して使う
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.body
+        begin, end, status = 0, len(body), 200
+        m = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if m and self.server.ranges and self.headers.get('If-Range', self.server.etag) == self.server.etag:
+            begin, end, status = int(m.group(1)), (int(m.group(2)) + 1 if m.group(2) else len(body)), 206
+            if begin >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{len(body)}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            end = min(end, len(body))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - begin))
+        self.send_header('ETag', self.server.etag)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {begin}-{end - 1}/{len(body)}")
+        self.end_headers()
+        view = memoryview(body)[begin:end]
+        step = 256 * 1024
+        tm = time.perf_counter()
+        for i in range(0, len(view), step):
+            with self.server.lock:
+                fail = self.server.fail_after is not None and i >= self.server.fail_after and end - begin > 1
+                if fail:
+                    self.server.fail_after = None
+            if fail:
+                # 途中で接続を切断する
+                self.close_connection = True
+                return
+            try:
+                self.wfile.write(view[i:i + step])
+            except ConnectionError:
+                # サイズの確認だけで接続を閉じるクライアントもある
+                return
+            if self.server.rate > 0:
+                wait = (i + step) / self.server.rate - (time.perf_counter() - tm)
+                if wait > 0:
+                    time.sleep(wait)
+
+
+def start_server(body:bytes, rate_mb:float, ranges:bool=True, fail_after:int=None) -> ThreadingHTTPServer:
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    httpd.daemon_threads = True
+    httpd.body, httpd.rate, httpd.ranges, httpd.fail_after = body, rate_mb * 1024 * 1024, ranges, fail_after
+    httpd.etag, httpd.lock = f"\"{hashlib.sha256(body).hexdigest()[:16]}\"", threading.Lock()
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the model downloader.')
+    parser.add_argument('--size_mb', type=int, default=64)
+    parser.add_argument('--segments', default='1,4')
+    parser.add_argument('--rate_mb', type=float, default=0.0, help='Per connection rate limit (MB/s). 0 is unlimited.')
+    args = parser.parse_args()
+    logger = logging.getLogger('bench_download')
+    body = os.urandom(args.size_mb * 1024 * 1024)
+    sha256 = hashlib.sha256(body).hexdigest()
+    print(f"size={args.size_mb}MB, rate_mb={args.rate_mb or 'unlimited'}")
+    print(f"{'case':>12} {'elapsed s':>10} {'MB/s':>8} {'segments':>9} {'resumed':>10} {'sha256':>7}")
+    with tempfile.TemporaryDirectory() as data:
+        cases = [(f"segments={s}", dict(segments=int(s)), dict()) for s in args.segments.split(',')]
+        cases += [('resume', dict(retries=1), dict(fail_after=len(body) // 2)),
+                  ('no range', dict(segments=4), dict(ranges=False)),
+                  ('cached', dict(), None)]
+        url = None
+        for name, opts, server in cases:
+            httpd = start_server(body, args.rate_mb, **server) if server is not None else None
+            url = f"http://127.0.0.1:{httpd.server_address[1]}/model.pth" if httpd is not None else url
+            downloader = download.Downloader(logger, data, **opts)
+            ret = downloader.fetch(url, sha256=sha256, use_cache=server is None)
+            if httpd is not None:
+                httpd.shutdown()
+                httpd.server_close()
+            print(f"{name:>12} {ret['elapsed']:>10.3f} {ret['mb_per_sec'] or 0:>8.1f} {ret['segments']:>9} {ret['resumed']:>10} "
+                  f"{'ok' if ret['sha256'] == sha256 else 'ng':>7}")
+
+
+if __name__ == '__main__':
+    main()
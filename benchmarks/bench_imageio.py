@@ -0,0 +1,100 @@
+"""
+画像の読み込みと書き込みのベンチマーク
+
+同じサイズの画像を一時ディレクトリに作成し、commonの従来のヘルパーとimageioのそれぞれで
+1画像あたりの処理時間と、tracemallocで測定した1画像の処理中に確保されたメモリのピークを比較する。
+- decode: PILでデコードしてndarrayにコピー、cv2.imread、使い回すバッファへのデコード
+- npy: np.loadで全体を読み込み、メモリマップで読み込み(どちらも入力サイズへのリサイズまで)
+- encode: PILでバイト列にエンコードしてから書き込み、PILで直接書き込み、cv2.imwriteで直接書き込み
+
+実行方法:
+    python benchmarks/bench_imageio.py [--images 50] [--width 1280] [--height 720] [--repeat 3]
+"""
+from pathlib import Path
+from pth2onnx.app import common, imageio
+import argparse
+import cv2
+import numpy as np
+import tempfile
+import time
+import tracemalloc
+
+INPUT_SIZE = 416
+
+
+def measure(func, files:list, repeat:int):
+    """
+    ファイルごとにfuncを実行し、最も速かった回の1画像あたりの時間(ミリ秒)と、1画像あたりの確保メモリのピーク(MB)を返す。
+    """
+    for f in files[:2]:
+        func(f)
+    best = None
+    for _ in range(repeat):
+        tm = time.perf_counter()
+        for f in files:
+            func(f)
+        elapsed = time.perf_counter() - tm
+        best = elapsed if best is None else min(best, elapsed)
+    peaks = []
+    tracemalloc.start()
+    for f in files:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        func(f)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return best / len(files) * 1000, max(peaks) / 1024 / 1024
+
+
+def resize(img:np.ndarray) -> np.ndarray:
+    r = INPUT_SIZE / max(img.shape[:2])
+    return cv2.resize(img, (int(img.shape[1] * r), int(img.shape[0] * r)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the image I/O.')
+    parser.add_argument('--images', type=int, default=50)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        jpgs, npys = [], []
+        for i in range(args.images):
+            img = cv2.GaussianBlur(rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8), (9, 9), 0)
+            jpgs.append(tmp / f"{i:04d}.jpg")
+            npys.append(tmp / f"{i:04d}.npy")
+            cv2.imwrite(str(jpgs[-1]), img)
+            np.save(npys[-1], img)
+        out_dir = tmp / 'out'
+        out_dir.mkdir()
+        src = cv2.imread(str(jpgs[0]))
+        src_rgb = cv2.cvtColor(src, cv2.COLOR_BGR2RGB)
+        reader = imageio.ImageReader()
+
+        def legacy_encode(f):
+            with open(out_dir / f.name, 'wb') as fp:
+                fp.write(common.img2byte(common.npy2img(src_rgb), format='JPEG'))
+
+        cases = [
+            ('decode', 'common.imgfile2npy', lambda f: common.imgfile2npy(f), jpgs),
+            ('decode', 'cv2.imread', lambda f: cv2.imread(str(f)), jpgs),
+            ('decode', 'ImageReader.read', lambda f: reader.read(f), jpgs),
+            ('npy', 'common.npyfile2npy', lambda f: resize(common.npyfile2npy(f)), npys),
+            ('npy', 'imageio.imread(mmap)', lambda f: resize(imageio.imread(f)), npys),
+            ('encode', 'img2byte+write', legacy_encode, jpgs),
+            ('encode', 'common.npy2imgfile', lambda f: common.npy2imgfile(src_rgb, out_dir / f.name), jpgs),
+            ('encode', 'imageio.imwrite', lambda f: imageio.imwrite(out_dir / f.name, src), jpgs),
+        ]
+        print(f"images={args.images}, size={args.width}x{args.height}, image_mb={src.nbytes / 1024 / 1024:.2f}")
+        print(f"{'stage':>7} {'method':>22} {'ms/img':>8} {'imgs/sec':>9} {'peak alloc MB/img':>18}")
+        for stage, name, func, files in cases:
+            ms, peak = measure(func, files, args.repeat)
+            print(f"{stage:>7} {name:>22} {ms:>8.2f} {1000 / ms:>9.1f} {peak:>18.2f}")
+        print(f"ImageReader: allocations={reader.allocations}, reused={reader.reused}")
+
+
+if __name__ == '__main__':
+    main()
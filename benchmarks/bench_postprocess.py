@@ -0,0 +1,86 @@
+"""
+YOLOXの後処理(デコード、スコアの閾値、クラスごとのNMS)のベンチマーク
+
+ベクトル化したpostprocess.postprocessと、画像ごと・クラスごとに処理する
+postprocess.postprocess_referenceの結果が一致することを確認した上で、
+1画像あたりの候補ボックス数ごとに1画像あたりの処理時間を計測する。
+結果が一致しない場合は終了コード1で終了する。
+
+実行方法:
+    python benchmarks/bench_postprocess.py [--batch 4] [--repeat 3]
+"""
+from pth2onnx.app import postprocess
+import argparse
+import numpy as np
+import sys
+import time
+
+INPUT_SIZE = (640, 640)
+NUM_CLASSES = 80
+
+
+def make_outputs(rng:np.random.Generator, batch:int, candidates:int) -> np.ndarray:
+    """
+    1画像あたりの候補ボックス数がおよそcandidatesになるYOLOXの出力を作成する。
+    ボックスはNMSで抑制が起きるように、いくつかの物体の周りに集まるように配置する。
+    """
+    num_anchors = sum((INPUT_SIZE[0] // s) * (INPUT_SIZE[1] // s) for s in postprocess.STRIDES)
+    outputs = np.zeros((batch, num_anchors, 5 + NUM_CLASSES), dtype=np.float32)
+    outputs[..., :2] = rng.uniform(-0.5, 0.5, (batch, num_anchors, 2))
+    outputs[..., 2:4] = rng.normal(2.0, 0.3, (batch, num_anchors, 2))
+    outputs[..., 4] = rng.uniform(0.5, 1.0, (batch, num_anchors))
+    outputs[..., 5:] = rng.uniform(0.0, 0.2, (batch, num_anchors, NUM_CLASSES))
+    for b in range(batch):
+        cells = rng.choice(num_anchors * NUM_CLASSES, size=min(candidates, num_anchors * NUM_CLASSES), replace=False)
+        outputs[b, cells // NUM_CLASSES, 5 + cells % NUM_CLASSES] = rng.uniform(0.7, 1.0, len(cells))
+    return outputs
+
+
+def same(a:np.ndarray, b:np.ndarray) -> bool:
+    if len(a) != len(b):
+        return False
+    if len(a) == 0:
+        return True
+    key_a = np.lexsort((a[:, 3], a[:, 2], a[:, 1], a[:, 0], a[:, 5]))
+    key_b = np.lexsort((b[:, 3], b[:, 2], b[:, 1], b[:, 0], b[:, 5]))
+    return np.array_equal(a[key_a], b[key_b])
+
+
+def measure(func, repeat:int) -> float:
+    best = None
+    for _ in range(repeat):
+        tm = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - tm
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the YOLOX postprocess.')
+    parser.add_argument('--batch', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--score_th', type=float, default=0.3)
+    parser.add_argument('--nms_th', type=float, default=0.45)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    ratios = np.full(args.batch, 0.5, dtype=np.float32)
+    ok = True
+    print(f"{'candidates':>10} {'detections':>10} {'reference ms/img':>17} {'vectorized ms/img':>18} {'speedup':>8} {'equal':>6}")
+    for candidates in (1000, 10000, 100000):
+        outputs = make_outputs(rng, args.batch, candidates)
+        ref = postprocess.postprocess_reference(outputs, INPUT_SIZE, ratios, score_th=args.score_th, nms_th=args.nms_th)
+        vec = postprocess.postprocess(outputs, INPUT_SIZE, ratios, score_th=args.score_th, nms_th=args.nms_th)
+        equal = all(same(r, v) for r, v in zip(ref, vec))
+        ok = ok and equal
+        t_ref = measure(lambda: postprocess.postprocess_reference(outputs, INPUT_SIZE, ratios, args.score_th, args.nms_th), args.repeat)
+        t_vec = measure(lambda: postprocess.postprocess(outputs, INPUT_SIZE, ratios, args.score_th, args.nms_th), args.repeat)
+        print(f"{candidates:>10} {sum(len(v) for v in vec) // args.batch:>10} {t_ref / args.batch * 1000:>17.2f} "
+              f"{t_vec / args.batch * 1000:>18.2f} {t_ref / t_vec:>7.1f}x {str(equal):>6}")
+    if not ok:
+        print('The vectorized postprocess does not match the reference implementation.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+検出結果の描画のベンチマーク
+
+1画像あたりのボックス数が10、100、1000の検出結果を乱数で作成し、1画像あたりの描画時間を比較する。
+- loop: ボックスごとに座標を丸めてcv2.rectangleとcv2.putTextで描画する従来の実装
+- renderer: 座標をまとめて丸めて切り詰め、色ごとにまとめてボックスを描画し、描画済みのラベルをコピーするrender.Renderer
+- batch: render.Rendererで--batch枚の画像をまとめて描画したときの1画像あたりの時間
+ラベルのスコアは0.1%単位で種類が限られるため、最初の数回でラベルの描画が済み、以降は使い回される。
+
+実行方法:
+    python benchmarks/bench_render.py [--boxes 10,100,1000] [--width 1280] [--height 720] [--batch 8] [--repeat 20]
+"""
+from pth2onnx.app import postprocess, render
+import argparse
+import cv2
+import numpy as np
+import time
+
+COLORS = render.class_colors(len(postprocess.COCO_CLASSES)).tolist()
+
+
+def draw_loop(img:np.ndarray, dets:np.ndarray) -> np.ndarray:
+    labels = postprocess.COCO_CLASSES
+    for x1, y1, x2, y2, score, cls in dets.tolist():
+        cls = int(cls)
+        color = COLORS[cls % len(COLORS)]
+        x1, y1, x2, y2 = int(round(x1)), int(round(y1)), int(round(x2)), int(round(y2))
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(img, f"{labels[cls]}:{score * 100:.1f}%", (x1, max(y1 - 4, 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1, cv2.LINE_AA)
+    return img
+
+
+def make_dets(rng:np.random.Generator, n:int, width:int, height:int) -> np.ndarray:
+    # 一部のボックスは画像の外にはみ出すようにする
+    xy = rng.uniform(-0.05, 1.0, (n, 2)) * (width, height)
+    wh = rng.uniform(0.02, 0.3, (n, 2)) * (width, height)
+    return np.concatenate([xy, xy + wh, rng.uniform(0.05, 1.0, (n, 1)),
+                           rng.integers(0, len(postprocess.COCO_CLASSES), (n, 1))], axis=1).astype(np.float32)
+
+
+def measure(func, repeat:int) -> float:
+    """
+    funcを繰り返し実行し、最も速かった回の時間(ミリ秒)を返す。
+    """
+    func()
+    best = None
+    for _ in range(repeat):
+        tm = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - tm
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the detection renderer.')
+    parser.add_argument('--boxes', default='10,100,1000')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    renderer = render.Renderer()
+    frame = cv2.GaussianBlur(rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8), (9, 9), 0)
+    print(f"image={args.width}x{args.height}, batch={args.batch}, repeat={args.repeat}")
+    print(f"{'boxes':>6} {'loop ms':>9} {'renderer ms':>12} {'batch ms':>9} {'speedup':>8}")
+    for n in [int(b) for b in args.boxes.split(',')]:
+        dets = make_dets(rng, n, args.width, args.height)
+        dets_list = [make_dets(rng, n, args.width, args.height) for _ in range(args.batch)]
+        imgs = [frame.copy() for _ in range(args.batch)]
+        img = frame.copy()
+        loop_ms = measure(lambda: draw_loop(img, dets), args.repeat)
+        renderer_ms = measure(lambda: renderer.draw(img, dets), args.repeat)
+        batch_ms = measure(lambda: renderer.draw_batch(imgs, dets_list), args.repeat) / args.batch
+        print(f"{n:>6} {loop_ms:>9.3f} {renderer_ms:>12.3f} {batch_ms:>9.3f} {loop_ms / renderer_ms:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
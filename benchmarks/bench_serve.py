@@ -0,0 +1,121 @@
+"""
+推論サーバー(-c serve)の負荷試験
+
+同時に複数のクライアントから画像をPOSTし、スループットと遅延のパーセンタイルを計測する。
+--urlを省略した場合は、--onnx_fileのモデルでバッチサイズ1のサーバーと--max_batch_sizeのサーバーを
+このプロセス内で順に起動し、マイクロバッチによるスループットの向上を比較する。
+マイクロバッチの効果はバッチの軸が可変のモデル(--yolox_dynamic_batchで変換)で得られる。
+
+実行方法:
+    python benchmarks/bench_serve.py --onnx_file <ONNXモデルファイルのパス> [--concurrency 16] [--requests 400] [--max_batch_size 8]
+    python benchmarks/bench_serve.py --url http://127.0.0.1:8080 [--concurrency 16] [--requests 400]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from pth2onnx.app import common, server, sessions
+from urllib.parse import urlparse
+import argparse
+import cv2
+import http.client
+import json
+import logging
+import numpy as np
+import threading
+import time
+
+
+def make_image(width:int, height:int) -> bytes:
+    rng = np.random.default_rng(0)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (9, 9), 0)
+    return cv2.imencode('.jpg', img)[1].tobytes()
+
+
+def load(url:str, body:bytes, concurrency:int, requests:int) -> dict:
+    """
+    concurrency個のクライアントで合計requests回の推論を要求し、スループットと遅延を返す。
+    """
+    u = urlparse(url)
+    per_client = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def _client(n:int):
+        conn = http.client.HTTPConnection(u.hostname, u.port, timeout=60)
+        latencies, errors = [], 0
+        for _ in range(n):
+            tm = time.perf_counter()
+            conn.request('POST', '/infer', body=body, headers={'Content-Type':'image/jpeg'})
+            res = conn.getresponse()
+            res.read()
+            if res.status == 200:
+                latencies.append(time.perf_counter() - tm)
+            else:
+                errors += 1
+        conn.close()
+        return latencies, errors
+
+    tm = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(_client, per_client))
+    elapsed = time.perf_counter() - tm
+    latencies = [l for lat, _ in results for l in lat]
+    return dict(requests_per_sec=len(latencies) / elapsed, errors=sum(e for _, e in results),
+                **common.percentiles(latencies, scale=1000, ndigits=2))
+
+
+def metrics(url:str) -> dict:
+    u = urlparse(url)
+    conn = http.client.HTTPConnection(u.hostname, u.port, timeout=10)
+    conn.request('GET', '/metrics')
+    ret = json.loads(conn.getresponse().read())
+    conn.close()
+    return ret
+
+
+def run_local(args, body:bytes, max_batch_size:int) -> tuple:
+    pool = sessions.SessionPool(input_size=args.input_size, batch_size=max_batch_size)
+    ready, stop = threading.Event(), threading.Event()
+    thread = threading.Thread(target=server.serve, args=(pool, {Path(args.onnx_file).stem:args.onnx_file}), daemon=True,
+                              kwargs=dict(port=0, max_batch_size=max_batch_size, max_wait=args.max_wait, max_queue=args.requests,
+                                          score_th=args.score_th, logger=logging.getLogger('bench_serve'), ready=ready, stop=stop))
+    thread.start()
+    ready.wait()
+    url = f"http://{ready.address[0]}:{ready.address[1]}"
+    load(url, body, args.concurrency, max(args.concurrency, args.requests // 10))
+    ret = load(url, body, args.concurrency, args.requests)
+    m = next(iter(metrics(url)['models'].values()))
+    stop.set()
+    thread.join()
+    return ret, m
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator of the inference server.')
+    parser.add_argument('--onnx_file', default=None)
+    parser.add_argument('--url', default=None)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--max_batch_size', type=int, default=8)
+    parser.add_argument('--max_wait', type=float, default=5.0)
+    parser.add_argument('--input_size', type=int, default=416)
+    parser.add_argument('--score_th', type=float, default=0.3)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    args = parser.parse_args()
+    if args.url is None and args.onnx_file is None:
+        parser.error('Please specify --onnx_file or --url.')
+    body = make_image(args.width, args.height)
+    print(f"concurrency={args.concurrency}, requests={args.requests}, image={args.width}x{args.height}")
+    print(f"{'max_batch':>9} {'req/s':>8} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6} {'speedup':>8}  batch_size_histogram")
+    if args.url is not None:
+        ret = load(args.url, body, args.concurrency, args.requests)
+        m = next(iter(metrics(args.url)['models'].values()))
+        rows = [(m['max_batch_size'], ret, m)]
+    else:
+        rows = [(b, *run_local(args, body, b)) for b in sorted({1, args.max_batch_size})]
+    base = rows[0][1]['requests_per_sec']
+    for b, ret, m in rows:
+        print(f"{b:>9} {ret['requests_per_sec']:>8.1f} {ret['mean']:>8.2f} {ret['p50']:>8.2f} {ret['p95']:>8.2f} {ret['p99']:>8.2f} "
+              f"{ret['errors']:>6} {ret['requests_per_sec'] / base:>7.2f}x  {m['batch_size_histogram']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+CLIの起動時間のベンチマーク
+
+pth2onnxのコマンドを新しいプロセスで繰り返し起動し、終了までの時間(最小値と中央値)と、
+python -X importtime で計測したimportの時間、時間のかかったモジュールを出力する。
+-hとオプションの処理だけで終わるコマンドで、numpy、OpenCV、onnxruntimeなどの重いパッケージを
+読み込んでいないことも確認する。いずれかのコマンドの起動時間の最小値が--budget_ms(ミリ秒)を超えるか、
+重いパッケージを読み込んでいた場合は終了コード1で終了する。
+起動時間にはPython自体の起動時間も含まれるため、参考として「python -c pass」の時間も出力する。
+
+実行方法:
+    python benchmarks/bench_startup.py [--repeat 10] [--budget_ms 300] [--top 5]
+"""
+from pathlib import Path
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_MODULES = ('numpy', 'cv2', 'onnxruntime', 'PIL', 'requests', 'pkg_resources', 'yaml')
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def run(argv:list, env:dict) -> tuple:
+    tm = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + argv, env=env, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - tm
+    imports = []
+    for line in proc.stderr.splitlines():
+        m = IMPORTTIME_LINE.match(line)
+        if m:
+            imports.append(dict(module=m.group(4), self_us=int(m.group(1)), cumulative_us=int(m.group(2)), depth=len(m.group(3)) // 2))
+    return elapsed, proc.returncode, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the CLI startup time.')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--budget_ms', type=float, default=300.0)
+    parser.add_argument('--top', type=int, default=5)
+    args = parser.parse_args()
+    root = Path(__file__).resolve().parent.parent
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(root)] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    with tempfile.TemporaryDirectory() as data:
+        cases = [('python -c pass', ['-c', 'pass'], False),
+                 ('pth2onnx -h', ['-m', 'pth2onnx', '-h'], True),
+                 ('pth2onnx (no mode)', ['-m', 'pth2onnx'], True),
+                 ('pth2onnx -c zoo', ['-m', 'pth2onnx', '-m', 'yolox', '-c', 'zoo', '-f', '--data', data], False)]
+        ok = True
+        print(f"{'command':>20} {'min ms':>8} {'median ms':>10} {'import ms':>10} {'budget':>7}  top imports (cumulative ms)")
+        for name, argv, light in cases:
+            times, imports = [], []
+            for _ in range(args.repeat):
+                elapsed, returncode, imports = run(argv, env)
+                if returncode != 0:
+                    print(f"{name}: failed. returncode={returncode}")
+                    ok = False
+                    break
+                times.append(elapsed)
+            if len(times) == 0:
+                continue
+            tops = sorted((i for i in imports if i['depth'] == 0), key=lambda i: i['cumulative_us'], reverse=True)[:args.top]
+            import_ms = sum(i['cumulative_us'] for i in imports if i['depth'] == 0) / 1000
+            within = name.startswith('python') or min(times) * 1000 <= args.budget_ms
+            heavy = sorted({i['module'].split('.')[0] for i in imports} & set(HEAVY_MODULES)) if light else []
+            ok = ok and within and len(heavy) == 0
+            print(f"{name:>20} {min(times) * 1000:>8.1f} {statistics.median(times) * 1000:>10.1f} {import_ms:>10.1f} "
+                  f"{'ok' if within else 'over':>7}  " + ', '.join(f"{i['module']}={i['cumulative_us'] / 1000:.1f}" for i in tops))
+            if heavy:
+                print(f"{'':>20} heavy modules imported: {heavy}")
+    print(f"startup: {'ok' if ok else 'failed'} (budget {args.budget_ms} ms)")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,5 @@
 from pathlib import Path
-from pth2onnx.app import common
-from pth2onnx.app.convert import yolox
+from pth2onnx.app import common, trace
 import argparse
 import os
 import time
@@ -14,20 +13,84 @@ def main():
     parser.add_argument('-f', '--format', help='Setting the cmd format.', action='store_true')
     parser.add_argument('-m', '--mode', help='Setting the boot mode.', choices=['yolox'])
     parser.add_argument('--data', help='Setting the data directory.', default=Path(HOME_DIR) / ".pth2onnx")
-    parser.add_argument('--timeout', help='Setting the cmd timeout.', type=int, default=15)
-    parser.add_argument('-c', '--cmd', help='Setting the cmd type.', choices=['install', 'zoo', 'demo', 'convert', 'inference'])
+    parser.add_argument('--trace', help='Setting the trace output file of the command stages. *.json is Chrome trace format, others are JSON lines.', default=None)
+    parser.add_argument('--timeout', help='Setting the cmd timeout (seconds). Default is no timeout, and 15 seconds for the worker start.', type=int, default=None)
+    parser.add_argument('-c', '--cmd', help='Setting the cmd type.', choices=['install', 'zoo', 'demo', 'convert', 'convert_batch', 'inference', 'worker', 'cache', 'bench', 'verify', 'optimize', 'quantize', 'serve', 'download', 'runs', 'eval'])
+    parser.add_argument('--subcmd', help='Setting the sub command type.', default=None)
     parser.add_argument('--pycmd', help='Setting the python command.', default='python')
     parser.add_argument('--pipcmd', help='Setting the pip command.', default='pip')
+    parser.add_argument('--yolox_lock_file', help='Setting the lock file of install. Default is yolox_requirements.lock in the data dir.', default=None)
+    parser.add_argument('--yolox_wheelhouse', help='Setting the wheel directory of install.', default=None)
+    parser.add_argument('--yolox_offline', help='Install from the wheelhouse without network access.', action='store_true')
+    parser.add_argument('--yolox_backend', help='Setting the backend for demo, convert and inference.', choices=['subprocess', 'worker'], default='subprocess')
     parser.add_argument('--yolox_model_name', help='Setting the model name.', default=None)
-    parser.add_argument('--yolox_weight_file', help='Setting the model weight file in YOLOX dir.', default=None)
+    parser.add_argument('--yolox_weight_file', help='Setting the model weight file in YOLOX dir. An http(s) URL is downloaded into YOLOX dir.', default=None)
+    parser.add_argument('--yolox_url', help='Setting the weight file URL of download. Append #sha256=<hex> to verify the file.', default=None)
+    parser.add_argument('--yolox_sha256', help='Setting the expected SHA-256 of the downloaded file.', default=None)
+    parser.add_argument('--yolox_download_segments', help='Setting the number of parallel range requests of download.', type=int, default=1)
     parser.add_argument('--yolox_input_image', help='Setting the input image file in YOLOX dir.', default='assets/dog.jpg')
-    parser.add_argument('--yolox_model_img_size', help='Setting the input image file in YOLOX dir.', default=416)
+    parser.add_argument('--yolox_model_img_size', help='Setting the model input image size. (demo and inference default: 416, convert default: model default)', type=int, default=None)
+    parser.add_argument('--yolox_model_img_sizes', help='Setting the comma separated model input image sizes exported in one convert run. (e.g. 320,416,640)', default=None)
+    parser.add_argument('--yolox_dynamic_batch', help='Export the onnx model with a dynamic batch axis.', action='store_true')
+    parser.add_argument('--yolox_dynamic_hw', help='Export the onnx model with dynamic input height and width.', action='store_true')
+    parser.add_argument('--yolox_opset', help='Setting the onnx opset version of convert.', type=int, default=11)
+    parser.add_argument('--yolox_no_cache', help='Do not use the convert cache.', action='store_true')
+    parser.add_argument('--yolox_cache_max_size', help='Setting the maximum size (MB) of the convert cache.', type=int, default=4096)
     parser.add_argument('--yolox_class_th', help='Setting the class threshold.', default=0.25)
     parser.add_argument('--yolox_nms_th', help='Setting the nms threshold.', default=0.45)
     parser.add_argument('--yolox_output_preview', help='Setting the output preview.', action='store_true')
     parser.add_argument('--yolox_onnx_file', help='Setting the output onnx weight file.', default=None)
     parser.add_argument('--yolox_output_dir', help='Setting the output inference directory.', default='inference/output')
     parser.add_argument('--yolox_score_th', help='Setting the inference score threshold.', default=0.3)
+    parser.add_argument('--yolox_input_dir', help='Setting the input image directory of inference. Run in pth2onnx process with a pipeline.', default=None)
+    parser.add_argument('--yolox_input_video', help='Setting the input video file or camera index of inference. Run in pth2onnx process with a pipeline.', default=None)
+    parser.add_argument('--yolox_stream', help='Run the video inference in realtime stream mode. Always enabled for a camera.', action='store_true')
+    parser.add_argument('--yolox_target_latency', help='Setting the target latency (ms) per frame of stream mode. Frames older than this are dropped.', type=float, default=None)
+    parser.add_argument('--yolox_max_frames', help='Setting the maximum number of frames to capture in stream mode. 0 is unlimited.', type=int, default=0)
+    parser.add_argument('--yolox_output_jsonl', help='Setting the output detections JSONL file of inference. Default is manifest.jsonl in the run directory.', default=None)
+    parser.add_argument('--yolox_ann_file', help='Setting the COCO format annotation file of eval. The images are read from --yolox_input_dir.', default=None)
+    parser.add_argument('--yolox_eval_score_th', help='Setting the score threshold of eval.', type=float, default=0.01)
+    parser.add_argument('--yolox_eval_nms_th', help='Setting the nms threshold of eval.', type=float, default=0.65)
+    parser.add_argument('--yolox_max_images', help='Setting the maximum number of images of eval. 0 is all.', type=int, default=0)
+    parser.add_argument('--yolox_run_limit', help='Setting the maximum number of runs listed by runs.', type=int, default=20)
+    parser.add_argument('--yolox_batch_size', help='Setting the inference batch size.', type=int, default=1)
+    parser.add_argument('--yolox_intra_op_threads', help='Setting the number of intra-op threads of onnxruntime. 0 is default.', type=int, default=0)
+    parser.add_argument('--yolox_inter_op_threads', help='Setting the number of inter-op threads of onnxruntime. 0 is default.', type=int, default=0)
+    parser.add_argument('--yolox_decode_threads', help='Setting the number of decode threads of the inference pipeline.', type=int, default=2)
+    parser.add_argument('--yolox_encode_threads', help='Setting the number of encode threads of the inference pipeline.', type=int, default=2)
+    parser.add_argument('--yolox_queue_size', help='Setting the queue size between the inference pipeline stages.', type=int, default=16)
+    parser.add_argument('--yolox_verify', help='Verify the onnx outputs against the pytorch model after convert.', action='store_true')
+    parser.add_argument('--yolox_verify_atol', help='Setting the absolute tolerance of the output tensors of verify.', type=float, default=1e-3)
+    parser.add_argument('--yolox_verify_rtol', help='Setting the relative tolerance of the output tensors of verify.', type=float, default=1e-3)
+    parser.add_argument('--yolox_verify_min_agreement', help='Setting the minimum detection agreement of verify.', type=float, default=0.99)
+    parser.add_argument('--yolox_verify_synthetic', help='Setting the number of seeded synthetic images of verify.', type=int, default=4)
+    parser.add_argument('--yolox_optimize', help='Optimize the onnx graph after convert.', action='store_true')
+    parser.add_argument('--yolox_no_onnxsim', help='Do not simplify the onnx graph with onnx-simplifier in optimize.', action='store_true')
+    parser.add_argument('--yolox_ort_format', help='Save the optimized model in ORT format (.ort) instead of .opt.onnx.', action='store_true')
+    parser.add_argument('--yolox_optimize_level', help='Setting the onnxruntime graph optimization level of optimize.', choices=['basic', 'extended', 'all'], default='extended')
+    parser.add_argument('--yolox_quant_mode', help='Setting the quantization mode.', choices=['static', 'dynamic'], default='static')
+    parser.add_argument('--yolox_calib_dir', help='Setting the calibration image directory of quantize.', default=None)
+    parser.add_argument('--yolox_calib_method', help='Setting the calibration method of static quantization.', choices=['minmax', 'entropy', 'percentile'], default='minmax')
+    parser.add_argument('--yolox_calib_size', help='Setting the maximum number of calibration images.', type=int, default=100)
+    parser.add_argument('--yolox_holdout_dir', help='Setting the held-out image directory to compare the quantized model. Default is a part of the calibration images.', default=None)
+    parser.add_argument('--yolox_per_channel', help='Quantize the weights per channel.', action='store_true')
+    parser.add_argument('--yolox_batch_sizes', help='Setting the comma separated batch sizes of bench.', default='1,4,16')
+    parser.add_argument('--yolox_warmup', help='Setting the number of warmup runs of bench.', type=int, default=5)
+    parser.add_argument('--yolox_iterations', help='Setting the number of timed runs of bench.', type=int, default=50)
+    parser.add_argument('--yolox_variant', help='Setting the model variant of zoo query. (e.g. fp32, int8(static))', default=None)
+    parser.add_argument('--yolox_latency_budget', help='Setting the latency budget (ms) of zoo query and fastest.', type=float, default=None)
+    parser.add_argument('--yolox_host', help='Setting the listen address of serve.', default='127.0.0.1')
+    parser.add_argument('--yolox_port', help='Setting the listen port of serve.', type=int, default=8080)
+    parser.add_argument('--yolox_max_batch_size', help='Setting the maximum micro-batch size of serve.', type=int, default=8)
+    parser.add_argument('--yolox_max_wait', help='Setting the maximum wait (ms) to fill a micro-batch of serve.', type=float, default=5.0)
+    parser.add_argument('--yolox_max_queue', help='Setting the maximum number of queued requests of serve.', type=int, default=256)
+    parser.add_argument('--yolox_memory_budget', help='Setting the memory budget (MB) of the loaded models of serve. 0 is unlimited.', type=int, default=0)
+    parser.add_argument('--yolox_sessions_per_model', help='Setting the maximum number of sessions per model of serve.', type=int, default=1)
+    parser.add_argument('--yolox_idle_timeout', help='Setting the idle time (seconds) to evict a session of serve. 0 is never.', type=float, default=0)
+    parser.add_argument('--yolox_max_body_size', help='Setting the maximum request body size (MB) of serve.', type=int, default=16)
+    parser.add_argument('--yolox_manifest', help='Setting the manifest file (YAML/JSON) of models to convert.', default=None)
+    parser.add_argument('--yolox_max_workers', help='Setting the maximum number of parallel convert processes.', type=int, default=None)
+    parser.add_argument('--yolox_worker_mem', help='Setting the estimated memory (MB) per convert process.', type=int, default=2048)
 
     args = parser.parse_args()
     args_dict = vars(args)
@@ -36,18 +99,83 @@ def main():
     mode = common.getopt(opt, 'mode', preval=args_dict, withset=True)
     data = common.getopt(opt, 'data', preval=args_dict, withset=True)
     cmd = common.getopt(opt, 'cmd', preval=args_dict, withset=True)
+    subcmd = common.getopt(opt, 'subcmd', preval=args_dict, withset=True)
+    trace_file = common.getopt(opt, 'trace', preval=args_dict, withset=True)
+    timeout = common.getopt(opt, 'timeout', preval=args_dict, withset=True)
     pycmd = common.getopt(opt, 'pycmd', preval=args_dict, withset=True)
     pipcmd = common.getopt(opt, 'pipcmd', preval=args_dict, withset=True)
+    yolox_lock_file = common.getopt(opt, 'yolox_lock_file', preval=args_dict, withset=True)
+    yolox_wheelhouse = common.getopt(opt, 'yolox_wheelhouse', preval=args_dict, withset=True)
+    yolox_offline = common.getopt(opt, 'yolox_offline', preval=args_dict, withset=True)
+    yolox_backend = common.getopt(opt, 'yolox_backend', preval=args_dict, withset=True)
     yolox_model_name = common.getopt(opt, 'yolox_model_name', preval=args_dict, withset=True)
     yolox_weight_file = common.getopt(opt, 'yolox_weight_file', preval=args_dict, withset=True)
+    yolox_url = common.getopt(opt, 'yolox_url', preval=args_dict, withset=True)
+    yolox_sha256 = common.getopt(opt, 'yolox_sha256', preval=args_dict, withset=True)
+    yolox_download_segments = common.getopt(opt, 'yolox_download_segments', preval=args_dict, withset=True)
     yolox_input_image = common.getopt(opt, 'yolox_input_image', preval=args_dict, withset=True)
     yolox_model_img_size = common.getopt(opt, 'yolox_model_img_size', preval=args_dict, withset=True)
+    yolox_model_img_sizes = common.getopt(opt, 'yolox_model_img_sizes', preval=args_dict, withset=True)
+    yolox_dynamic_batch = common.getopt(opt, 'yolox_dynamic_batch', preval=args_dict, withset=True)
+    yolox_dynamic_hw = common.getopt(opt, 'yolox_dynamic_hw', preval=args_dict, withset=True)
+    yolox_opset = common.getopt(opt, 'yolox_opset', preval=args_dict, withset=True)
+    yolox_no_cache = common.getopt(opt, 'yolox_no_cache', preval=args_dict, withset=True)
+    yolox_cache_max_size = common.getopt(opt, 'yolox_cache_max_size', preval=args_dict, withset=True)
     yolox_class_th = common.getopt(opt, 'yolox_class_th', preval=args_dict, withset=True)
     yolox_nms_th = common.getopt(opt, 'yolox_nms_th', preval=args_dict, withset=True)
     yolox_output_preview = common.getopt(opt, 'yolox_output_preview', preval=args_dict, withset=True)
     yolox_onnx_file = common.getopt(opt, 'yolox_onnx_file', preval=args_dict, withset=True)
     yolox_output_dir = common.getopt(opt, 'yolox_output_dir', preval=args_dict, withset=True)
     yolox_score_th = common.getopt(opt, 'yolox_score_th', preval=args_dict, withset=True)
+    yolox_input_dir = common.getopt(opt, 'yolox_input_dir', preval=args_dict, withset=True)
+    yolox_input_video = common.getopt(opt, 'yolox_input_video', preval=args_dict, withset=True)
+    yolox_stream = common.getopt(opt, 'yolox_stream', preval=args_dict, withset=True)
+    yolox_target_latency = common.getopt(opt, 'yolox_target_latency', preval=args_dict, withset=True)
+    yolox_max_frames = common.getopt(opt, 'yolox_max_frames', preval=args_dict, withset=True)
+    yolox_decode_threads = common.getopt(opt, 'yolox_decode_threads', preval=args_dict, withset=True)
+    yolox_encode_threads = common.getopt(opt, 'yolox_encode_threads', preval=args_dict, withset=True)
+    yolox_queue_size = common.getopt(opt, 'yolox_queue_size', preval=args_dict, withset=True)
+    yolox_output_jsonl = common.getopt(opt, 'yolox_output_jsonl', preval=args_dict, withset=True)
+    yolox_ann_file = common.getopt(opt, 'yolox_ann_file', preval=args_dict, withset=True)
+    yolox_eval_score_th = common.getopt(opt, 'yolox_eval_score_th', preval=args_dict, withset=True)
+    yolox_eval_nms_th = common.getopt(opt, 'yolox_eval_nms_th', preval=args_dict, withset=True)
+    yolox_max_images = common.getopt(opt, 'yolox_max_images', preval=args_dict, withset=True)
+    yolox_run_limit = common.getopt(opt, 'yolox_run_limit', preval=args_dict, withset=True)
+    yolox_batch_size = common.getopt(opt, 'yolox_batch_size', preval=args_dict, withset=True)
+    yolox_intra_op_threads = common.getopt(opt, 'yolox_intra_op_threads', preval=args_dict, withset=True)
+    yolox_inter_op_threads = common.getopt(opt, 'yolox_inter_op_threads', preval=args_dict, withset=True)
+    yolox_verify = common.getopt(opt, 'yolox_verify', preval=args_dict, withset=True)
+    yolox_verify_atol = common.getopt(opt, 'yolox_verify_atol', preval=args_dict, withset=True)
+    yolox_verify_rtol = common.getopt(opt, 'yolox_verify_rtol', preval=args_dict, withset=True)
+    yolox_verify_min_agreement = common.getopt(opt, 'yolox_verify_min_agreement', preval=args_dict, withset=True)
+    yolox_verify_synthetic = common.getopt(opt, 'yolox_verify_synthetic', preval=args_dict, withset=True)
+    yolox_optimize = common.getopt(opt, 'yolox_optimize', preval=args_dict, withset=True)
+    yolox_no_onnxsim = common.getopt(opt, 'yolox_no_onnxsim', preval=args_dict, withset=True)
+    yolox_ort_format = common.getopt(opt, 'yolox_ort_format', preval=args_dict, withset=True)
+    yolox_optimize_level = common.getopt(opt, 'yolox_optimize_level', preval=args_dict, withset=True)
+    yolox_quant_mode = common.getopt(opt, 'yolox_quant_mode', preval=args_dict, withset=True)
+    yolox_calib_dir = common.getopt(opt, 'yolox_calib_dir', preval=args_dict, withset=True)
+    yolox_calib_method = common.getopt(opt, 'yolox_calib_method', preval=args_dict, withset=True)
+    yolox_calib_size = common.getopt(opt, 'yolox_calib_size', preval=args_dict, withset=True)
+    yolox_holdout_dir = common.getopt(opt, 'yolox_holdout_dir', preval=args_dict, withset=True)
+    yolox_per_channel = common.getopt(opt, 'yolox_per_channel', preval=args_dict, withset=True)
+    yolox_batch_sizes = common.getopt(opt, 'yolox_batch_sizes', preval=args_dict, withset=True)
+    yolox_warmup = common.getopt(opt, 'yolox_warmup', preval=args_dict, withset=True)
+    yolox_iterations = common.getopt(opt, 'yolox_iterations', preval=args_dict, withset=True)
+    yolox_variant = common.getopt(opt, 'yolox_variant', preval=args_dict, withset=True)
+    yolox_latency_budget = common.getopt(opt, 'yolox_latency_budget', preval=args_dict, withset=True)
+    yolox_host = common.getopt(opt, 'yolox_host', preval=args_dict, withset=True)
+    yolox_port = common.getopt(opt, 'yolox_port', preval=args_dict, withset=True)
+    yolox_max_batch_size = common.getopt(opt, 'yolox_max_batch_size', preval=args_dict, withset=True)
+    yolox_max_wait = common.getopt(opt, 'yolox_max_wait', preval=args_dict, withset=True)
+    yolox_max_queue = common.getopt(opt, 'yolox_max_queue', preval=args_dict, withset=True)
+    yolox_memory_budget = common.getopt(opt, 'yolox_memory_budget', preval=args_dict, withset=True)
+    yolox_sessions_per_model = common.getopt(opt, 'yolox_sessions_per_model', preval=args_dict, withset=True)
+    yolox_idle_timeout = common.getopt(opt, 'yolox_idle_timeout', preval=args_dict, withset=True)
+    yolox_max_body_size = common.getopt(opt, 'yolox_max_body_size', preval=args_dict, withset=True)
+    yolox_manifest = common.getopt(opt, 'yolox_manifest', preval=args_dict, withset=True)
+    yolox_max_workers = common.getopt(opt, 'yolox_max_workers', preval=args_dict, withset=True)
+    yolox_worker_mem = common.getopt(opt, 'yolox_worker_mem', preval=args_dict, withset=True)
 
     tm = time.time()
 
@@ -57,28 +185,118 @@ def main():
             exit(1)
         common.saveopt(opt, args.useopt)
 
+    if trace_file is not None:
+        trace.start(trace_file, name='main', mode=mode, cmd=cmd, subcmd=subcmd)
+
     if mode == 'yolox':
-        logger, _ = common.load_config(mode)
-        y = yolox.Yolox(logger)
+        # onnxruntimeやOpenCVの読み込みは時間がかかるため、-hやオプションの処理だけの場合は読み込まない
+        from pth2onnx.app.convert import yolox
+        logger, config = common.load_config(mode)
+        verify_opts = dict(input_image=yolox_input_image, num_synthetic=yolox_verify_synthetic, atol=yolox_verify_atol, rtol=yolox_verify_rtol,
+                           min_agreement=yolox_verify_min_agreement, score_th=yolox_score_th, nms_th=yolox_nms_th)
+        optimize_opts = dict(use_simplify=not yolox_no_onnxsim, ort_format=yolox_ort_format, level=yolox_optimize_level)
+        y = yolox.Yolox(logger, data=data, backend=yolox_backend, cache_max_size=yolox_cache_max_size, timeout=timeout,
+                        download_segments=yolox_download_segments)
         if cmd == 'install':
-            ret = y.install(pycmd=pycmd, pipcmd=pipcmd)
+            ret = y.install(pycmd=pycmd, pipcmd=pipcmd, subcmd=subcmd, lock_file=yolox_lock_file, wheelhouse=yolox_wheelhouse,
+                            offline=yolox_offline)
             common.print_format(ret, format, tm)
 
         elif cmd == 'zoo':
-            ret = y.zoo()
+            ret = y.zoo(subcmd=subcmd, model_name=yolox_model_name, img_size=yolox_model_img_size, variant=yolox_variant,
+                        latency_budget=yolox_latency_budget, onnx_file=yolox_onnx_file)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'download':
+            ret = y.download(url=yolox_url, weight_file=yolox_weight_file, sha256=yolox_sha256)
             common.print_format(ret, format, tm)
 
         elif cmd == 'demo':
-            ret = y.demo(model_name=yolox_model_name, weight_file=yolox_weight_file, input_image=yolox_input_image, model_img_size=yolox_model_img_size,
+            ret = y.demo(model_name=yolox_model_name, weight_file=yolox_weight_file, input_image=yolox_input_image, model_img_size=yolox_model_img_size or 416,
                          clsth=yolox_class_th, nms=yolox_nms_th, output_preview=yolox_output_preview, pycmd=pycmd)
             common.print_format(ret, format, tm)
 
         elif cmd == 'convert':
-            ret = y.convert(model_name=yolox_model_name, weight_file=yolox_weight_file, output_file=yolox_onnx_file)
+            ret = y.convert(model_name=yolox_model_name, weight_file=yolox_weight_file, output_file=yolox_onnx_file,
+                            model_img_size=yolox_model_img_size, opset=yolox_opset, use_cache=not yolox_no_cache,
+                            verify=verify_opts if yolox_verify else None, optimize=optimize_opts if yolox_optimize else None,
+                            img_sizes=[int(v) for v in str(yolox_model_img_sizes).split(',') if v.strip()] if yolox_model_img_sizes else None,
+                            dynamic_batch=yolox_dynamic_batch, dynamic_hw=yolox_dynamic_hw, pycmd=pycmd)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'convert_batch':
+            ret = y.convert_batch(manifest_file=yolox_manifest, max_workers=yolox_max_workers, worker_mem=yolox_worker_mem,
+                                  opset=yolox_opset, use_cache=not yolox_no_cache, verify=verify_opts if yolox_verify else None,
+                                  optimize=optimize_opts if yolox_optimize else None, dynamic_batch=yolox_dynamic_batch,
+                                  dynamic_hw=yolox_dynamic_hw, pycmd=pycmd)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'inference' and yolox_input_video is not None and (yolox_stream or str(yolox_input_video).isdigit()):
+            ret = y.inference_stream(onnx_file=yolox_onnx_file, input_video=yolox_input_video, output_jsonl=yolox_output_jsonl, output_dir=yolox_output_dir,
+                                     score_th=yolox_score_th, nms_th=yolox_nms_th, input_size=yolox_model_img_size or 416,
+                                     target_latency=yolox_target_latency, max_frames=yolox_max_frames, intra_op_threads=yolox_intra_op_threads,
+                                     inter_op_threads=yolox_inter_op_threads, output_preview=yolox_output_preview)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'inference' and (yolox_input_dir is not None or yolox_input_video is not None):
+            ret = y.inference_native(onnx_file=yolox_onnx_file, input_dir=yolox_input_dir, input_video=yolox_input_video, output_jsonl=yolox_output_jsonl,
+                                     output_dir=yolox_output_dir, score_th=yolox_score_th, nms_th=yolox_nms_th, input_size=yolox_model_img_size or 416,
+                                     batch_size=yolox_batch_size, intra_op_threads=yolox_intra_op_threads, inter_op_threads=yolox_inter_op_threads,
+                                     decode_threads=yolox_decode_threads, encode_threads=yolox_encode_threads, queue_size=yolox_queue_size)
             common.print_format(ret, format, tm)
 
         elif cmd == 'inference':
-            ret = y.inference(onnx_file=yolox_onnx_file, input_image=yolox_input_image, output_dir=yolox_output_dir, score_th=yolox_score_th, input_size=yolox_model_img_size, output_preview=yolox_output_preview, pycmd=pycmd)
+            ret = y.inference(onnx_file=yolox_onnx_file, input_image=yolox_input_image, output_dir=yolox_output_dir, score_th=yolox_score_th, input_size=yolox_model_img_size or 416, output_preview=yolox_output_preview, pycmd=pycmd)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'quantize':
+            ret = y.quantize(onnx_file=yolox_onnx_file, calib_dir=yolox_calib_dir, holdout_dir=yolox_holdout_dir, mode=yolox_quant_mode,
+                             calib_method=yolox_calib_method, calib_size=yolox_calib_size, per_channel=yolox_per_channel,
+                             input_size=yolox_model_img_size or 416, score_th=yolox_score_th, nms_th=yolox_nms_th)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'optimize':
+            ret = y.optimize(onnx_file=yolox_onnx_file, **optimize_opts)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'verify':
+            ret = y.verify(model_name=yolox_model_name, weight_file=yolox_weight_file, onnx_file=yolox_onnx_file,
+                           model_img_size=yolox_model_img_size, **verify_opts)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'bench':
+            ret = y.bench(model_name=yolox_model_name, weight_file=yolox_weight_file, onnx_file=yolox_onnx_file, img_size=yolox_model_img_size,
+                          batch_sizes=[int(b) for b in str(yolox_batch_sizes).split(',') if b.strip()], warmup=yolox_warmup,
+                          iterations=yolox_iterations, threads=yolox_intra_op_threads)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'serve':
+            ret = y.serve(onnx_file=yolox_onnx_file, host=yolox_host, port=yolox_port, max_batch_size=yolox_max_batch_size,
+                          max_wait=yolox_max_wait, max_queue=yolox_max_queue, score_th=yolox_score_th, nms_th=yolox_nms_th,
+                          input_size=yolox_model_img_size or 416, intra_op_threads=yolox_intra_op_threads,
+                          inter_op_threads=yolox_inter_op_threads, boot_path=config['pth2onnx']['common']['boot_path'],
+                          memory_budget=yolox_memory_budget, sessions_per_model=yolox_sessions_per_model, idle_timeout=yolox_idle_timeout,
+                          max_body_size=yolox_max_body_size)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'cache':
+            ret = y.cache(subcmd=subcmd)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'eval':
+            ret = y.eval(onnx_file=yolox_onnx_file, ann_file=yolox_ann_file, image_dir=yolox_input_dir, output_dir=yolox_output_dir,
+                         input_size=yolox_model_img_size or 416, batch_size=yolox_batch_size, score_th=yolox_eval_score_th,
+                         nms_th=yolox_eval_nms_th, max_images=yolox_max_images, intra_op_threads=yolox_intra_op_threads,
+                         inter_op_threads=yolox_inter_op_threads, decode_threads=yolox_decode_threads,
+                         encode_threads=yolox_encode_threads, queue_size=yolox_queue_size)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'runs':
+            ret = y.runs(subcmd=subcmd, input_image=yolox_input_image if subcmd == 'find' else None, limit=yolox_run_limit)
+            common.print_format(ret, format, tm)
+
+        elif cmd == 'worker':
+            ret = y.worker(subcmd=subcmd, timeout=timeout)
             common.print_format(ret, format, tm)
 
         else:
@@ -88,3 +306,5 @@ def main():
     else:
         parser.print_help()
 
+    trace.stop()
+
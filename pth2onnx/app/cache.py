@@ -0,0 +1,205 @@
+from pathlib import Path
+from pth2onnx.app import common
+from typing import List
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+
+CACHE_VERSION = 1
+
+def sha256_file(file_path:Path, chunk_size:int=1024 * 1024) -> str:
+    """
+    ファイルを先頭から順に読み込みながらSHA-256を計算します。
+
+    Args:
+        file_path (Path): ファイルのパス
+        chunk_size (int, optional): 一度に読み込むバイト数. Defaults to 1MB.
+
+    Returns:
+        str: SHA-256の16進文字列
+    """
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def remove_file(file_path:Path) -> None:
+    """
+    ファイルが存在すれば削除します。読み取り専用のファイルも削除します。
+
+    Args:
+        file_path (Path): ファイルのパス
+    """
+    file_path = Path(file_path)
+    if not file_path.exists() and not file_path.is_symlink():
+        return
+    if not file_path.is_symlink():
+        os.chmod(file_path, stat.S_IREAD | stat.S_IWRITE)
+    file_path.unlink()
+
+
+class ConvertCache(object):
+    def __init__(self, logger:logging.Logger, data:Path, max_size:int=4096):
+        """
+        変換結果のONNXファイルを保存するキャッシュのコンストラクタ。
+        キャッシュは重みファイルのハッシュと変換オプションから求めたキーで管理され、
+        合計サイズが上限を超えると最後に使用された日時が古いものから削除されます。
+
+        Args:
+            logger (logging.Logger): ロガー
+            data (Path): データディレクトリのパス
+            max_size (int, optional): キャッシュの合計サイズの上限(MB). Defaults to 4096.
+        """
+        self.logger = logger
+        self.cache_dir = Path(data) / 'cache' / 'convert'
+        self.index_file = self.cache_dir / 'index.json'
+        self.max_size = int(max_size) * 1024 * 1024
+        self.lock = threading.Lock()
+
+    def key(self, weight_sha256:str, model_name:str, model_img_size:int=None, opset:int=11, commit:str=None, **options) -> str:
+        """
+        キャッシュのキーを求めます。
+
+        Args:
+            weight_sha256 (str): 重みファイルのSHA-256。sha256_fileで求めた値
+            model_name (str): モデル名
+            model_img_size (int, optional): エクスポート時の入力サイズ. Defaults to None.
+            opset (int, optional): ONNXのopsetバージョン. Defaults to 11.
+            commit (str, optional): YOLOXのコミットID. Defaults to None.
+            **options: その他の変換オプション。値が偽のオプションはキーに含めません
+
+        Returns:
+            str: キャッシュのキー
+        """
+        opts = dict(version=CACHE_VERSION, weight=weight_sha256, model_name=model_name,
+                    model_img_size=model_img_size, opset=opset, commit=commit, **{k:v for k, v in options.items() if v})
+        return hashlib.sha256(json.dumps(opts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _load_index(self) -> dict:
+        if not self.index_file.exists():
+            return dict()
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError:
+            self.logger.warning(f"Cache index is broken. Recreate it. ({self.index_file})")
+            return dict()
+
+    def _save_index(self, index:dict):
+        common.mkdirs(self.cache_dir)
+        tmp_file = self.index_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp_file, self.index_file)
+
+    def _entry_file(self, key:str) -> Path:
+        return self.cache_dir / f"{key}.onnx"
+
+    def get(self, key:str, output_file:Path) -> bool:
+        """
+        キャッシュにキーが存在すれば、ONNXファイルをハードリンクまたはコピーで出力先に配置します。
+
+        Args:
+            key (str): キャッシュのキー
+            output_file (Path): 出力先のファイルパス
+
+        Returns:
+            bool: キャッシュにヒットした場合はTrue
+        """
+        with self.lock:
+            index = self._load_index()
+            entry_file = self._entry_file(key)
+            if key not in index or not entry_file.exists():
+                return False
+            output_file = Path(output_file)
+            common.mkdirs(output_file.parent)
+            if output_file.exists() and os.path.samefile(output_file, entry_file):
+                pass
+            else:
+                remove_file(output_file)
+                try:
+                    os.link(entry_file, output_file)
+                except OSError:
+                    shutil.copyfile(entry_file, output_file)
+            index[key]['last_access'] = time.time()
+            index[key]['hits'] = index[key].get('hits', 0) + 1
+            self._save_index(index)
+            return True
+
+    def put(self, key:str, onnx_file:Path, **meta) -> None:
+        """
+        ONNXファイルをキャッシュに保存し、合計サイズが上限を超えた場合は古いものから削除します。
+        キャッシュのファイルはハードリンクで共有されるため読み取り専用にします。
+
+        Args:
+            key (str): キャッシュのキー
+            onnx_file (Path): 保存するONNXファイルのパス
+            **meta: インデックスに記録する付加情報
+        """
+        with self.lock:
+            common.mkdirs(self.cache_dir)
+            entry_file = self._entry_file(key)
+            tmp_file = entry_file.with_suffix(f".{os.getpid()}.tmp")
+            shutil.copyfile(onnx_file, tmp_file)
+            os.chmod(tmp_file, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+            remove_file(entry_file)
+            os.replace(tmp_file, entry_file)
+            index = self._load_index()
+            now = time.time()
+            index[key] = dict(size=entry_file.stat().st_size, created=now, last_access=now, hits=0,
+                              **{k:str(v) if isinstance(v, Path) else v for k, v in meta.items()})
+            self._evict(index, self.max_size)
+            self._save_index(index)
+
+    def _evict(self, index:dict, max_size:int) -> List[str]:
+        total = sum(e['size'] for e in index.values())
+        evicted = []
+        for key in sorted(index.keys(), key=lambda k: index[k]['last_access']):
+            if total <= max_size:
+                break
+            entry_file = self._entry_file(key)
+            remove_file(entry_file)
+            total -= index[key]['size']
+            del index[key]
+            evicted.append(key)
+            self.logger.info(f"Cache evicted. key={key}")
+        return evicted
+
+    def list(self) -> List[dict]:
+        """
+        キャッシュのエントリを最後に使用された日時の新しい順に返します。
+
+        Returns:
+            List[dict]: キャッシュのエントリのリスト
+        """
+        with self.lock:
+            index = self._load_index()
+        ret = []
+        for key in sorted(index.keys(), key=lambda k: index[k]['last_access'], reverse=True):
+            e = index[key]
+            ret.append(dict(key=key[:16], model_name=e.get('model_name'), model_img_size=e.get('model_img_size'),
+                            opset=e.get('opset'), size=e['size'], hits=e.get('hits', 0),
+                            last_access=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e['last_access']))))
+        return ret
+
+    def prune(self, max_size:int=None) -> List[str]:
+        """
+        キャッシュの合計サイズが上限以下になるまで古いエントリを削除します。
+
+        Args:
+            max_size (int, optional): 合計サイズの上限(MB)。省略時はコンストラクタで指定した上限. Defaults to None.
+
+        Returns:
+            List[str]: 削除したエントリのキーのリスト
+        """
+        with self.lock:
+            index = self._load_index()
+            evicted = self._evict(index, self.max_size if max_size is None else int(max_size) * 1024 * 1024)
+            self._save_index(index)
+            return evicted
@@ -0,0 +1,224 @@
+from typing import List, Tuple, Union
+import base64
+import numpy as np
+import struct
+
+ARRAY_MAGIC = b'PTNA'
+BATCH_MAGIC = b'PTNB'
+VERSION = 1
+ALIGN = 64
+COMPRESSIONS = {None:0, 'lz4':1, 'zstd':2}
+CONTENT_TYPE = 'application/x-pth2onnx-array'
+_HEADER = struct.Struct('<4sBBBBIQQ')
+_BATCH_HEADER = struct.Struct('<4sBxxxI')
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+def _compressor(name:str):
+    try:
+        if name == 'lz4':
+            import lz4.frame
+            return lz4.frame
+        if name == 'zstd':
+            import zstandard
+            return zstandard
+    except ImportError:
+        raise ValueError(f"Compression module is not installed. ({name}) Please install {'lz4' if name == 'lz4' else 'zstandard'}.")
+    raise ValueError(f"Unknown compression. ({name})")
+
+def _compress(name:str, data:memoryview, level:int=None) -> bytes:
+    mod = _compressor(name)
+    if name == 'lz4':
+        return mod.compress(data, compression_level=level or 0)
+    return mod.ZstdCompressor(level=level or 3).compress(data)
+
+def _decompress(name:str, data:memoryview, size:int) -> bytes:
+    mod = _compressor(name)
+    if name == 'lz4':
+        return mod.decompress(data)
+    return mod.ZstdDecompressor().decompress(data, max_output_size=size)
+
+def _padding(size:int) -> int:
+    return -size % ALIGN
+
+def encode_parts(arr:np.ndarray, compression:str=None, level:int=None) -> List[Buffer]:
+    """
+    ndarrayをヘッダーとデータのバッファのリストにエンコードします。
+    C順またはFortran順で連続した配列はデータをコピーせずにmemoryviewとして返すため、ソケットやファイルに順に書き込めます。
+
+    Args:
+        arr (np.ndarray): ndarray。object型は扱えません
+        compression (str, optional): 'lz4'または'zstd'。Noneは圧縮しない. Defaults to None.
+        level (int, optional): 圧縮レベル。Noneは各形式の既定値. Defaults to None.
+
+    Returns:
+        List[Buffer]: ヘッダー、データ、次のフレームの位置を揃えるパディングのリスト
+    """
+    arr = np.asarray(arr)
+    if arr.dtype.hasobject or arr.dtype.names is not None:
+        raise ValueError(f"Object and structured arrays are not supported. ({arr.dtype})")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression. ({compression})")
+    if not (arr.flags.c_contiguous or arr.flags.f_contiguous):
+        arr = np.ascontiguousarray(arr)
+    data = memoryview(arr.reshape(-1, order='A').view(np.uint8)) if arr.size > 0 else memoryview(b'')
+    if arr.nbytes == 0:
+        compression = None
+    payload = _compress(compression, data, level) if compression is not None else data
+    dtype = arr.dtype.str.encode('ascii')
+    meta = dtype + struct.pack(f"<{arr.ndim}Q{arr.ndim}q", *arr.shape, *arr.strides)
+    header_len = _HEADER.size + len(meta)
+    header_len += _padding(header_len)
+    header = _HEADER.pack(ARRAY_MAGIC, VERSION, COMPRESSIONS[compression], arr.ndim, len(dtype), header_len, arr.nbytes, len(payload))
+    header += meta + bytes(header_len - _HEADER.size - len(meta))
+    return [header, payload, bytes(_padding(len(payload)))]
+
+def encode(arr:np.ndarray, compression:str=None, level:int=None) -> bytes:
+    """
+    ndarrayをdtype、形状、ストライド、圧縮形式を含むヘッダー付きのバイト列にエンコードします。
+
+    Args:
+        arr (np.ndarray): ndarray
+        compression (str, optional): 'lz4'または'zstd'。Noneは圧縮しない. Defaults to None.
+        level (int, optional): 圧縮レベル. Defaults to None.
+
+    Returns:
+        bytes: エンコードしたバイト列
+    """
+    return b''.join(encode_parts(arr, compression=compression, level=level))
+
+def decode_from(buf:Buffer, offset:int=0, copy:bool=False) -> Tuple[np.ndarray, int]:
+    """
+    バッファのoffsetの位置からndarrayを1つデコードします。
+    圧縮していない場合はバッファをコピーせずに参照する配列を返すため、バッファが読み取り専用なら配列も読み取り専用です。
+
+    Args:
+        buf (Buffer): エンコードしたバイト列
+        offset (int, optional): デコードを始める位置. Defaults to 0.
+        copy (bool, optional): バッファを参照せずにコピーした配列を返すかどうか. Defaults to False.
+
+    Returns:
+        Tuple[np.ndarray, int]: デコードした配列と次のフレームの位置
+    """
+    mv = memoryview(buf).cast('B')
+    if len(mv) - offset < _HEADER.size:
+        raise ValueError(f"Buffer too short for an array header.")
+    magic, version, comp, ndim, dtype_len, header_len, nbytes, payload_len = _HEADER.unpack_from(mv, offset)
+    if magic != ARRAY_MAGIC:
+        raise ValueError(f"Invalid array magic. ({bytes(magic)})")
+    if version > VERSION:
+        raise ValueError(f"Unsupported array codec version. ({version})")
+    pos = offset + _HEADER.size
+    dtype = np.dtype(bytes(mv[pos:pos + dtype_len]).decode('ascii'))
+    pos += dtype_len
+    dims = struct.unpack_from(f"<{ndim}Q{ndim}q", mv, pos)
+    shape, strides = dims[:ndim], dims[ndim:]
+    start = offset + header_len
+    end = start + payload_len
+    if end > len(mv):
+        raise ValueError(f"Buffer too short for the array data. ({len(mv)} < {end})")
+    data = mv[start:end]
+    if comp != 0:
+        name = next(k for k, v in COMPRESSIONS.items() if v == comp)
+        data = _decompress(name, data, nbytes)
+    if len(data) != nbytes:
+        raise ValueError(f"Array data size mismatch. ({len(data)} != {nbytes})")
+    arr = np.ndarray(shape, dtype=dtype, buffer=data, strides=strides) if nbytes > 0 else np.empty(shape, dtype=dtype)
+    return (arr.copy(order='K') if copy and comp == 0 else arr), end + _padding(payload_len)
+
+def decode(buf:Buffer, copy:bool=False) -> np.ndarray:
+    """
+    encodeでエンコードしたバイト列をndarrayにデコードします。
+
+    Args:
+        buf (Buffer): エンコードしたバイト列
+        copy (bool, optional): バッファを参照せずにコピーした配列を返すかどうか. Defaults to False.
+
+    Returns:
+        np.ndarray: デコードした配列
+    """
+    return decode_from(buf, copy=copy)[0]
+
+def encode_batch_parts(arrays:List[np.ndarray], compression:str=None, level:int=None) -> List[Buffer]:
+    """
+    ndarrayのリストを件数のヘッダーと配列ごとのフレームのバッファのリストにエンコードします。
+
+    Args:
+        arrays (List[np.ndarray]): ndarrayのリスト。形状やdtypeが異なっていても構いません
+        compression (str, optional): 'lz4'または'zstd'。配列ごとに圧縮します. Defaults to None.
+        level (int, optional): 圧縮レベル. Defaults to None.
+
+    Returns:
+        List[Buffer]: エンコードしたバッファのリスト
+    """
+    parts = [_BATCH_HEADER.pack(BATCH_MAGIC, VERSION, len(arrays))]
+    parts.append(bytes(_padding(_BATCH_HEADER.size)))
+    for arr in arrays:
+        parts += encode_parts(arr, compression=compression, level=level)
+    return parts
+
+def encode_batch(arrays:List[np.ndarray], compression:str=None, level:int=None) -> bytes:
+    """
+    ndarrayのリストを1つのバイト列にエンコードします。
+
+    Args:
+        arrays (List[np.ndarray]): ndarrayのリスト
+        compression (str, optional): 'lz4'または'zstd'. Defaults to None.
+        level (int, optional): 圧縮レベル. Defaults to None.
+
+    Returns:
+        bytes: エンコードしたバイト列
+    """
+    return b''.join(encode_batch_parts(arrays, compression=compression, level=level))
+
+def decode_batch(buf:Buffer, copy:bool=False) -> List[np.ndarray]:
+    """
+    encode_batchでエンコードしたバイト列をndarrayのリストにデコードします。
+
+    Args:
+        buf (Buffer): エンコードしたバイト列
+        copy (bool, optional): バッファを参照せずにコピーした配列を返すかどうか. Defaults to False.
+
+    Returns:
+        List[np.ndarray]: デコードした配列のリスト
+    """
+    mv = memoryview(buf).cast('B')
+    if len(mv) < _BATCH_HEADER.size:
+        raise ValueError(f"Buffer too short for a batch header.")
+    magic, version, count = _BATCH_HEADER.unpack_from(mv, 0)
+    if magic != BATCH_MAGIC:
+        raise ValueError(f"Invalid batch magic. ({bytes(magic)})")
+    if version > VERSION:
+        raise ValueError(f"Unsupported array codec version. ({version})")
+    offset = _BATCH_HEADER.size + _padding(_BATCH_HEADER.size)
+    arrays = []
+    for _ in range(count):
+        arr, offset = decode_from(mv, offset, copy=copy)
+        arrays.append(arr)
+    return arrays
+
+def to_b64(arr:np.ndarray, compression:str=None) -> str:
+    """
+    JSONのようにバイナリを扱えない経路のために、エンコードしたバイト列をBase64の文字列にします。
+    common.npy2b64strと異なり、dtypeと形状もデコードできます。
+
+    Args:
+        arr (np.ndarray): ndarray
+        compression (str, optional): 'lz4'または'zstd'. Defaults to None.
+
+    Returns:
+        str: Base64の文字列
+    """
+    return base64.b64encode(encode(arr, compression=compression)).decode('ascii')
+
+def from_b64(b64str:str) -> np.ndarray:
+    """
+    to_b64でエンコードした文字列をndarrayにデコードします。
+
+    Args:
+        b64str (str): Base64の文字列
+
+    Returns:
+        np.ndarray: デコードした配列
+    """
+    return decode(base64.b64decode(b64str))
@@ -1,22 +1,20 @@
+# numpy、PIL、requests、yamlなどの読み込みに時間のかかるパッケージは、起動を速くするために使う関数の中でimportする
+from __future__ import annotations
 from io import BytesIO
 from pathlib import Path
-from PIL import Image, ImageDraw
-from pkg_resources import resource_string
-from tabulate import tabulate
-from typing import List
+from typing import TYPE_CHECKING, List
 import base64
 import json
 import logging
-import logging.config
-import numpy as np
 import os
 import random
-import requests
 import shutil
 import string
-import subprocess
 import time
-import yaml
+
+if TYPE_CHECKING:
+    from PIL import Image
+    import numpy as np
 
 APP_ID = 'pth2onnx'
 
@@ -31,12 +29,29 @@ def load_config(mode:str):
         logger (logging.Logger): ロガー
         config (dict): 設定
     """
-    log_config = yaml.safe_load(resource_string(APP_ID, "logconf.yml"))
+    import logging.config
+    import yaml
+    log_config = yaml.safe_load(resource_bytes("logconf.yml"))
     logging.config.dictConfig(log_config)
     logger = logging.getLogger(mode)
-    config = yaml.safe_load(resource_string(APP_ID, "config.yml"))
+    config = yaml.safe_load(resource_bytes("config.yml"))
     return logger, config
 
+def resource_bytes(name:str) -> bytes:
+    """
+    パッケージに同梱したファイルを読み込みます。
+
+    Args:
+        name (str): ファイル名
+
+    Returns:
+        bytes: ファイルの内容
+    """
+    from importlib import resources
+    if hasattr(resources, 'files'):
+        return resources.files(APP_ID).joinpath(name).read_bytes()
+    return resources.read_binary(APP_ID, name)
+
 def saveopt(opt:dict, opt_path:Path):
     """
     コマンドラインオプションをJSON形式でファイルに保存します。
@@ -136,6 +151,68 @@ def random_string(size:int=16):
     """
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=size))
 
+def available_memory() -> int:
+    """
+    利用可能な物理メモリのバイト数を取得します。
+    取得できない場合はNoneを返します。
+
+    Returns:
+        int: 利用可能な物理メモリのバイト数
+    """
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        pass
+    return None
+
+def max_workers(mem_per_worker:int, max_count:int=None) -> int:
+    """
+    CPUコア数と利用可能なメモリから同時に実行できるワーカー数を求めます。
+
+    Args:
+        mem_per_worker (int): 1ワーカーあたりに必要なメモリのバイト数
+        max_count (int, optional): ワーカー数の上限. Defaults to None.
+
+    Returns:
+        int: ワーカー数
+    """
+    workers = os.cpu_count() or 1
+    mem = available_memory()
+    if mem is not None and mem_per_worker > 0:
+        workers = min(workers, mem // mem_per_worker)
+    if max_count is not None and max_count > 0:
+        workers = min(workers, max_count)
+    return max(1, int(workers))
+
+def load_manifest(manifest_path:Path) -> List[dict]:
+    """
+    YAMLまたはJSON形式のマニフェストファイルを読み込みます。
+    マニフェストはエントリのリスト、または'models'キーにエントリのリストを持つ辞書です。
+
+    Args:
+        manifest_path (Path): マニフェストファイルのパス
+
+    Returns:
+        List[dict]: マニフェストのエントリのリスト
+    """
+    import yaml
+    manifest_path = Path(manifest_path)
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        if manifest_path.suffix.lower() == '.json':
+            manifest = json.load(f)
+        else:
+            manifest = yaml.safe_load(f)
+    if isinstance(manifest, dict):
+        manifest = manifest.get('models', [])
+    if not isinstance(manifest, list):
+        raise ValueError(f"Invalid manifest format.({str(manifest_path)})")
+    return manifest
+
 def print_format(data:dict, format:bool, tm:float):
     """
     データを指定されたフォーマットで出力します。
@@ -145,6 +222,7 @@ def print_format(data:dict, format:bool, tm:float):
         format (bool): フォーマットするかどうか
         tm (float): 処理時間
     """
+    from tabulate import tabulate
     if format:
         if 'success' in data and type(data['success']) == list:
             print(tabulate(data['success'], headers='keys'))
@@ -158,6 +236,28 @@ def print_format(data:dict, format:bool, tm:float):
     else:
         print(data)
 
+def percentiles(values:List[float], ps:List[int]=[50, 95, 99], scale:float=1.0, ndigits:int=3) -> dict:
+    """
+    値のリストから平均値と指定したパーセンタイルを求めます。
+
+    Args:
+        values (List[float]): 値のリスト
+        ps (List[int], optional): 求めるパーセンタイル. Defaults to [50, 95, 99].
+        scale (float, optional): 結果に掛ける倍率. Defaults to 1.0.
+        ndigits (int, optional): 結果を丸める小数点以下の桁数. Defaults to 3.
+
+    Returns:
+        dict: mean, p50, p95, p99 などをキーに持つ辞書。値が空の場合はすべてNone
+    """
+    import numpy as np
+    if values is None or len(values) == 0:
+        return dict(mean=None, **{f"p{p}":None for p in ps})
+    arr = np.asarray(values, dtype=np.float64) * scale
+    ret = dict(mean=round(float(arr.mean()), ndigits))
+    for p, v in zip(ps, np.percentile(arr, ps)):
+        ret[f"p{p}"] = round(float(v), ndigits)
+    return ret
+
 BASE_MODELS = dict(
     Classification_EfficientNet_Lite4=dict(
         site='https://github.com/onnx/models/tree/main/vision/classification/efficientnet-lite4',
@@ -181,67 +281,53 @@ BASE_MODELS = dict(
     )
 )
 
-def download_file(url:str, save_path:Path):
+def download_file(url:str, save_path:Path, sha256:str=None, data:Path=None, segments:int=1):
     """
     ファイルをダウンロードします。
+    ファイルは少しずつ書き込みながらダウンロードし、データディレクトリのキャッシュを経由して保存先に配置します。
+    中断した場合は次回に続きからダウンロードします。
 
     Args:
         url (str): ダウンロードするファイルのURL
         save_path (Path): 保存先のファイルパス
+        sha256 (str, optional): 期待するSHA-256の16進文字列。一致しない場合はValueError. Defaults to None.
+        data (Path, optional): データディレクトリのパス。Noneの場合は~/.pth2onnx. Defaults to None.
+        segments (int, optional): 並行してダウンロードする区間の数. Defaults to 1.
 
     Returns:
         Path: 保存したファイルのパス
     """
-    r = requests.get(url, stream=True)
-    with open(save_path, 'wb') as f:
-        f.write(r.content)
+    from pth2onnx.app import download
+    data = data if data is not None else Path(os.path.expanduser("~")) / ".pth2onnx"
+    download.download(url, data, sha256=sha256, output_file=save_path, segments=segments)
     return save_path
 
-def cmd(cmd:str, logger:logging.Logger, cwd:Path=Path('.'), outlog:bool=True):
-    """
-    コマンドを実行します。
-
-    Args:
-        cmd (str): 実行するコマンド
-        logger (logging.Logger): ロガー
-        cwd (Path, optional): 実行するディレクトリ. Defaults to '.'.
-        outlog (bool, optional): 出力をログに出力するかどうか. Defaults to True.
-
-    Returns:
-        Tuple[int, str]: コマンドの戻り値と出力
-    """
-    if outlog: logger.debug(f"cmd:{cmd}")
-    proc = subprocess.Popen(cmd, shell=True, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    output = None
-    while proc.returncode is None:
-        out = proc.stdout.readline()
-        if out == b'' and proc.poll() is not None:
-            break
-        for enc in ['utf-8', 'cp932', 'utf-16', 'utf-16-le', 'utf-16-be']:
-            try:
-                output = out.decode(enc).rstrip()
-                if outlog: logger.debug(f"output:{output}")
-                break
-            except UnicodeDecodeError:
-                pass
-
-    return proc.returncode, output
-
-def find_max_update_file(dir_path:Path, glob:str) -> Path:
+def git_head(repo_dir:Path) -> str:
     """
-    指定されたディレクトリ内のファイルの中で最も更新日時が新しいファイルを返します。
+    gitリポジトリのHEADのコミットIDを.gitディレクトリから直接読み取ります。
+    取得できない場合はNoneを返します。
 
     Args:
-        dir_path (Path): ディレクトリのパス
-        glob (str): ファイルのパターン
+        repo_dir (Path): リポジトリのディレクトリのパス
 
     Returns:
-        Path: 最も更新日時が新しいファイルのパス
-    """
-    files = list(dir_path.glob(glob))
-    file_updates = {fpath: os.stat(fpath).st_mtime for fpath in files}
-    ret = max(file_updates, key=file_updates.get)
-    return ret
+        str: コミットID
+    """
+    git_dir = Path(repo_dir) / '.git'
+    try:
+        head = (git_dir / 'HEAD').read_text().strip()
+        if not head.startswith('ref:'):
+            return head
+        ref = head[4:].strip()
+        if (git_dir / ref).exists():
+            return (git_dir / ref).read_text().strip()
+        with open(git_dir / 'packed-refs') as f:
+            for line in f:
+                if line.rstrip().endswith(f" {ref}"):
+                    return line.split(' ')[0]
+    except OSError:
+        pass
+    return None
 
 def npyfile2npy(fp) -> np.ndarray:
     """
@@ -253,6 +339,7 @@ def npyfile2npy(fp) -> np.ndarray:
     Returns:
         np.ndarray: 読み込んだndarray
     """
+    import numpy as np
     return np.load(fp)
 
 def npybytes2npy(npy:bytes) -> np.ndarray:
@@ -265,11 +352,13 @@ def npybytes2npy(npy:bytes) -> np.ndarray:
     Returns:
         np.ndarray: 読み込んだndarray
     """
+    import numpy as np
     return np.load(BytesIO(npy))
 
 def npy2b64str(npy:np.ndarray) -> str:
     """
     ndarrayをBase64エンコードした文字列を返します。
+    dtypeと形状は含まれないため、プロセス間やホスト間で配列を受け渡す場合はcodecモジュールを使用してください。
 
     Args:
         npy (np.ndarray): ndarray
@@ -289,6 +378,7 @@ def npy2img(npy:np.ndarray) -> Image:
     Returns:
         Image: PILのImageオブジェクト
     """
+    from PIL import Image
     return Image.fromarray(npy)
 
 def b64str2npy(b64str:str, shape:tuple, dtype:str='uint8') -> np.ndarray:
@@ -303,23 +393,29 @@ def b64str2npy(b64str:str, shape:tuple, dtype:str='uint8') -> np.ndarray:
     Returns:
         np.ndarray: 復元したndarray
     """
+    import numpy as np
     return np.frombuffer(base64.b64decode(b64str), dtype=dtype).reshape(shape)
 
-def npy2imgfile(npy, output_image_file:Path=None, image_type:str='jpg') -> None:
+def npy2imgfile(npy, output_image_file:Path=None, image_type:str='jpg') -> bytes:
     """
-    ndarrayを画像bytesに変換しoutput_image_fileに保存します。
-    output_image_fileが省略された場合は保存されません
+    ndarrayを画像に変換しoutput_image_fileに保存します。
+    保存する場合はバイト列を経由せずにファイルに直接エンコードします。
+    output_image_fileが省略された場合は保存せずに画像のバイト列を返します
 
     Args:
         npy ([type]): ndarray
         output_image_file (Path): 保存先の画像ファイルパス
+        image_type (str): 画像の形式。'jpg'、'png'など
+
+    Returns:
+        bytes: output_image_fileが省略された場合は画像のバイト列。保存した場合はNone
     """
+    from PIL import Image
     image = Image.fromarray(npy)
-    img_byte = img2byte(image, format=image_type)
     if output_image_file is not None:
-        with open(output_image_file, 'wb') as f:
-            f.write(img_byte)
-    return img_byte
+        image.save(output_image_file, format=_pil_format(image_type))
+        return None
+    return img2byte(image, format=image_type)
 
 def imgbytes2npy(img:bytes, dtype:str='uint8') -> np.ndarray:
     """
@@ -332,6 +428,8 @@ def imgbytes2npy(img:bytes, dtype:str='uint8') -> np.ndarray:
     Returns:
         np.ndarray: ndarray
     """
+    from PIL import Image
+    import numpy as np
     img = Image.open(BytesIO(img))
     return np.array(img, dtype=dtype)
 
@@ -346,6 +444,8 @@ def imgfile2npy(fp, dtype:str='uint8') -> np.ndarray:
     Returns:
         np.ndarray: ndarray
     """
+    from PIL import Image
+    import numpy as np
     img = Image.open(fp)
     return np.array(img, dtype=dtype)
 
@@ -360,48 +460,55 @@ def img2npy(image:Image, dtype:str='uint8') -> np.ndarray:
     Returns:
         np.ndarray: ndarray
     """
+    import numpy as np
     return np.array(image, dtype=dtype)
 
+def _pil_format(format:str) -> str:
+    # 'jpg'のような拡張子もPILの形式名('JPEG')として扱う
+    from PIL import Image
+    ext = '.' + format.lower().lstrip('.')
+    return Image.registered_extensions().get(ext, format.upper())
+
 def img2byte(image:Image, format:str='JPEG') -> bytes:
     """
     画像をバイト列に変換します。
 
     Args:
         image (Image): PILのImageオブジェクト
+        format (str, optional): 画像の形式。'JPEG'、'PNG'または'jpg'のような拡張子. Defaults to 'JPEG'.
 
     Returns:
         bytes: 画像のバイト列
     """
     with BytesIO() as buffer:
-        image.save(buffer, format="JPEG")
+        image.save(buffer, format=_pil_format(format))
         return buffer.getvalue()
 
 def draw_boxes(image:Image, boxes:List[List[float]], scores:List[float], classes:List[int], labels:List[str] = None, colors = None):
     """
-    画像にバウンディングボックスを描画します。
+    画像にバウンディングボックスとラベルを描画します。
+    座標の丸めと画像の範囲への切り詰めはまとめて行い、描画はrender.Rendererで画像の配列に直接行います。
 
     Args:
         image (Image): PILのImageオブジェクト
-        boxes (List[List[float]]): バウンディングボックスの座標リスト
+        boxes (List[List[float]]): バウンディングボックスの座標リスト。y1, x1, y2, x2の順
         scores (List[float]): バウンディングボックスのスコアリスト
         classes (List[int]): バウンディングボックスのクラスリスト
-        labels (List[str], optional): クラスのラベルリスト. Defaults to None.
-        colors (List, optional): バウンディングボックスの色リスト. Defaults to None.
+        labels (List[str], optional): クラスのラベルリスト。Noneはクラス番号を表示. Defaults to None.
+        colors (List, optional): クラスごとのRGBの色リスト。Noneは赤. Defaults to None.
 
     Returns:
         Image: 描画された画像
     """
-    draw = ImageDraw.Draw(image)
-    for box, score, cl in zip(boxes, scores, classes):
-        y1, x1, y2, x2 = box
-        x1 = max(0, np.floor(x1 + 0.5).astype(int))
-        y1 = max(0, np.floor(y1 + 0.5).astype(int))
-        x2 = min(image.width, np.floor(x2 + 0.5).astype(int))
-        y2 = min(image.height, np.floor(y2 + 0.5).astype(int))
-        color = colors[cl] if colors is not None else (255, 0, 0)
-        draw.rectangle(((x1, y1), (x2, y2)), outline=color)
-
-        label = labels[cl] if labels is not None else str(cl)
-        draw.text((x1, y1), label, bbox={'facecolor': 'white', 'alpha': 0.7, 'pad': 10})
-    
+    from pth2onnx.app import render
+    from PIL import Image as PILImage
+    import numpy as np
+    if len(boxes) == 0:
+        return image
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    dets = np.concatenate([boxes[:, [1, 0, 3, 2]], np.asarray(scores, dtype=np.float64).reshape(-1, 1),
+                           np.asarray(classes, dtype=np.float64).reshape(-1, 1)], axis=1)
+    renderer = render.get_renderer(labels=labels, colors=colors if colors is not None else [(255, 0, 0)], thickness=1, show_score=False)
+    arr = renderer.draw(np.array(image.convert('RGB')), dets)
+    image.paste(PILImage.fromarray(arr).convert(image.mode))
     return image
\ No newline at end of file
@@ -1,86 +1,597 @@
+# asyncio、sqlite3、multiprocessing.connectionなどの読み込みに時間のかかるモジュールや、それらを使うモジュールは、起動を速くするために使う関数の中でimportする
+from __future__ import annotations
 from pathlib import Path
+from typing import TYPE_CHECKING, List
 from pth2onnx.app import common
-import cv2
+from pth2onnx.app import trace
+from pth2onnx.app.cache import ConvertCache, remove_file, sha256_file
+import hashlib
+import json
 import logging
+import os
 import platform
+import shutil
+import subprocess
+import threading
+import time
+
+if TYPE_CHECKING:
+    from pth2onnx.app.registry import ModelRegistry
+    from pth2onnx.app.runs import Run, RunIndex
+
+WORKER_SCRIPT = Path(__file__).resolve().parent / 'yolox_worker.py'
+WORKER_AUTHKEY_ENV = 'PTH2ONNX_WORKER_AUTHKEY'
+YOLOX_REPO = 'https://github.com/Megvii-BaseDetection/YOLOX'
+LOCK_FILE = 'yolox_requirements.lock'
+LOCK_MARKER = 'pth2onnx_lock.sha256'
 
 class Yolox(object):
-    def __init__(self, logger:logging.Logger):
+    def __init__(self, logger:logging.Logger, data:Path = None, backend:str = 'subprocess', cache_max_size:int = 4096, timeout:float = None,
+                 download_segments:int = 1):
         """
         YOLOXクラスのコンストラクタ
 
         Args:
             logger (logging.Logger): ロガーオブジェクト
+            data (Path): データディレクトリのパス, by default None
+            backend (str): demo, convert, inferenceの実行方法。'subprocess'または'worker', by default 'subprocess'
+            cache_max_size (int): 変換キャッシュの合計サイズの上限(MB), by default 4096
+            timeout (float): 外部コマンドのタイムアウト(秒)。Noneは無制限, by default None
+            download_segments (int): 重みファイルを並行してダウンロードする区間の数, by default 1
         """
         self.logger = logger
+        self.timeout = timeout
+        self.data = Path(data) if data is not None else Path(os.path.expanduser("~")) / ".pth2onnx"
+        self.backend = backend if backend is not None else 'subprocess'
+        self.convert_cache = ConvertCache(logger, self.data, max_size=cache_max_size if cache_max_size is not None else 4096)
+        self._registry = None
+        self._run_index = None
+        self.download_segments = download_segments if download_segments is not None else 1
+        # convert_batchのスレッドが同時にワーカーを起動しないようにする
+        self.worker_lock = threading.Lock()
+
+
+    @property
+    def registry(self) -> ModelRegistry:
+        """
+        モデルのレジストリ。sqlite3の読み込みを使うときまで遅らせるため、最初に参照したときに作成する。
+
+        Returns:
+            ModelRegistry: モデルのレジストリ
+        """
+        if self._registry is None:
+            from pth2onnx.app.registry import ModelRegistry
+            self._registry = ModelRegistry(self.logger, self.data)
+        return self._registry
+
+
+    @property
+    def run_index(self) -> RunIndex:
+        """
+        実行の索引。sqlite3の読み込みを使うときまで遅らせるため、最初に参照したときに作成する。
+
+        Returns:
+            RunIndex: 実行の索引
+        """
+        if self._run_index is None:
+            from pth2onnx.app.runs import RunIndex
+            self._run_index = RunIndex(self.logger, self.data)
+        return self._run_index
 
 
-    def install(self, pycmd:str = 'python', pipcmd:str = 'pip'):
+    def _venv_python(self, cwd:Path) -> Path:
         """
-        YOLOXをインストールする
+        YOLOXの仮想環境のPythonコマンドのパスを返す
+
+        Args:
+            cwd (Path): YOLOXディレクトリのパス
+
+        Returns:
+            Path: Pythonコマンドのパス
+        """
+        if platform.system() == 'Windows':
+            return cwd.resolve() / '.venv' / 'Scripts' / 'python.exe'
+        return cwd.resolve() / '.venv' / 'bin' / 'python'
+
+
+    def _pycmd(self, cwd:Path, pycmd:str = 'python') -> List[str]:
+        """
+        YOLOXの仮想環境でスクリプトを実行するコマンドを返す。
+        pycmdが'python'の場合は仮想環境のPythonを直接使うため、仮想環境を有効にする必要はない。
+
+        Args:
+            cwd (Path): YOLOXディレクトリのパス
+            pycmd (str): Pythonコマンドのパス, by default 'python'
+
+        Returns:
+            List[str]: コマンドのリスト
+        """
+        if pycmd is None or pycmd == 'python':
+            return [str(self._venv_python(cwd))]
+        from pth2onnx.app import runner
+        return runner.split(pycmd)
+
+
+    def _run(self, argv:List[str], cwd:Path, name:str):
+        """
+        コマンドを実行し、結果を示す辞書を返す
+
+        Args:
+            argv (List[str]): コマンドと引数のリスト
+            cwd (Path): 実行するディレクトリ
+            name (str): エラーメッセージに使う処理名
+
+        Returns:
+            dict: 成功時は{'success': 実行結果}、失敗時は{'error': '<エラーメッセージ>'}
+        """
+        from pth2onnx.app import runner
+        ret = runner.run(argv, self.logger, cwd=cwd, timeout=self.timeout)
+        self.logger.debug(f"returncode={ret['returncode']}, elapsed={ret['elapsed']}, peak_rss_mb={ret['peak_rss_mb']}")
+        if ret['timeout']:
+            msg = f"{name} failed. timeout={self.timeout}s"
+        elif ret['returncode'] != 0:
+            msg = f"{name} failed. returncode={ret['returncode']}"
+        else:
+            return {'success':ret}
+        self.logger.error(f"{msg}\n" + '\n'.join(ret['output'].splitlines()[-20:]))
+        return {'error':msg}
+
+
+    def _register(self, name:str, path:Path, **kwargs):
+        """
+        ONNXファイルをモデルレジストリに登録する。登録に失敗しても変換などの処理は失敗にしない
+
+        Args:
+            name (str): モデル名
+            path (Path): ONNXファイルのパス
+            **kwargs: ModelRegistry.registerに渡すオプション
+        """
+        import sqlite3
+        try:
+            self.registry.register(name, path, **kwargs)
+        except (sqlite3.Error, OSError) as e:
+            self.logger.warning(f"Registry update failed. {e}")
+
+
+    def _record_bench(self, path:Path, latency_ms:float, name:str = None, **kwargs):
+        """
+        ONNXファイルの推論時間をモデルレジストリに記録する。記録に失敗しても処理は失敗にしない
+
+        Args:
+            path (Path): ONNXファイルのパス
+            latency_ms (float): 推論時間(ミリ秒)
+            name (str): 未登録のファイルをこのモデル名で登録する。Noneの場合は登録せずに記録しない, by default None
+            **kwargs: ModelRegistry.record_benchに渡すオプション
+        """
+        import sqlite3
+        try:
+            if not self.registry.record_bench(path, latency_ms, **kwargs) and name is not None:
+                self.registry.register(name, path)
+                self.registry.record_bench(path, latency_ms, **kwargs)
+        except (sqlite3.Error, OSError) as e:
+            self.logger.warning(f"Registry update failed. {e}")
+
+
+    def _record_run(self, run:Run, status:str, items:List[dict], model:str = None, **summary):
+        """
+        実行を実行の索引に記録する。記録に失敗しても処理は失敗にしない
+
+        Args:
+            run (Run): 実行
+            status (str): 'success'または'error'
+            items (List[dict]): input、output、detectionsを持つ辞書のリスト
+            model (str): 実行に使ったモデルのパスまたは名前, by default None
+            **summary: 実行の処理時間などの集計
+        """
+        import sqlite3
+        try:
+            self.run_index.record(run, status, items, model=model, **summary)
+        except (sqlite3.Error, OSError) as e:
+            self.logger.warning(f"Run index update failed. {e}")
+
+
+    def _weight_file(self, weight_file):
+        """
+        重みファイルがURLの場合はダウンロードしてYOLOXディレクトリに配置する
+
+        Args:
+            weight_file (Path): 重みファイルのパスまたはURL
+
+        Returns:
+            dict: 成功時は{'success': YOLOXディレクトリからの相対パス}、失敗時は{'error': '<エラーメッセージ>'}
+        """
+        from pth2onnx.app.download import is_url
+        if weight_file is None or not is_url(weight_file):
+            return {'success':weight_file}
+        ret = self.download(str(weight_file))
+        return {'success':Path(ret['success']['weight_file'])} if 'success' in ret else ret
+
+
+    def worker(self, subcmd:str, timeout:int = 15):
+        """
+        YOLOXの仮想環境内で常駐するワーカーを操作する
+
+        Args:
+            subcmd (str): 'start'、'stop'または'status'
+            timeout (int): ワーカーの起動を待つ秒数, by default 15
+
+        Returns:
+            dict: 操作結果を示す辞書
+        """
+        if subcmd == 'start':
+            return self._worker_start(timeout=timeout or 15)
+        elif subcmd == 'stop':
+            ret = self._worker_request(dict(op='stop'), autostart=False)
+            if 'success' in ret:
+                (self.data / 'yolox_worker.key').unlink(missing_ok=True)
+            return ret
+        elif subcmd == 'status':
+            return self._worker_request(dict(op='ping'), autostart=False)
+        self.logger.error(f"Unkown worker subcmd. ({subcmd})")
+        return {'error':f"Unkown worker subcmd. ({subcmd}) Please specify --subcmd start, stop or status."}
+
+
+    def _worker_start(self, timeout:int = 15):
+        """
+        ワーカーを起動し、待ち受けを開始するまで待つ
+
+        Args:
+            timeout (int): ワーカーの起動を待つ秒数, by default 15
+
+        Returns:
+            dict: 起動結果を示す辞書
+        """
+        with self.worker_lock:
+            return self._worker_spawn(timeout=timeout)
+
+
+    def _worker_spawn(self, timeout:int = 15):
+        """
+        ワーカーが応答しない場合にワーカーのプロセスを起動する。worker_lockを取得して呼び出す
+
+        Args:
+            timeout (int): ワーカーの起動を待つ秒数, by default 15
+
+        Returns:
+            dict: 起動結果を示す辞書
+        """
+        cwd = Path('./YOLOX')
+        if not cwd.exists() or not (cwd / '.venv').exists():
+            self.logger.error(f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'.")
+            return {'error':f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'."}
+        # 他のスレッドがロックを持っている間に起動した場合はそのワーカーを使う
+        ret = self._worker_request(dict(op='ping'), autostart=False)
+        if 'success' in ret:
+            return ret
+        common.mkdirs(self.data)
+        state_file = self.data / 'yolox_worker.json'
+        key_file = self.data / 'yolox_worker.key'
+        state_file.unlink(missing_ok=True)
+        authkey = common.random_string(32)
+        with open(key_file, 'w') as f:
+            f.write(authkey)
+        os.chmod(key_file, 0o600)
+        env = os.environ.copy()
+        env[WORKER_AUTHKEY_ENV] = authkey
+        if platform.system() == 'Windows':
+            kwargs = dict(creationflags=subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.DETACHED_PROCESS)
+        else:
+            kwargs = dict(start_new_session=True)
+        with open(self.data / 'yolox_worker.log', 'ab') as log:
+            proc = subprocess.Popen([str(self._venv_python(cwd)), str(WORKER_SCRIPT), 'serve', '--state_file', str(state_file.resolve())],
+                                    cwd=cwd, env=env, stdin=subprocess.DEVNULL, stdout=log, stderr=log, **kwargs)
+        tm = time.time()
+        while not state_file.exists():
+            if proc.poll() is not None:
+                self.logger.error(f"Worker start failed. returncode={proc.returncode}, see {self.data / 'yolox_worker.log'}")
+                return {'error':f"Worker start failed. returncode={proc.returncode}"}
+            if time.time() - tm > timeout:
+                proc.kill()
+                self.logger.error(f"Worker start timeout. ({timeout}s)")
+                return {'error':f"Worker start timeout. ({timeout}s)"}
+            time.sleep(0.1)
+        self.logger.info(f"Worker started. pid={proc.pid}")
+        return self._worker_request(dict(op='ping'), autostart=False)
+
+
+    @trace.traced('worker.request')
+    def _worker_request(self, req:dict, autostart:bool = True):
+        """
+        ワーカーにリクエストを送信し、結果を受け取る
+
+        Args:
+            req (dict): リクエスト
+            autostart (bool): ワーカーが起動していない場合に起動するかどうか, by default True
+
+        Returns:
+            dict: ワーカーの処理結果
+        """
+        from multiprocessing import AuthenticationError
+        from multiprocessing.connection import Client
+        state_file = self.data / 'yolox_worker.json'
+        key_file = self.data / 'yolox_worker.key'
+        try:
+            with open(state_file) as f:
+                state = json.load(f)
+            with open(key_file) as f:
+                authkey = f.read().encode('utf-8')
+            with Client((state['host'], state['port']), authkey=authkey) as conn:
+                conn.send_bytes(json.dumps(req, default=str).encode('utf-8'))
+                return json.loads(conn.recv_bytes().decode('utf-8'))
+        except (OSError, EOFError, KeyError, ValueError, AuthenticationError) as e:
+            if not autostart:
+                return {'error':f"Worker is not running. Run the command 'pth2onnx -m yolox -c worker --subcmd start'. ({e})"}
+        ret = self._worker_start()
+        if 'error' in ret:
+            return ret
+        return self._worker_request(req, autostart=False)
+
+
+    @trace.traced('worker.oneshot')
+    def _worker_oneshot(self, req:dict, cwd:Path):
+        """
+        YOLOXの仮想環境で新しいプロセスを起動し、ワーカーの単発モードでリクエストを1件処理する
+
+        Args:
+            req (dict): リクエスト
+            cwd (Path): YOLOXディレクトリのパス
+
+        Returns:
+            dict: ワーカーの処理結果
+        """
+        try:
+            proc = subprocess.run([str(self._venv_python(cwd)), str(WORKER_SCRIPT), 'oneshot'], cwd=cwd, timeout=self.timeout,
+                                  input=json.dumps(req, default=str).encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except subprocess.TimeoutExpired:
+            self.logger.error(f"Worker oneshot timeout. op={req.get('op')}, timeout={self.timeout}s")
+            return {'error':f"Worker oneshot timeout. op={req.get('op')}, timeout={self.timeout}s"}
+        for line in proc.stderr.decode('utf-8', errors='replace').splitlines():
+            self.logger.debug(line)
+        lines = proc.stdout.decode('utf-8', errors='replace').strip().splitlines()
+        if proc.returncode != 0 or len(lines) == 0:
+            self.logger.error(f"Worker oneshot failed. op={req.get('op')}, returncode={proc.returncode}")
+            return {'error':f"Worker oneshot failed. op={req.get('op')}, returncode={proc.returncode}"}
+        return json.loads(lines[-1])
+
+
+    @trace.traced('install')
+    def install(self, pycmd:str = 'python', pipcmd:str = 'pip', subcmd:str = None, lock_file:Path = None, wheelhouse:Path = None,
+                offline:bool = False):
+        """
+        YOLOXをインストールする。
+        subcmdが'lock'の場合は通常のインストールの後、仮想環境のパッケージのバージョンをロックファイルに固定し、
+        wheelhouseが指定されていればロックファイルのwheelをダウンロードする。
+        ロックファイルがある場合はロックファイルのバージョンでインストールし、ロックファイルのハッシュが一致する仮想環境は再利用する。
+        git cloneと仮想環境の作成は、wheelのダウンロードと並行して行う。
 
         Args:
             pycmd (str): Pythonコマンドのパス, by default 'python'
             pipcmd (str): pipコマンドのパス, by default 'pip'
+            subcmd (str): 'lock'の場合はロックファイルを作成する, by default None
+            lock_file (Path): ロックファイルのパス。Noneの場合はデータディレクトリのyolox_requirements.lock, by default None
+            wheelhouse (Path): wheelを保存するディレクトリのパス, by default None
+            offline (bool): ネットワークを使わずにwheelhouseからインストールするかどうか, by default False
 
         Returns:
-            dict: インストール結果を示す辞書
+            dict: 成功時は{'success': 手順ごとの経過時間のリスト}、失敗時は{'error': '<エラーメッセージ>'}
         """
+        if subcmd not in (None, 'lock'):
+            self.logger.error(f"Unknown subcmd. ({subcmd})")
+            return {'error':f"Unknown subcmd. ({subcmd})"}
+        lock_file = Path(lock_file) if lock_file is not None else self.data / LOCK_FILE
+        wheelhouse = Path(wheelhouse) if wheelhouse is not None else None
+        use_lock = subcmd is None and lock_file.exists()
+        if offline and (not use_lock or wheelhouse is None or not wheelhouse.exists()):
+            self.logger.error(f"Offline install requires the lock file and the wheelhouse. lock_file={lock_file}, wheelhouse={wheelhouse}")
+            return {'error':f"Offline install requires the lock file and the wheelhouse."}
+        from pth2onnx.app import runner
+        import asyncio
+        return asyncio.run(self._install(runner.split(pycmd), pipcmd, subcmd, lock_file, wheelhouse, offline, use_lock))
+
+
+    async def _install(self, pycmd:List[str], pipcmd:str, subcmd:str, lock_file:Path, wheelhouse:Path, offline:bool, use_lock:bool):
+        from pth2onnx.app import runner
+        import asyncio
+        tm = time.perf_counter()
         cwd = Path('./YOLOX')
-        if not cwd.exists():
-            returncode, _ = common.cmd("git clone https://github.com/Megvii-BaseDetection/YOLOX", self.logger)
-            if returncode != 0:
-                self.logger.error(f"Install failed. returncode={returncode}")
-                return {'error':f"Install failed. returncode={returncode}"}
-
-        if not (cwd / '.venv').exists():
-            returncode, _ = common.cmd(f"{pycmd} -m venv .venv", self.logger, cwd=cwd)
-            if returncode != 0:
-                self.logger.error(f"Install failed. returncode={returncode}")
-                return {'error':f"Install failed. returncode={returncode}"}
-
-        actcmd = '.venv\\Scripts\\activate.bat' if platform.system() == 'Windows' else '. .venv/bin/activate'
+        venv = cwd / '.venv'
+        marker = venv / LOCK_MARKER
+        lock_hash = hashlib.sha256(lock_file.read_bytes()).hexdigest() if use_lock else None
+        steps = []
+
+        def _result(error:str = None):
+            steps.append(dict(step='total', elapsed=round(time.perf_counter() - tm, 3), status='failed' if error else 'ok'))
+            for s in steps:
+                self.logger.info(f"Install {s}")
+            return {'error':error} if error else {'success':steps}
+
+        async def _step(name:str, argv:List[str], run_cwd:Path):
+            with trace.span(f"install.{name}"):
+                ret = await runner.run_async(argv, self.logger, cwd=run_cwd, timeout=self.timeout)
+            failed = ret['timeout'] or ret['returncode'] != 0
+            steps.append(dict(step=name, elapsed=ret['elapsed'], status='failed' if failed else 'ok'))
+            if not failed:
+                return None, ret
+            msg = f"Install failed. step={name}, " + (f"timeout={self.timeout}s" if ret['timeout'] else f"returncode={ret['returncode']}")
+            self.logger.error(f"{msg}\n" + '\n'.join(ret['output'].splitlines()[-20:]))
+            return msg, ret
+
+        if lock_hash is not None and marker.exists() and marker.read_text(encoding='utf-8').strip() == lock_hash:
+            steps.append(dict(step='venv', elapsed=0.0, status='reused'))
+            return _result()
+
+        async def _source_and_venv():
+            if not cwd.exists():
+                if offline:
+                    self.logger.error(f"YOLOX source not found. Clone it before offline install. ({cwd})")
+                    return f"YOLOX source not found."
+                err, _ = await _step('clone', ['git', 'clone', YOLOX_REPO], Path('.'))
+                if err:
+                    return err
+            if venv.exists() and lock_hash is not None:
+                self.logger.info(f"Lock hash mismatch. Recreate venv. ({venv})")
+                shutil.rmtree(venv)
+            if not venv.exists():
+                err, _ = await _step('venv', pycmd + ['-m', 'venv', '.venv'], cwd)
+                return err
+            return None
+
+        async def _download():
+            # ロックファイルはYOLOXのソースが無くても解決できるため、cloneと並行してwheelを揃える
+            if not use_lock or wheelhouse is None or offline:
+                return None
+            wheelhouse.mkdir(parents=True, exist_ok=True)
+            err, _ = await _step('download', pycmd + ['-m', 'pip', 'download', '--no-deps', '-r', str(lock_file.resolve()),
+                                                      '-d', str(wheelhouse.resolve())], Path('.'))
+            return err
+
+        err = next((e for e in await asyncio.gather(_source_and_venv(), _download()) if e), None)
+        if err:
+            return _result(err)
+
         self.logger.debug(f"Current directory:{cwd}")
-        returncode, _ = common.cmd(f"{actcmd} && python -m pip install --upgrade pip", self.logger, cwd=cwd)
-        if returncode != 0:
-            self.logger.error(f"Install failed. returncode={returncode}")
-            return {'error':f"Install failed. returncode={returncode}"}
+        venv_python = str(self._venv_python(cwd))
+        pip = [venv_python, '-m', 'pip'] if pipcmd in (None, 'pip', 'pip3') else runner.split(pipcmd)
+        if use_lock:
+            index = ['--no-index'] if offline else []
+            links = ['--find-links', str(wheelhouse.resolve())] if wheelhouse is not None else []
+            argvs = [('requirements', pip + ['install', '--no-deps'] + index + links + ['-r', str(lock_file.resolve())]),
+                     ('yolox', pip + ['install', '--no-deps', '--no-build-isolation'] + index + ['-e', '.'])]
+        else:
+            argvs = [('pip', [venv_python, '-m', 'pip', 'install', '--upgrade', 'pip']),
+                     ('requirements', pip + ['install', '-r', 'requirements.txt']),
+                     ('onnxruntime', pip + ['install', 'onnxruntime']),
+                     ('yolox', pip + ['install', '-v', '-e', '.'])]
+            if marker.exists():
+                marker.unlink()
+        for name, argv in argvs:
+            err, _ = await _step(name, argv, cwd)
+            if err:
+                return _result(err)
+
+        if subcmd == 'lock':
+            # pip, setuptools, wheelも固定し、オフラインでもビルドに使えるようにする
+            err, ret = await _step('freeze', [venv_python, '-m', 'pip', 'freeze', '--all', '--exclude-editable'], cwd)
+            if err:
+                return _result(err)
+            pins = [line.strip() for line in ret['output'].splitlines() if '==' in line and not line.startswith(('#', '-'))]
+            skipped = [line.strip() for line in ret['output'].splitlines() if ' @ ' in line]
+            if skipped:
+                self.logger.warning(f"Packages installed from a local path are not locked. {skipped}")
+            lock_file.parent.mkdir(parents=True, exist_ok=True)
+            lock_file.write_text('\n'.join(pins) + '\n', encoding='utf-8')
+            self.logger.info(f"Lock file saved. packages={len(pins)}, lock_file={lock_file}")
+            if wheelhouse is not None:
+                wheelhouse.mkdir(parents=True, exist_ok=True)
+                err, _ = await _step('download', pip + ['download', '--no-deps', '-r', str(lock_file.resolve()),
+                                                        '-d', str(wheelhouse.resolve())], cwd)
+                if err:
+                    return _result(err)
+            lock_hash = hashlib.sha256(lock_file.read_bytes()).hexdigest()
+        if lock_hash is not None:
+            marker.write_text(lock_hash, encoding='utf-8')
+        return _result()
 
-        returncode, _ = common.cmd(f"{actcmd} && {pipcmd} install -r requirements.txt", self.logger, cwd=cwd)
-        if returncode != 0:
-            self.logger.error(f"Install failed. returncode={returncode}")
-            return {'error':f"Install failed. returncode={returncode}"}
 
-        returncode, _ = common.cmd(f"{actcmd} && {pipcmd} install onnxruntime", self.logger, cwd=cwd)
-        if returncode != 0:
-            self.logger.error(f"Install failed. returncode={returncode}")
-            return {'error':f"Install failed. returncode={returncode}"}
+    @trace.traced('download')
+    def download(self, url:str, weight_file:Path = None, sha256:str = None):
+        """
+        重みファイルをダウンロードしてYOLOXディレクトリに配置する。
+        ダウンロードしたファイルはデータディレクトリのキャッシュに保存され、同じURLは再びダウンロードしない。
+        中断した場合は次回に続きからダウンロードする。
 
-        returncode, _ = common.cmd(f"{actcmd} && {pipcmd} install -v -e .", self.logger, cwd=cwd)
-        if returncode != 0:
-            self.logger.error(f"Install failed. returncode={returncode}")
-            return {'error':f"Install failed. returncode={returncode}"}
+        Args:
+            url (str): 重みファイルのURL。末尾に「#sha256=<16進文字列>」を付けるとSHA-256を検証する
+            weight_file (Path): 配置先のYOLOXディレクトリからの相対パス。省略時はURLのファイル名, by default None
+            sha256 (str): 期待するSHA-256の16進文字列, by default None
 
-        return {'success':f"Install successed."}
+        Returns:
+            dict: 成功時は{'success': 配置したファイルのパス、サイズ、SHA-256、キャッシュにヒットしたか、再開したバイト数など}
+        """
+        if url is None:
+            self.logger.error(f"Please specify the --yolox_url option.")
+            return {'error':f"Please specify the --yolox_url option."}
+        cwd = Path('./YOLOX')
+        if not cwd.exists():
+            self.logger.error(f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'.")
+            return {'error':f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'."}
+        from pth2onnx.app.download import Downloader, parse_url, url_file_name
+        url, url_sha256 = parse_url(str(url))
+        weight_file = Path(weight_file) if weight_file is not None else Path(url_file_name(url))
+        try:
+            downloader = Downloader(self.logger, self.data, segments=self.download_segments)
+            ret = downloader.fetch(url, sha256=sha256 or url_sha256, output_file=cwd / weight_file)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Download failed. {e}")
+            return {'error':f"Download failed. {e}"}
+        ret['weight_file'] = str(weight_file)
+        return {'success':ret}
 
 
-    def zoo(self):
+    def zoo(self, subcmd:str = None, model_name:str = None, img_size:int = None, variant:str = None, latency_budget:float = None,
+            onnx_file:Path = None):
         """
-        YOLOXのモデル一覧を取得するURLを示す
+        YOLOXのモデル一覧を取得するURLを示す。subcmdを指定した場合はモデルレジストリを操作する。
+        レジストリには変換、最適化、量子化したONNXファイルと、bench、optimize、quantizeで測定した推論時間が記録される。
+
+        Args:
+            subcmd (str): 'list'、'query'、'fastest'または'add'。Noneの場合はモデル一覧のURLを示す, by default None
+            model_name (str): 検索するモデル名。'*'を含む場合はワイルドカード。addの場合は登録するモデル名, by default None
+            img_size (int): 検索する入力サイズ。addの場合は登録する入力サイズ, by default None
+            variant (str): 検索するバリエーション('fp32'、'int8(static)'など), by default None
+            latency_budget (float): 推論時間の上限(ミリ秒)。fastestでは必須, by default None
+            onnx_file (Path): addで登録するONNXファイルのパス。登録時に推論時間を測定する, by default None
 
         Returns:
-            dict: モデル一覧を示すURL
+            dict: 操作結果を示す辞書
         """
-        return {'site':f"https://github.com/Megvii-BaseDetection/YOLOX/#benchmark"}
+        if subcmd is None:
+            return {'site':f"https://github.com/Megvii-BaseDetection/YOLOX/#benchmark"}
+        import sqlite3
+        try:
+            if subcmd == 'list':
+                return {'success':self.registry.query()}
+            elif subcmd == 'query':
+                return {'success':self.registry.query(name=model_name, input_size=img_size, variant=variant, max_latency=latency_budget)}
+            elif subcmd == 'fastest':
+                if latency_budget is None:
+                    self.logger.error(f"Please specify the --yolox_latency_budget option.")
+                    return {'error':f"Please specify the --yolox_latency_budget option."}
+                rows = self.registry.fastest(latency_budget, name=model_name, input_size=img_size)
+                if len(rows) == 0:
+                    self.logger.error(f"No measured model within the latency budget. ({latency_budget}ms)")
+                    return {'error':f"No measured model within the latency budget. ({latency_budget}ms)"}
+                return {'success':rows}
+            elif subcmd == 'add':
+                onnx_file = Path(onnx_file) if onnx_file is not None else None
+                if onnx_file is None or not onnx_file.exists():
+                    self.logger.error(f"Onnx file not found. ({onnx_file})")
+                    return {'error':f"Onnx file not found. ({onnx_file})"}
+                from pth2onnx.app.optimize import measure
+                # 読み込めないファイルを登録しないよう、推論時間を測定してから登録する
+                try:
+                    row = measure(onnx_file)
+                except Exception as e:
+                    self.logger.error(f"Onnx measure failed. onnx_file={onnx_file}, {e}", exc_info=True)
+                    return {'error':f"Onnx measure failed. onnx_file={onnx_file}, {e}"}
+                self.registry.register(model_name or onnx_file.stem, onnx_file, variant=variant or 'fp32', input_size=img_size)
+                self.registry.record_bench(onnx_file, row['latency_ms'])
+                return {'success':self.registry.query(name=model_name or onnx_file.stem, input_size=img_size)}
+        except sqlite3.Error as e:
+            self.logger.error(f"Registry failed. {e}", exc_info=True)
+            return {'error':f"Registry failed. {e}"}
+        self.logger.error(f"Unkown zoo subcmd. ({subcmd})")
+        return {'error':f"Unkown zoo subcmd. ({subcmd}) Please specify --subcmd list, query, fastest or add."}
 
 
+    @trace.traced('demo')
     def demo(self, model_name:str, weight_file:Path, input_image:Path = Path('assets/dog.jpg'), model_img_size:int = 640, clsth:float=0.25, nms:float=0.45, output_preview:bool=False, pycmd:str = 'python'):
         """
         YOLOXのデモを実行する
 
         Args:
             model_name (str): モデル名
-            weight_file (Path): 重みファイルのパス
+            weight_file (Path): 重みファイルのパス。URLの場合はダウンロードする
             input_image (Path): 入力画像のパス, by default 'assets/dog.jpg'
             model_img_size (int): モデルの画像サイズ, by default 640
             clsth (float): クラス閾値, by default 0.25
@@ -91,61 +602,551 @@ class Yolox(object):
         Returns:
             dict: デモ結果を示す辞書
         """
+        import cv2
         cwd = Path('./YOLOX')
         if not cwd.exists() or not (cwd / '.venv').exists():
             self.logger.error(f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'.")
             return {'error':f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'."}
+        ret = self._weight_file(weight_file)
+        if 'error' in ret:
+            return ret
+        weight_file = ret['success']
         weight_file = Path(weight_file) if isinstance(weight_file, str) else weight_file
         input_image = Path(input_image) if isinstance(input_image, str) else input_image
 
-        actcmd = '.venv\\Scripts\\activate.bat' if platform.system() == 'Windows' else '.venv/Scripts/activate'
-        self.logger.debug(f"Current directory:{cwd}")
-        returncode, _ = common.cmd(f"{actcmd} && {pycmd} tools/demo.py image -n {model_name} -c {weight_file} --path {input_image}"
-                                   f" --conf {clsth} --nms {nms} --tsize {model_img_size} --save_result --device [cpu/gpu]", self.logger, cwd=cwd)
-        if returncode != 0:
-            self.logger.error(f"Demo failed. returncode={returncode}")
-            return {'error':f"Demo failed. returncode={returncode}"}
-        outfile = common.find_max_update_file(cwd / 'YOLOX_outputs', '**/*.jpg')
+        # 実行ごとに別の実験名で保存し、出力ファイルを探すときに他の実行の出力を見ないようにする
+        from pth2onnx.app.runs import Run
+        run = Run('demo', cwd / 'YOLOX_outputs')
+        if self.backend == 'worker':
+            ret = self._worker_request(dict(op='demo', model_name=model_name, weight_file=weight_file, input_image=input_image,
+                                            conf=clsth, nms=nms, tsize=model_img_size,
+                                            save_dir=Path('YOLOX_outputs') / run.run_id / 'vis_res'))
+            if 'error' in ret:
+                self.logger.error(f"Demo failed. {ret['error']}")
+                self._record_run(run, 'error', [dict(input=cwd / input_image)], model=weight_file)
+                return ret
+            outfile = cwd / ret['success']['outfile']
+        else:
+            self.logger.debug(f"Current directory:{cwd}")
+            ret = self._run(self._pycmd(cwd, pycmd) + ['tools/demo.py', 'image', '-n', model_name, '-c', weight_file, '--path', input_image,
+                                                     '--conf', clsth, '--nms', nms, '--tsize', model_img_size, '--save_result', '--device', 'cpu',
+                                                     '-expn', run.run_id],
+                            cwd, 'Demo')
+            if 'error' in ret:
+                self._record_run(run, 'error', [dict(input=cwd / input_image)], model=weight_file)
+                return ret
+            # tools/demo.pyは<実験名>/vis_res/<日時>/<入力ファイル名>に保存する
+            outfile = next((run.run_dir / 'vis_res').glob(f"*/{input_image.name}"), None)
+            if outfile is None:
+                self.logger.error(f"Demo output not found. ({run.run_dir})")
+                self._record_run(run, 'error', [dict(input=cwd / input_image)], model=weight_file)
+                return {'error':f"Demo output not found. ({run.run_dir})"}
+        run.write(dict(image=str(cwd / input_image), output=str(outfile), detections=None,
+                       elapsed_ms=round((time.perf_counter() - run.tm) * 1000, 1)))
+        self._record_run(run, 'success', run.items(), model=weight_file, model_name=model_name, tsize=model_img_size)
         if output_preview:
             with open(outfile, 'rb') as f:
                 img_npy = common.imgfile2npy(f)
                 cv2.imshow(str(outfile), img_npy)
                 cv2.waitKey(0)
-        return {'success':f"outfile={outfile}"}
+        return {'success':f"outfile={outfile}, run_id={run.run_id}"}
 
 
-    def convert(self, model_name:str, weight_file:Path, output_file:Path = None, pycmd:str = 'python'):
+    @trace.traced('convert')
+    def convert(self, model_name:str, weight_file:Path, output_file:Path = None, model_img_size:int = None, opset:int = 11,
+                use_cache:bool = True, verify:dict = None, optimize:dict = None, img_sizes:List[int] = None,
+                dynamic_batch:bool = False, dynamic_hw:bool = False, pycmd:str = 'python'):
         """
-        YOLOXのモデルをONNXに変換する
+        YOLOXのモデルをONNXに変換する。
+        重みファイルと変換オプションが同じ変換結果がキャッシュにあれば、変換せずにキャッシュから出力する。
+        img_sizesに複数の入力サイズを指定すると、PyTorchモデルを一度だけロードしてサイズごとに<出力ファイル名>_<サイズ>.onnxを出力する。
 
         Args:
             model_name (str): モデル名
-            weight_file (Path): 重みファイルのパス
+            weight_file (Path): 重みファイルのパス。URLの場合はダウンロードする
             output_file (Path): 出力ファイルのパス
+            model_img_size (int): エクスポート時の入力サイズ。省略時はモデルの既定値, by default None
+            opset (int): ONNXのopsetバージョン, by default 11
+            use_cache (bool): 変換キャッシュを使用するかどうか, by default True
+            verify (dict): 変換後に検証する場合はverifyメソッドに渡すオプション。Noneの場合は検証しない, by default None
+            optimize (dict): 変換後に最適化する場合はoptimizeメソッドに渡すオプション。Noneの場合は最適化しない, by default None
+            img_sizes (List[int]): エクスポート時の入力サイズのリスト。指定した場合はmodel_img_sizeより優先, by default None
+            dynamic_batch (bool): バッチの軸を可変にするかどうか。可変にした場合はバッチ推論の結果を1枚ずつの推論結果と比較する, by default False
+            dynamic_hw (bool): 入力の高さと幅を可変にするかどうか, by default False
             pycmd (str): Pythonコマンドのパス, by default 'python'
 
         Returns:
             dict: 変換結果を示す辞書
         """
+        from pth2onnx.app import engine
         cwd = Path('./YOLOX')
         if not cwd.exists() or not (cwd / '.venv').exists():
             self.logger.error(f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'.")
             return {'error':f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'."}
+        ret = self._weight_file(weight_file)
+        if 'error' in ret:
+            return ret
+        weight_file = ret['success']
         weight_file = Path(weight_file) if isinstance(weight_file, str) else weight_file
         output_file = Path(output_file) if isinstance(output_file, str) else output_file
-
-        actcmd = '.venv\\Scripts\\activate.bat' if platform.system() == 'Windows' else '.venv/Scripts/activate'
         self.logger.debug(f"Current directory:{cwd}")
 
         if output_file is None:
             output_file = weight_file.parent / Path(model_name + '.onnx')
-        returncode, _ = common.cmd(f"{actcmd} && {pycmd} tools/export_onnx.py -n {model_name} -c {weight_file} --output-name {output_file} --no-onnxsim", self.logger, cwd=cwd)
-        if returncode != 0:
-            self.logger.error(f"Convert failed. returncode={returncode}")
-            return {'error':f"Convert failed. returncode={returncode}"}
-        return {'success':f"outfile={output_file}"}
+        opset = int(opset) if opset is not None else 11
+        sizes = [int(s) for s in img_sizes] if img_sizes else [int(model_img_size) if model_img_size is not None else None]
+        if len(sizes) > 1:
+            targets = [(output_file.with_name(f"{output_file.stem}_{s}{output_file.suffix}"), s) for s in sizes]
+        else:
+            targets = [(output_file, sizes[0])]
+        options = dict(dynamic_batch=dynamic_batch, dynamic_hw=dynamic_hw)
+
+        # 重みファイルのハッシュは、入力サイズごとのキャッシュのキーとレジストリへの登録で共通に使うため1回だけ求める
+        weight_sha256 = sha256_file(cwd / weight_file) if (cwd / weight_file).exists() else None
+        cache_keys, cached, exports = dict(), set(), []
+        commit = common.git_head(cwd) if use_cache else None
+        for target_file, size in targets:
+            if use_cache and weight_sha256 is not None:
+                with trace.span('convert.cache_get', outfile=str(target_file)) as sp:
+                    cache_keys[target_file] = self.convert_cache.key(weight_sha256, model_name, model_img_size=size, opset=opset,
+                                                                     commit=commit, **options)
+                    hit = self.convert_cache.get(cache_keys[target_file], cwd / target_file)
+                    if sp is not None:
+                        sp['hit'] = hit
+                if hit:
+                    self.logger.info(f"Convert cache hit. key={cache_keys[target_file]}")
+                    cached.add(target_file)
+                    continue
+            # 失敗したときに既存の出力を消さないように、一時ファイルにエクスポートしてから置き換える。
+            # 置き換えは新しいファイルになるため、キャッシュからハードリンクされたファイルも上書きしない
+            tmp_file = target_file.with_name(f"{target_file.stem}.{os.getpid()}.tmp{target_file.suffix}")
+            exports.append(dict(output_file=tmp_file, img_size=size, target_file=target_file))
+        if len(exports) > 0:
+            ret = self._export(cwd, model_name, weight_file, exports, opset, pycmd=pycmd, **options)
+            if 'error' in ret:
+                for e in exports:
+                    remove_file(cwd / e['output_file'])
+                return ret
+            for e in exports:
+                if not (cwd / e['output_file']).exists():
+                    self.logger.error(f"Convert output not found. ({cwd / e['output_file']})")
+                    return {'error':f"Convert output not found. ({cwd / e['output_file']})"}
+                os.replace(cwd / e['output_file'], cwd / e['target_file'])
 
+        messages = []
+        for target_file, size in targets:
+            message = f"outfile={target_file}" + (" (cached)" if target_file in cached else "")
+            # 検証に失敗した変換結果はキャッシュしない
+            if verify is not None:
+                ret = self.verify(model_name, weight_file, target_file, model_img_size=size, **verify)
+                if 'error' in ret:
+                    return ret
+            if dynamic_batch:
+                try:
+                    with trace.span('convert.batch_check', outfile=str(target_file)):
+                        ret = engine.check_batch(cwd / target_file, input_size=size or 416)
+                except Exception as e:
+                    self.logger.error(f"Batch check failed. {e}", exc_info=True)
+                    return {'error':f"Batch check failed. {e}"}
+                self.logger.info(f"Batch check. outfile={target_file}, {ret}")
+                if not ret['passed']:
+                    self.logger.error(f"Batch check failed. Batched detections differ from batch-1 detections. {ret}")
+                    return {'error':f"Batch check failed. Batched detections differ from batch-1 detections. {ret}"}
+                message += f", batch_check max_abs={ret['max_abs']:.3g}"
+            if target_file not in cached and target_file in cache_keys and (cwd / target_file).exists():
+                with trace.span('convert.cache_put', outfile=str(target_file)):
+                    self.convert_cache.put(cache_keys[target_file], cwd / target_file, model_name=model_name, weight_file=weight_file,
+                                           model_img_size=size, opset=opset, **options)
+            self._register(model_name, cwd / target_file, variant='fp32', arch='yolox', input_size=size, weight_sha256=weight_sha256)
+            ret = self._convert_optimize(cwd, target_file, optimize, message)
+            if 'error' in ret:
+                return ret
+            messages.append(ret['success'])
+        return {'success':'; '.join(messages)}
 
+
+    @trace.traced('convert.export')
+    def _export(self, cwd:Path, model_name:str, weight_file:Path, exports:List[dict], opset:int = 11,
+                dynamic_batch:bool = False, dynamic_hw:bool = False, pycmd:str = 'python'):
+        """
+        PyTorchモデルをONNXにエクスポートする。
+        ワーカーを使う場合や、複数のサイズまたは可変の高さと幅でエクスポートする場合は、
+        ワーカーでモデルを一度だけロードしてエクスポートする。それ以外はYOLOXのtools/export_onnx.pyを実行する。
+
+        Args:
+            cwd (Path): YOLOXディレクトリのパス
+            model_name (str): モデル名
+            weight_file (Path): 重みファイルのパス
+            exports (List[dict]): output_fileとimg_sizeを持つエクスポート内容のリスト
+            opset (int): ONNXのopsetバージョン, by default 11
+            dynamic_batch (bool): バッチの軸を可変にするかどうか, by default False
+            dynamic_hw (bool): 入力の高さと幅を可変にするかどうか, by default False
+            pycmd (str): Pythonコマンドのパス, by default 'python'
+
+        Returns:
+            dict: エクスポート結果を示す辞書
+        """
+        if self.backend == 'worker' or len(exports) > 1 or dynamic_hw:
+            req = dict(op='convert', model_name=model_name, weight_file=weight_file, exports=exports, opset=opset,
+                       dynamic_batch=dynamic_batch, dynamic_hw=dynamic_hw)
+            ret = self._worker_request(req) if self.backend == 'worker' else self._worker_oneshot(req, cwd)
+            if 'error' in ret:
+                self.logger.error(f"Convert failed. {ret['error']}")
+            return ret
+        output_file, img_size = exports[0]['output_file'], exports[0]['img_size']
+        argv = self._pycmd(cwd, pycmd) + ['tools/export_onnx.py', '-n', model_name, '-c', weight_file, '--output-name', output_file,
+                                          '-o', opset, '--no-onnxsim']
+        if dynamic_batch:
+            argv.append('--dynamic')
+        if img_size is not None:
+            argv += ['test_size', f"{img_size},{img_size}"]
+        ret = self._run(argv, cwd, 'Convert')
+        if 'error' in ret:
+            return ret
+        return {'success':{'outfile':str(output_file)}}
+
+
+    @trace.traced('convert.optimize')
+    def _convert_optimize(self, cwd:Path, output_file:Path, opts:dict, message:str):
+        """
+        変換結果を最適化し、変換結果のメッセージに最適化したファイルと効果を追記する
+
+        Args:
+            cwd (Path): YOLOXディレクトリのパス
+            output_file (Path): 変換結果のファイルのパス
+            opts (dict): optimizeメソッドに渡すオプション。Noneの場合は最適化しない
+            message (str): 変換結果のメッセージ
+
+        Returns:
+            dict: 変換結果を示す辞書
+        """
+        if opts is None:
+            return {'success':message}
+        ret = self.optimize(cwd / output_file, **opts)
+        if 'error' in ret:
+            return ret
+        before, after = ret['success'][0], ret['success'][-1]
+        return {'success':f"{message}, optimized={after['file']}"
+                          f" (nodes {before['nodes']}->{after['nodes']}, session_ms {before['session_ms']}->{after['session_ms']},"
+                          f" latency_ms {before['latency_ms']}->{after['latency_ms']})"}
+
+
+    @trace.traced('optimize')
+    def optimize(self, onnx_file:Path, use_simplify:bool = True, ort_format:bool = False, level:str = 'extended'):
+        """
+        ONNXモデルを簡略化し、ONNX Runtimeでオフライン最適化したモデルを同じディレクトリに保存する。
+        pth2onnxのプロセス内で実行し、パスはカレントディレクトリからの相対パス。
+
+        Args:
+            onnx_file (Path): ONNXファイルのパス
+            use_simplify (bool): onnx-simplifierで簡略化するかどうか, by default True
+            ort_format (bool): ORT形式(.ort)で保存するかどうか。Falseの場合は<名前>.opt.onnx, by default False
+            level (str): ONNX Runtimeの最適化レベル。'basic'、'extended'または'all', by default 'extended'
+
+        Returns:
+            dict: 最適化前後のノード数、ファイルサイズ、セッションの作成時間、推論時間を示す辞書
+        """
+        from pth2onnx.app.optimize import optimize_model
+        onnx_file = Path(onnx_file) if isinstance(onnx_file, str) else onnx_file
+        if onnx_file is None or not onnx_file.exists():
+            self.logger.error(f"Onnx file not found. ({onnx_file})")
+            return {'error':f"Onnx file not found. ({onnx_file})"}
+        try:
+            rows = optimize_model(onnx_file, use_simplify=use_simplify, ort_format=ort_format, level=level, logger=self.logger)
+        except Exception as e:
+            self.logger.error(f"Optimize failed. {e}", exc_info=True)
+            return {'error':f"Optimize failed. {e}"}
+        stem = onnx_file.name[:-len(onnx_file.suffix)]
+        for row in rows:
+            if row['stage'] != 'original':
+                self._register(stem, row['file'], variant=row['stage'], parent=onnx_file)
+            self._record_bench(row['file'], row['latency_ms'], name=stem)
+        return {'success':rows}
+
+
+    @trace.traced('quantize')
+    def quantize(self, onnx_file:Path, calib_dir:Path = None, holdout_dir:Path = None, mode:str = 'static', calib_method:str = 'minmax',
+                 calib_size:int = 100, per_channel:bool = False, input_size:int = 416, score_th:float = 0.3, nms_th:float = 0.45):
+        """
+        ONNXモデルをINT8に量子化し、FP32のモデルと比較する。
+        staticはキャリブレーション用の画像を推論と同じ前処理で入力して活性化の範囲を求め、dynamicは重みのみを量子化する。
+        評価用の画像でファイルサイズ、推論時間、FP32の検出結果との一致率を比較する。
+        pth2onnxのプロセス内で実行し、パスはカレントディレクトリからの相対パス。
+
+        Args:
+            onnx_file (Path): FP32のONNXファイルのパス
+            calib_dir (Path): キャリブレーション用の画像ディレクトリのパス, by default None
+            holdout_dir (Path): 評価用の画像ディレクトリのパス。省略時はcalib_dirの画像の一部を評価用に分ける, by default None
+            mode (str): 'static'または'dynamic', by default 'static'
+            calib_method (str): キャリブレーションの方法。'minmax'、'entropy'または'percentile', by default 'minmax'
+            calib_size (int): キャリブレーションに使う画像の最大数, by default 100
+            per_channel (bool): 重みをチャネルごとに量子化するかどうか, by default False
+            input_size (int): 入力画像のサイズ。モデルの入力が固定サイズの場合はそちらを優先, by default 416
+            score_th (float): スコアの閾値, by default 0.3
+            nms_th (float): NMSの閾値, by default 0.45
+
+        Returns:
+            dict: FP32とINT8のモデルのファイルサイズ、推論時間、検出結果の一致率を示す辞書
+        """
+        from pth2onnx.app import engine, postprocess, quantize
+        onnx_file = Path(onnx_file) if isinstance(onnx_file, str) else onnx_file
+        if onnx_file is None or not onnx_file.exists():
+            self.logger.error(f"Onnx file not found. ({onnx_file})")
+            return {'error':f"Onnx file not found. ({onnx_file})"}
+        if mode not in quantize.MODES:
+            self.logger.error(f"Unknown quantization mode. ({mode})")
+            return {'error':f"Unknown quantization mode. ({mode})"}
+        calib_files = engine.list_image_files(calib_dir) if calib_dir is not None and Path(calib_dir).is_dir() else []
+        if holdout_dir is not None:
+            holdout_files = engine.list_image_files(holdout_dir) if Path(holdout_dir).is_dir() else []
+        else:
+            calib_files, holdout_files = quantize.split_images(calib_files)
+        calib_files = calib_files[:max(1, int(calib_size))]
+        if mode == 'static' and len(calib_files) == 0:
+            self.logger.error(f"Calibration images not found. ({calib_dir})")
+            return {'error':f"Calibration images not found. ({calib_dir})"}
+        if len(holdout_files) == 0:
+            self.logger.error(f"Holdout images not found. ({holdout_dir or calib_dir})")
+            return {'error':f"Holdout images not found. ({holdout_dir or calib_dir})"}
+
+        stem = onnx_file.name[:-len(onnx_file.suffix)]
+        output_file = onnx_file.with_name(f"{stem}.int8.onnx" if mode == 'static' else f"{stem}.dynint8.onnx")
+        try:
+            fp32 = engine.OnnxEngine(onnx_file, input_size=input_size)
+        except Exception as e:
+            self.logger.error(f"Session create failed. onnx_file={onnx_file}, {e}", exc_info=True)
+            return {'error':f"Session create failed. onnx_file={onnx_file}, {e}"}
+        tm = time.perf_counter()
+        try:
+            reader = quantize.ImageCalibrationReader(fp32, calib_files) if mode == 'static' else None
+            quantize.quantize_model(onnx_file, output_file, mode=mode, calib_reader=reader, calib_method=calib_method,
+                                    per_channel=per_channel, logger=self.logger)
+        except Exception as e:
+            self.logger.error(f"Quantize failed. {e}", exc_info=True)
+            return {'error':f"Quantize failed. {e}"}
+        quant_sec = time.perf_counter() - tm
+        try:
+            int8 = engine.OnnxEngine(output_file, input_size=input_size)
+            fp32_dets, fp32_lat = quantize.evaluate(fp32, holdout_files, score_th=score_th, nms_th=nms_th)
+            int8_dets, int8_lat = quantize.evaluate(int8, holdout_files, score_th=score_th, nms_th=nms_th)
+        except Exception as e:
+            # 量子化したファイルは調査できるように残す
+            self.logger.error(f"Quantized model evaluation failed. output_file={output_file}, {e}", exc_info=True)
+            return {'error':f"Quantized model evaluation failed. output_file={output_file}, {e}"}
+        agreement, _ = postprocess.detection_agreement(fp32_dets, int8_dets)
+        fp32_size, int8_size = onnx_file.stat().st_size, output_file.stat().st_size
+        fp32_ms, int8_ms = common.percentiles(fp32_lat, scale=1000, ndigits=2), common.percentiles(int8_lat, scale=1000, ndigits=2)
+        rows = [dict(model='fp32', file=str(onnx_file), size_mb=round(fp32_size / 1024 / 1024, 2), size_ratio=1.0,
+                     latency_ms=fp32_ms['mean'], p95_ms=fp32_ms['p95'], speedup=1.0,
+                     detections=sum(len(d) for d in fp32_dets), agreement=1.0),
+                dict(model=f"int8({mode})", file=str(output_file), size_mb=round(int8_size / 1024 / 1024, 2),
+                     size_ratio=round(int8_size / fp32_size, 3), latency_ms=int8_ms['mean'], p95_ms=int8_ms['p95'],
+                     speedup=round(fp32_ms['mean'] / int8_ms['mean'], 2) if int8_ms['mean'] else None,
+                     detections=sum(len(d) for d in int8_dets), agreement=round(agreement, 4))]
+        self._record_bench(onnx_file, rows[0]['latency_ms'], name=stem, p95_ms=rows[0]['p95_ms'])
+        self._register(stem, output_file, variant=f"int8({mode})", parent=onnx_file)
+        self._record_bench(output_file, rows[1]['latency_ms'], p95_ms=rows[1]['p95_ms'])
+        self.logger.info(f"Quantize finished. calib_images={len(calib_files) if mode == 'static' else 0}, "
+                         f"holdout_images={len(holdout_files)}, elapsed={quant_sec:.03f}")
+        return {'success':rows}
+
+
+    @trace.traced('verify')
+    def verify(self, model_name:str, weight_file:Path, onnx_file:Path, input_image:Path = Path('assets/dog.jpg'), model_img_size:int = None,
+               num_synthetic:int = 4, seed:int = 0, atol:float = 1e-3, rtol:float = 1e-3, min_agreement:float = 0.99, iou_th:float = 0.5,
+               score_th:float = 0.3, nms_th:float = 0.45):
+        """
+        PyTorchモデルとONNXモデルに同じ入力を与え、出力が一致するかを検証する。
+        出力テンソルごとの最大絶対誤差と最大相対誤差、IoUで対応付けた検出結果の一致率を求め、
+        許容誤差を超えた場合はエラーを返す。パスはYOLOXディレクトリからの相対パス。
+
+        Args:
+            model_name (str): モデル名
+            weight_file (Path): 重みファイルのパス。URLの場合はダウンロードする
+            onnx_file (Path): ONNXファイルのパス
+            input_image (Path): 検証に使う実画像のパス。Noneの場合は合成画像のみ, by default Path('assets/dog.jpg')
+            model_img_size (int): 入力サイズ。ONNXモデルの入力が固定サイズの場合はそちらを優先, by default None
+            num_synthetic (int): 乱数で生成する合成画像の数, by default 4
+            seed (int): 合成画像を生成する乱数のシード, by default 0
+            atol (float): 出力テンソルの許容絶対誤差, by default 1e-3
+            rtol (float): 出力テンソルの許容相対誤差, by default 1e-3
+            min_agreement (float): 検出結果の一致率の下限, by default 0.99
+            iou_th (float): 検出結果を対応付けるIoUの閾値, by default 0.5
+            score_th (float): スコアの閾値, by default 0.3
+            nms_th (float): NMSの閾値, by default 0.45
+
+        Returns:
+            dict: 検証結果を示す辞書
+        """
+        from pth2onnx.app import postprocess
+        cwd = Path('./YOLOX')
+        if not cwd.exists() or not (cwd / '.venv').exists():
+            self.logger.error(f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'.")
+            return {'error':f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'."}
+        ret = self._weight_file(weight_file)
+        if 'error' in ret:
+            return ret
+        weight_file = ret['success']
+        for file in (weight_file, onnx_file):
+            if file is None or not (cwd / file).exists():
+                self.logger.error(f"File not found. ({file})")
+                return {'error':f"File not found. ({file})"}
+        req = dict(op='verify', model_name=model_name, weight_file=weight_file, onnx_file=onnx_file,
+                   images=[input_image] if input_image is not None else [], num_synthetic=num_synthetic, seed=seed,
+                   img_size=model_img_size, atol=atol, rtol=rtol, score_th=score_th, nms_th=nms_th)
+        ret = self._worker_request(req) if self.backend == 'worker' else self._worker_oneshot(req, cwd)
+        if 'error' in ret:
+            self.logger.error(f"Verify failed. {ret['error']}")
+            return ret
+        images = ret['success']['images']
+        agreement, total = postprocess.detection_agreement([i['torch'] for i in images], [i['onnx'] for i in images], iou_th=iou_th)
+        result = dict(model_name=model_name, onnx_file=str(onnx_file), img_size=ret['success']['img_size'],
+                      images=len(ret['success']['images']), detections=total, agreement=round(agreement, 4))
+        failed = []
+        for t in ret['success']['tensors']:
+            result.update({f"{t['name']}_max_abs":t['max_abs'], f"{t['name']}_max_rel":t['max_rel'], f"{t['name']}_mismatch":t['mismatch']})
+            if t['mismatch'] > 0:
+                failed.append(f"{t['name']}: {t['mismatch']}/{t['size']} elements exceed atol={atol}, rtol={rtol}")
+        if agreement < min_agreement:
+            failed.append(f"detection agreement {agreement:.4f} < {min_agreement}")
+        result['passed'] = len(failed) == 0
+        self.logger.info(f"Verify result. {result}")
+        if len(failed) > 0:
+            self.logger.error(f"Verify failed. {'; '.join(failed)}")
+            return {'error':f"Verify failed. {'; '.join(failed)}", 'result':result}
+        return {'success':result}
+
+
+    def cache(self, subcmd:str, max_size:int = None):
+        """
+        変換キャッシュを操作する
+
+        Args:
+            subcmd (str): 'list'、'prune'または'clear'
+            max_size (int): pruneで残す合計サイズの上限(MB)。省略時は--yolox_cache_max_sizeの値, by default None
+
+        Returns:
+            dict: 操作結果を示す辞書
+        """
+        if subcmd is None or subcmd == 'list':
+            return {'success':self.convert_cache.list()}
+        elif subcmd == 'prune':
+            evicted = self.convert_cache.prune(max_size=max_size)
+            return {'success':f"Cache pruned. evicted={len(evicted)}"}
+        elif subcmd == 'clear':
+            evicted = self.convert_cache.prune(max_size=0)
+            return {'success':f"Cache cleared. evicted={len(evicted)}"}
+        self.logger.error(f"Unkown cache subcmd. ({subcmd})")
+        return {'error':f"Unkown cache subcmd. ({subcmd}) Please specify --subcmd list, prune or clear."}
+
+
+    def runs(self, subcmd:str, input_image:Path = None, limit:int = 20):
+        """
+        実行の索引から過去の実行と出力を検索する
+
+        Args:
+            subcmd (str): 'list'または'find'
+            input_image (Path): findで出力を探す入力ファイルのパス。カレントディレクトリとYOLOXディレクトリからの相対パスを探す, by default None
+            limit (int): 返す件数の上限, by default 20
+
+        Returns:
+            dict: 操作結果を示す辞書
+        """
+        import sqlite3
+        try:
+            if subcmd is None or subcmd == 'list':
+                return {'success':self.run_index.list(limit=limit)}
+            elif subcmd == 'find':
+                if input_image is None:
+                    self.logger.error(f"Input file is not specified.")
+                    return {'error':f"Input file is not specified. Please specify --yolox_input_image."}
+                # demoとinferenceの入力はYOLOXディレクトリからの相対パスのため、両方を探す
+                found = self.run_index.find(input_image, limit=limit) + self.run_index.find(Path('./YOLOX') / input_image, limit=limit)
+                found = sorted({(r['run_id'], r['input']):r for r in found}.values(), key=lambda r:r['created'], reverse=True)
+                return {'success':found[:int(limit)]}
+        except sqlite3.Error as e:
+            self.logger.error(f"Run index read failed. {e}")
+            return {'error':f"Run index read failed. {e}"}
+        self.logger.error(f"Unkown runs subcmd. ({subcmd})")
+        return {'error':f"Unkown runs subcmd. ({subcmd}) Please specify --subcmd list or find."}
+
+
+    def convert_batch(self, manifest_file:Path, max_workers:int = None, worker_mem:int = 2048, opset:int = 11, use_cache:bool = True,
+                      verify:dict = None, optimize:dict = None, dynamic_batch:bool = False, dynamic_hw:bool = False, pycmd:str = 'python'):
+        """
+        マニフェストに記載された複数のYOLOXモデルを並列にONNXに変換する。
+        同時に実行する変換プロセス数はCPUコア数と利用可能なメモリから決定する。
+        backendが'worker'の場合は、変換の前にワーカーを1つだけ起動する。ワーカーは要求を1件ずつ処理するため、変換は1件ずつ行う。
+        いずれかのモデルの変換に失敗しても残りのモデルの変換は継続する。
+
+        Args:
+            manifest_file (Path): マニフェストファイル(YAML/JSON)のパス。
+                                  各エントリは model_name, weight_file, output_file(省略可),
+                                  model_img_size(省略可), img_sizes(省略可), opset(省略可),
+                                  dynamic_batch(省略可), dynamic_hw(省略可) を持つ
+            max_workers (int): 同時に実行する変換プロセス数の上限, by default None
+            worker_mem (int): 1変換プロセスあたりに見積もるメモリ(MB), by default 2048
+            opset (int): エントリにopsetが無い場合のONNXのopsetバージョン, by default 11
+            use_cache (bool): 変換キャッシュを使用するかどうか, by default True
+            verify (dict): 変換後に検証する場合はverifyメソッドに渡すオプション, by default None
+            optimize (dict): 変換後に最適化する場合はoptimizeメソッドに渡すオプション, by default None
+            dynamic_batch (bool): エントリにdynamic_batchが無い場合にバッチの軸を可変にするかどうか, by default False
+            dynamic_hw (bool): エントリにdynamic_hwが無い場合に入力の高さと幅を可変にするかどうか, by default False
+            pycmd (str): Pythonコマンドのパス, by default 'python'
+
+        Returns:
+            dict: モデルごとの変換結果を示す辞書
+        """
+        if manifest_file is None:
+            self.logger.error(f"Please specify the --yolox_manifest option.")
+            return {'error':f"Please specify the --yolox_manifest option."}
+        manifest_file = Path(manifest_file) if isinstance(manifest_file, str) else manifest_file
+        if not manifest_file.exists():
+            self.logger.error(f"Manifest file not found. ({manifest_file})")
+            return {'error':f"Manifest file not found. ({manifest_file})"}
+        try:
+            entries = common.load_manifest(manifest_file)
+        except Exception as e:
+            self.logger.error(f"Manifest load failed. {e}")
+            return {'error':f"Manifest load failed. {e}"}
+
+        workers = common.max_workers(int(worker_mem) * 1024 * 1024, max_count=min(int(max_workers or len(entries)), len(entries)))
+        if self.backend == 'worker':
+            ret = self._worker_start()
+            if 'error' in ret:
+                return ret
+            workers = 1
+        self.logger.info(f"Convert batch start. models={len(entries)}, workers={workers}")
+
+        def _convert(entry:dict):
+            tm = time.perf_counter()
+            model_name = entry.get('model_name') if isinstance(entry, dict) else None
+            weight_file = entry.get('weight_file') if isinstance(entry, dict) else None
+            output_file = entry.get('output_file') if isinstance(entry, dict) else None
+            if model_name is None or weight_file is None:
+                ret = {'error':f"model_name and weight_file are required. entry={entry}"}
+            else:
+                try:
+                    ret = self.convert(model_name=model_name, weight_file=weight_file, output_file=output_file,
+                                       model_img_size=entry.get('model_img_size'), opset=entry.get('opset', opset),
+                                       use_cache=use_cache, verify=verify, optimize=optimize, img_sizes=entry.get('img_sizes'),
+                                       dynamic_batch=entry.get('dynamic_batch', dynamic_batch), dynamic_hw=entry.get('dynamic_hw', dynamic_hw),
+                                       pycmd=pycmd)
+                except Exception as e:
+                    self.logger.error(f"Convert failed. model_name={model_name}, {e}", exc_info=True)
+                    ret = {'error':f"Convert failed. {e}"}
+            return {'model_name':model_name, 'weight_file':weight_file,
+                    'status':'success' if 'success' in ret else 'error',
+                    'result':ret.get('success', ret.get('error')),
+                    'elapsed':f"{time.perf_counter() - tm:.03f}"}
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_convert, entries))
+        return {'success':results}
+
+
+    @trace.traced('inference')
     def inference(self, onnx_file:Path, input_image:Path = Path('assets/dog.jpg'), output_dir:Path = Path('inference/output'), score_th:float=0.3, input_size:int=416, output_preview:bool=False, pycmd:str = 'python'):
         """
         ONNXファイルを使用して推論を実行します。
@@ -162,6 +1163,7 @@ class Yolox(object):
         Returns:
             dict: 処理結果を示す辞書。成功時は{'success': 'outfile=<出力ファイルパス>'}、失敗時は{'error': '<エラーメッセージ>'}
         """
+        import cv2
         cwd = Path('./YOLOX')
         if not cwd.exists() or not (cwd / '.venv').exists():
             self.logger.error(f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'.")
@@ -170,18 +1172,391 @@ class Yolox(object):
         input_image = Path(input_image) if isinstance(input_image, str) else input_image
         output_dir = Path(output_dir) if isinstance(output_dir, str) else output_dir
 
-        actcmd = '.venv\\Scripts\\activate.bat' if platform.system() == 'Windows' else '.venv/Scripts/activate'
-        self.logger.debug(f"Current directory:{cwd}")
-        returncode, _ = common.cmd(f"{actcmd} && {pycmd} demo/ONNXRuntime/onnx_inference.py -m {onnx_file} --image_path {input_image} --output_dir {output_dir} "
-                                    f"--score_thr {score_th} --input_shape {input_size},{input_size}", self.logger, cwd=cwd)
-        if returncode != 0:
-            self.logger.error(f"Onnx inference failed. returncode={returncode}")
-            return {'error':f"Onnx inference failed. returncode={returncode}"}
-        outfile = common.find_max_update_file(cwd / output_dir, '**/*.jpg')
+        # 実行ごとに別のディレクトリに保存するため、出力ファイルのパスは入力ファイル名から決まる
+        from pth2onnx.app.runs import Run
+        run = Run('inference', cwd / output_dir)
+        if self.backend == 'worker':
+            ret = self._worker_request(dict(op='inference', onnx_file=onnx_file, input_image=input_image, output_dir=output_dir / run.run_id,
+                                            score_th=score_th, input_size=input_size))
+            if 'error' in ret:
+                self.logger.error(f"Onnx inference failed. {ret['error']}")
+                self._record_run(run, 'error', [dict(input=cwd / input_image)], model=cwd / onnx_file)
+                return ret
+        else:
+            self.logger.debug(f"Current directory:{cwd}")
+            ret = self._run(self._pycmd(cwd, pycmd) + ['demo/ONNXRuntime/onnx_inference.py', '-m', onnx_file, '--image_path', input_image,
+                                                     '--output_dir', output_dir / run.run_id, '--score_thr', score_th,
+                                                     '--input_shape', f"{input_size},{input_size}"],
+                            cwd, 'Onnx inference')
+            if 'error' in ret:
+                self._record_run(run, 'error', [dict(input=cwd / input_image)], model=cwd / onnx_file)
+                return ret
+        outfile = run.run_dir / input_image.name
+        run.write(dict(image=str(cwd / input_image), output=str(outfile), detections=None,
+                       elapsed_ms=round((time.perf_counter() - run.tm) * 1000, 1)))
+        self._record_run(run, 'success', run.items(), model=cwd / onnx_file, score_th=score_th, input_size=input_size)
         if output_preview:
             with open(outfile, 'rb') as f:
                 img_npy = common.imgfile2npy(f)
                 cv2.imshow(str(outfile), img_npy)
                 cv2.waitKey(0)
-            return {'success':f"outfile={outfile}"}
+        return {'success':f"outfile={outfile}, run_id={run.run_id}"}
+
+
+    @trace.traced('inference_native')
+    def inference_native(self, onnx_file:Path, input_dir:Path = None, input_video:Path = None, output_jsonl:Path = None,
+                         output_dir:Path = Path('inference/output'), score_th:float=0.3, nms_th:float=0.45, input_size:int=416,
+                         batch_size:int=1, intra_op_threads:int=0, inter_op_threads:int=0, decode_threads:int=2, encode_threads:int=2,
+                         queue_size:int=16):
+        """
+        ディレクトリ内の画像または動画ファイルのフレームをpth2onnxのプロセス内で推論します。
+        デコード、推論、描画とエンコードはキューでつないだパイプラインで並行して実行し、
+        検出結果を描画した画像(動画)と、入力順のJSONL形式の検出結果を実行ごとのディレクトリに保存し、実行の索引に記録します。
+        YOLOXのインストールは不要で、パスはカレントディレクトリからの相対パスです。
+
+        Parameters:
+            onnx_file (Path): ONNXファイルのパス
+            input_dir (Path, optional): 入力画像のディレクトリのパス (デフォルトはNone)
+            input_video (Path, optional): 入力動画ファイルのパス (デフォルトはNone)
+            output_jsonl (Path, optional): 検出結果を保存するJSONLファイル(マニフェスト)のパス (デフォルトは<output_dir>/<実行ID>/manifest.jsonl)
+            output_dir (Path, optional): 実行ごとの出力ディレクトリを作成するディレクトリのパス (デフォルトはPath('inference/output'))
+            score_th (float, optional): スコアの閾値 (デフォルトは0.3)
+            nms_th (float, optional): NMSの閾値 (デフォルトは0.45)
+            input_size (int, optional): 入力画像のサイズ (デフォルトは416)
+            batch_size (int, optional): バッチサイズ (デフォルトは1)
+            intra_op_threads (int, optional): オペレータ内の並列スレッド数。0は既定値 (デフォルトは0)
+            inter_op_threads (int, optional): オペレータ間の並列スレッド数。0は既定値 (デフォルトは0)
+            decode_threads (int, optional): 画像のデコードのスレッド数 (デフォルトは2)
+            encode_threads (int, optional): 描画とエンコードのスレッド数 (デフォルトは2)
+            queue_size (int, optional): パイプラインの各段の間のキューの上限 (デフォルトは16)
+
+        Returns:
+            dict: 処理結果を示す辞書
+        """
+        from pth2onnx.app import engine, pipeline
+        from pth2onnx.app.runs import Run
+        onnx_file = Path(onnx_file) if isinstance(onnx_file, str) else onnx_file
+        run = Run('inference_native', output_dir, manifest_file=output_jsonl)
+        output_dir, output_jsonl = run.run_dir, run.manifest_file
+        if onnx_file is None or not onnx_file.exists():
+            self.logger.error(f"Onnx file not found. ({onnx_file})")
+            return {'error':f"Onnx file not found. ({onnx_file})"}
+        input_dir = Path(input_dir) if isinstance(input_dir, str) else input_dir
+        if input_video is None and (input_dir is None or not input_dir.is_dir()):
+            self.logger.error(f"Input directory not found. ({input_dir})")
+            return {'error':f"Input directory not found. ({input_dir})"}
+
+        # モデルを読み込めない場合に動画を開いたままにしないよう、ソースとシンクより先にセッションを作成する
+        tm = time.perf_counter()
+        try:
+            eng = engine.OnnxEngine(onnx_file, input_size=input_size, batch_size=batch_size,
+                                    intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+        except Exception as e:
+            self.logger.error(f"Session create failed. onnx_file={onnx_file}, {e}", exc_info=True)
+            return {'error':f"Session create failed. onnx_file={onnx_file}, {e}"}
+        self.logger.info(f"Session created. onnx_file={onnx_file}, elapsed={time.perf_counter() - tm:.03f}")
+        common.mkdirs(output_dir)
+        common.mkdirs(output_jsonl.parent)
+        if input_video is not None:
+            try:
+                source = pipeline.VideoSource(input_video)
+            except ValueError as e:
+                self.logger.error(f"{e}")
+                return {'error':f"{e}"}
+            outfile = output_dir / (Path(str(input_video)).stem + '.mp4')
+            sink = pipeline.VideoSink(outfile, source.fps, source.size, output_jsonl)
+        else:
+            source = pipeline.ImageDirSource(input_dir)
+            outfile = output_dir
+            sink = pipeline.ImageDirSink(input_dir, output_dir, output_jsonl)
+
+        pipe = pipeline.Pipeline(eng, score_th=score_th, nms_th=nms_th, decode_threads=decode_threads, encode_threads=encode_threads,
+                                 queue_size=queue_size, logger=self.logger)
+        ret = pipe.run(source, sink)
+        for stage in ret['stages']:
+            self.logger.info(f"Stage {stage['stage']}: items={stage['items']}, busy_sec={stage['busy_sec']}, items_per_sec={stage['items_per_sec']}")
+        stages = {f"{stage['stage']}_per_sec":stage['items_per_sec'] for stage in ret['stages']}
+        items = run.items(input_file=input_video, output_file=outfile) if input_video is not None else run.items()
+        self._record_run(run, 'error' if len(ret['errors_detail']) > 0 else 'success', items, model=onnx_file,
+                         outputs=ret['outputs'], errors=ret['errors'], elapsed=ret['elapsed'], **stages)
+        if len(ret['errors_detail']) > 0:
+            return {'error':f"Inference failed. {ret['errors_detail']}"}
+        return {'success':dict(run_id=run.run_id, outfile=str(outfile), jsonl=str(output_jsonl), outputs=ret['outputs'], errors=ret['errors'],
+                               batch_size=eng.batch_size, elapsed=ret['elapsed'],
+                               outputs_per_sec=round(ret['outputs'] / ret['elapsed'], 2) if ret['elapsed'] > 0 else None, **stages)}
+
+
+    def serve(self, onnx_file:str, host:str = '127.0.0.1', port:int = 8080, max_batch_size:int = 8, max_wait:float = 5.0,
+              max_queue:int = 256, score_th:float = 0.3, nms_th:float = 0.45, input_size:int = 416, intra_op_threads:int = 0,
+              inter_op_threads:int = 0, boot_path:str = '/index.html', memory_budget:int = 0, sessions_per_model:int = 1,
+              idle_timeout:float = 0, max_body_size:int = 16):
+        """
+        画像をPOSTすると検出結果を返すHTTPサーバーを起動する。
+        ONNXモデルはカンマ区切りで複数指定でき、要求のmodelパラメータ(ファイル名の拡張子を除いた部分)で推論するモデルを選ぶ。
+        モデルは最初に使われたときにロードし、メモリ使用量の上限を超える場合は最後に使われた日時が古いものから破棄する。
+        同時に届いた要求はmax_batch_size件またはmax_wait(ミリ秒)を上限にまとめて推論する。
+        Ctrl+Cで終了し、終了時のメトリクスとセッションプールのヒット、ミス、破棄の回数を返す。YOLOXのインストールは不要で、パスはカレントディレクトリからの相対パス。
+
+        Parameters:
+            onnx_file (str): ONNXファイルのパス。カンマ区切りで複数指定できる
+            host (str, optional): 待ち受けるアドレス (デフォルトは'127.0.0.1')
+            port (int, optional): 待ち受けるポート (デフォルトは8080)
+            max_batch_size (int, optional): まとめる要求の最大数。モデルのバッチサイズが固定の場合はその単位に分けて推論する (デフォルトは8)
+            max_wait (float, optional): 最初の要求が届いてから推論を始めるまでの最大の待ち時間(ミリ秒) (デフォルトは5.0)
+            max_queue (int, optional): モデルごとに待たせる要求の上限。超えた要求には503を返す (デフォルトは256)
+            score_th (float, optional): スコアの閾値 (デフォルトは0.3)
+            nms_th (float, optional): NMSの閾値 (デフォルトは0.45)
+            input_size (int, optional): 入力画像のサイズ (デフォルトは416)
+            intra_op_threads (int, optional): オペレータ内の並列スレッド数。0は既定値 (デフォルトは0)
+            inter_op_threads (int, optional): オペレータ間の並列スレッド数。0は既定値 (デフォルトは0)
+            boot_path (str, optional): 画像をアップロードする画面のパス (デフォルトは'/index.html')
+            memory_budget (int, optional): ロードしたモデルのメモリ使用量の合計の上限(MB)。0は無制限 (デフォルトは0)
+            sessions_per_model (int, optional): 並行して推論するためにモデルごとに作成するセッションの最大数 (デフォルトは1)
+            idle_timeout (float, optional): 使われていないセッションを破棄するまでの時間(秒)。0は破棄しない (デフォルトは0)
+            max_body_size (int, optional): POSTの本文の最大サイズ(MB)。超えた要求には413を返す (デフォルトは16)
+
+        Returns:
+            dict: 処理結果を示す辞書
+        """
+        from pth2onnx.app import server, sessions
+        if onnx_file is None:
+            self.logger.error(f"Onnx file not found. ({onnx_file})")
+            return {'error':f"Onnx file not found. ({onnx_file})"}
+        models = dict()
+        for f in [Path(f.strip()) for f in str(onnx_file).split(',') if f.strip()]:
+            if not f.exists():
+                self.logger.error(f"Onnx file not found. ({f})")
+                return {'error':f"Onnx file not found. ({f})"}
+            if f.stem in models:
+                self.logger.error(f"Duplicate model name. ({f.stem})")
+                return {'error':f"Duplicate model name. ({f.stem})"}
+            models[f.stem] = f
+        pool = sessions.SessionPool(memory_budget=memory_budget, sessions_per_model=sessions_per_model, idle_timeout=idle_timeout,
+                                    input_size=input_size, batch_size=max_batch_size, intra_op_threads=intra_op_threads,
+                                    inter_op_threads=inter_op_threads, logger=self.logger)
+        try:
+            metrics = server.serve(pool, models, host=host, port=port, max_batch_size=max_batch_size, max_wait=max_wait, max_queue=max_queue,
+                                   score_th=score_th, nms_th=nms_th, boot_path=boot_path, max_body_size=max_body_size, logger=self.logger)
+        except OSError as e:
+            self.logger.error(f"Server failed. {e}", exc_info=True)
+            return {'error':f"Server failed. {e}"}
+        return {'success':metrics}
 
+
+    @trace.traced('inference_stream')
+    def inference_stream(self, onnx_file:Path, input_video:str, output_jsonl:Path = None, output_dir:Path = Path('inference/output'),
+                         score_th:float=0.3, nms_th:float=0.45, input_size:int=416, target_latency:float=None, max_frames:int=0,
+                         intra_op_threads:int=0, inter_op_threads:int=0, output_preview:bool=False):
+        """
+        動画ファイルまたはカメラの映像をpth2onnxのプロセス内でリアルタイムに推論します。
+        推論が追いつかない場合はフレームを溜めずに破棄し、常に最新のフレームを推論します。
+        動画ファイルはフレームレートに合わせて読み込むため、カメラと同じ条件で遅延を測定できます。
+        検出結果を描画した動画と、推論したフレームごとのJSONL形式の検出結果を実行ごとのディレクトリに保存し、実行の索引に記録します。
+
+        Parameters:
+            onnx_file (Path): ONNXファイルのパス
+            input_video (str): 入力動画ファイルのパス、またはカメラの番号
+            output_jsonl (Path, optional): 検出結果を保存するJSONLファイル(マニフェスト)のパス (デフォルトは<output_dir>/<実行ID>/manifest.jsonl)
+            output_dir (Path, optional): 実行ごとの出力ディレクトリを作成するディレクトリのパス (デフォルトはPath('inference/output'))
+            score_th (float, optional): スコアの閾値 (デフォルトは0.3)
+            nms_th (float, optional): NMSの閾値 (デフォルトは0.45)
+            input_size (int, optional): 入力画像のサイズ (デフォルトは416)
+            target_latency (float, optional): 目標とするフレームごとの遅延(ミリ秒)。超えたフレームは破棄 (デフォルトはNone)
+            max_frames (int, optional): キャプチャする最大フレーム数。0は無制限 (デフォルトは0)
+            intra_op_threads (int, optional): オペレータ内の並列スレッド数。0は既定値 (デフォルトは0)
+            inter_op_threads (int, optional): オペレータ間の並列スレッド数。0は既定値 (デフォルトは0)
+            output_preview (bool, optional): 推論結果をウインドウに表示するかどうか。qキーで終了 (デフォルトはFalse)
+
+        Returns:
+            dict: 処理結果を示す辞書
+        """
+        from pth2onnx.app import engine, pipeline, stream
+        from pth2onnx.app.runs import Run
+        onnx_file = Path(onnx_file) if isinstance(onnx_file, str) else onnx_file
+        run = Run('inference_stream', output_dir, manifest_file=output_jsonl)
+        output_dir, output_jsonl = run.run_dir, run.manifest_file
+        if onnx_file is None or not onnx_file.exists():
+            self.logger.error(f"Onnx file not found. ({onnx_file})")
+            return {'error':f"Onnx file not found. ({onnx_file})"}
+        # モデルを読み込めない場合にカメラや動画を開いたままにしないよう、ソースとシンクより先にセッションを作成する
+        tm = time.perf_counter()
+        try:
+            eng = engine.OnnxEngine(onnx_file, input_size=input_size, batch_size=1,
+                                    intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+        except Exception as e:
+            self.logger.error(f"Session create failed. onnx_file={onnx_file}, {e}", exc_info=True)
+            return {'error':f"Session create failed. onnx_file={onnx_file}, {e}"}
+        self.logger.info(f"Session created. onnx_file={onnx_file}, elapsed={time.perf_counter() - tm:.03f}")
+        try:
+            source = stream.StreamSource(input_video)
+        except ValueError as e:
+            self.logger.error(f"{e}")
+            return {'error':f"{e}"}
+        common.mkdirs(output_dir)
+        common.mkdirs(output_jsonl.parent)
+        outfile = output_dir / ((f"camera{source.name}" if source.realtime else Path(source.name).stem) + '.mp4')
+        sink = pipeline.VideoSink(outfile, source.fps, source.size, output_jsonl)
+
+        runner = stream.StreamRunner(eng, score_th=score_th, nms_th=nms_th, target_latency=target_latency, logger=self.logger)
+        try:
+            ret = runner.run(source, sink, output_preview=output_preview, max_frames=max_frames)
+        except Exception as e:
+            # ソースとシンクはrunの中で閉じられる
+            self.logger.error(f"Stream failed. input_video={input_video}, {e}", exc_info=True)
+            self._record_run(run, 'error', run.items(input_file=input_video, output_file=outfile), model=onnx_file,
+                             target_latency_ms=target_latency)
+            return {'error':f"Stream failed. input_video={input_video}, {e}"}
+        self.logger.info(f"Stream finished. {ret}")
+        self._record_run(run, 'success', run.items(input_file=input_video, output_file=outfile), model=onnx_file,
+                         target_latency_ms=target_latency, **ret)
+        return {'success':dict(run_id=run.run_id, outfile=str(outfile), jsonl=str(output_jsonl), target_latency_ms=target_latency, **ret)}
+
+
+    @trace.traced('eval')
+    def eval(self, onnx_file:str, ann_file:Path, image_dir:Path, output_dir:Path = Path('inference/output'), input_size:int = 416,
+             batch_size:int = 1, score_th:float = 0.01, nms_th:float = 0.65, max_images:int = 0, intra_op_threads:int = 0,
+             inter_op_threads:int = 0, decode_threads:int = 2, encode_threads:int = 2, queue_size:int = 16):
+        """
+        COCO形式のアノテーションファイルと画像ディレクトリでONNXモデルを評価し、精度と速度を合わせて測定する。
+        ONNXモデルはカンマ区切りで複数指定でき、同じ画像で順に評価する。
+        デコードと前処理、推論、後処理はパイプラインで並行して実行し、前処理と後処理は複数のスレッドで行う。
+        モデルごとのmAP@[.5:.95]、mAP@.5、1秒あたりの画像数、遅延のパーセンタイルを実行ごとのディレクトリのreport.jsonに保存する。
+        画像ごとの検出結果はスコアの高い順に100件までをマニフェストに記録する。
+        YOLOXのインストールは不要で、パスはカレントディレクトリからの相対パス。
+
+        Args:
+            onnx_file (str): ONNXファイルのパス。カンマ区切りで複数指定できる
+            ann_file (Path): COCO形式のアノテーションファイル(JSON)のパス
+            image_dir (Path): 画像ディレクトリのパス
+            output_dir (Path): 実行ごとの出力ディレクトリを作成するディレクトリのパス, by default Path('inference/output')
+            input_size (int): 入力画像のサイズ。モデルの入力が固定サイズの場合はそちらを優先, by default 416
+            batch_size (int): バッチサイズ, by default 1
+            score_th (float): スコアの閾値, by default 0.01
+            nms_th (float): NMSの閾値, by default 0.65
+            max_images (int): 評価する画像の最大数。0は全件, by default 0
+            intra_op_threads (int): オペレータ内の並列スレッド数。0は既定値, by default 0
+            inter_op_threads (int): オペレータ間の並列スレッド数。0は既定値, by default 0
+            decode_threads (int): デコードと前処理のスレッド数, by default 2
+            encode_threads (int): 後処理のスレッド数, by default 2
+            queue_size (int): パイプラインの各段の間のキューの上限, by default 16
+
+        Returns:
+            dict: モデルごとの精度と速度を示す辞書
+        """
+        from pth2onnx.app import evaluate, postprocess
+        from pth2onnx.app.runs import Run
+        if onnx_file is None:
+            self.logger.error(f"Onnx file not found. ({onnx_file})")
+            return {'error':f"Onnx file not found. ({onnx_file})"}
+        onnx_files = [Path(f.strip()) for f in str(onnx_file).split(',') if f.strip()]
+        for f in onnx_files:
+            if not f.exists():
+                self.logger.error(f"Onnx file not found. ({f})")
+                return {'error':f"Onnx file not found. ({f})"}
+        if ann_file is None or not Path(ann_file).is_file():
+            self.logger.error(f"Annotation file not found. ({ann_file})")
+            return {'error':f"Annotation file not found. ({ann_file})"}
+        if image_dir is None or not Path(image_dir).is_dir():
+            self.logger.error(f"Image directory not found. ({image_dir})")
+            return {'error':f"Image directory not found. ({image_dir})"}
+        try:
+            dataset = evaluate.CocoDataset(ann_file, image_dir, max_images=max_images)
+        except (ValueError, KeyError, TypeError) as e:
+            self.logger.error(f"Annotation file load failed. {e}")
+            return {'error':f"Annotation file load failed. {e}"}
+        if len(dataset) == 0:
+            self.logger.error(f"Images not found in the annotation file. ({ann_file})")
+            return {'error':f"Images not found in the annotation file. ({ann_file})"}
+
+        run = Run('eval', output_dir)
+        common.mkdirs(run.run_dir)
+        reports = []
+        for f in onnx_files:
+            try:
+                report, dets = evaluate.evaluate(f, dataset, input_size=input_size, batch_size=batch_size, score_th=score_th, nms_th=nms_th,
+                                                 intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads,
+                                                 decode_threads=decode_threads, encode_threads=encode_threads, queue_size=queue_size,
+                                                 logger=self.logger)
+            except Exception as e:
+                # モデルの読み込みに失敗した場合(onnxruntimeのInvalidProtobufなど)も含む
+                self.logger.error(f"Evaluation failed. model={f}, {e}", exc_info=True)
+                self._record_run(run, 'error', run.items(), model=f)
+                return {'error':f"Evaluation failed. model={f}, {e}"}
+            self.logger.info(f"Evaluated. model={f}, mAP={report['mAP']}, mAP50={report['mAP50']}, images_per_sec={report['images_per_sec']}")
+            # マニフェストにはCOCOの検出結果の形式に合わせて画像ごとにスコアの高い順に100件までを記録する
+            for img in dataset.images:
+                if img['id'] in dets:
+                    record = postprocess.dets2dict(dataset.image_dir / img['file_name'], evaluate.top_detections(dets[img['id']]))
+                    run.write(dict(record, model=str(f), image_id=img['id']))
+            reports.append(report)
+        report_file = run.run_dir / 'report.json'
+        with open(report_file, 'w', encoding='utf-8') as fp:
+            json.dump(dict(run_id=run.run_id, ann_file=str(ann_file), image_dir=str(image_dir), images=len(dataset),
+                           score_th=score_th, nms_th=nms_th, models=reports), fp, indent=2)
+        summary = [{k:r[k] for k in ('model', 'mAP', 'mAP50', 'mAP75', 'images_per_sec', 'latency_ms', 'infer_ms')} for r in reports]
+        self._record_run(run, 'success', run.items(), model=','.join(str(f) for f in onnx_files), report=report_file, models=summary)
+        return {'success':dict(run_id=run.run_id, report=str(report_file), images=len(dataset), models=summary)}
+
+
+    def bench(self, model_name:str, weight_file:Path = None, onnx_file:Path = None, img_size:int = None, batch_sizes:List[int] = [1, 4, 16],
+              warmup:int = 5, iterations:int = 50, threads:int = 0):
+        """
+        PyTorchモデルとONNXモデルの推論時間を測定して比較する。
+        バックエンドごとにYOLOXの仮想環境で別プロセスを起動して測定するため、ピークRSSも個別に求まる。
+        パスはYOLOXディレクトリからの相対パス。
+
+        Parameters:
+            model_name (str): モデル名
+            weight_file (Path, optional): pytorchの重みファイルのパス。URLの場合はダウンロードする。省略時はPyTorchを測定しない (デフォルトはNone)
+            onnx_file (Path, optional): ONNXファイルのパス。省略時はONNX Runtimeを測定しない (デフォルトはNone)
+            img_size (int, optional): 入力画像のサイズ。省略時はモデルの既定値 (デフォルトはNone)
+            batch_sizes (List[int], optional): バッチサイズのリスト (デフォルトは[1, 4, 16])
+            warmup (int, optional): 測定前に実行する回数 (デフォルトは5)
+            iterations (int, optional): 測定する回数 (デフォルトは50)
+            threads (int, optional): 推論のスレッド数。0は既定値 (デフォルトは0)
+
+        Returns:
+            dict: 処理結果を示す辞書。成功時はバックエンド、入力サイズ、バッチサイズごとの測定結果のリスト
+        """
+        cwd = Path('./YOLOX')
+        if not cwd.exists() or not (cwd / '.venv').exists():
+            self.logger.error(f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'.")
+            return {'error':f"YOLOX is not installed. Run the command 'pth2onnx -m yolox -c install -f'."}
+        if weight_file is None and onnx_file is None:
+            self.logger.error(f"Please specify the --yolox_weight_file or --yolox_onnx_file option.")
+            return {'error':f"Please specify the --yolox_weight_file or --yolox_onnx_file option."}
+        ret = self._weight_file(weight_file)
+        if 'error' in ret:
+            return ret
+        weight_file = ret['success']
+        for file in (weight_file, onnx_file):
+            if file is not None and not (cwd / file).exists():
+                self.logger.error(f"File not found. ({cwd / file})")
+                return {'error':f"File not found. ({cwd / file})"}
+        req = dict(op='bench', model_name=model_name, weight_file=weight_file, onnx_file=onnx_file,
+                   img_sizes=[img_size] if img_size else None, batch_sizes=batch_sizes, warmup=warmup, iterations=iterations, threads=threads)
+        rows = []
+        for backend, file in (('torch', weight_file), ('onnx', onnx_file)):
+            if file is None:
+                continue
+            ret = self._worker_oneshot(dict(req, backend=backend), cwd)
+            if 'error' in ret:
+                return ret
+            for r in ret['success']:
+                row = dict(backend=r['backend'], img_size=r['img_size'], batch_size=r['batch_size'])
+                if 'error' in r:
+                    self.logger.warning(f"Bench skipped. {row} {r['error']}")
+                    continue
+                row.update({f"{k}_ms":v for k, v in common.percentiles(r['latencies'], scale=1000, ndigits=2).items()})
+                row['imgs_per_sec'] = round(r['batch_size'] * len(r['latencies']) / sum(r['latencies']), 2)
+                row['peak_rss_mb'] = r['peak_rss_mb']
+                rows.append(row)
+                if backend == 'onnx':
+                    self._record_bench(cwd / onnx_file, row['mean_ms'], name=model_name, p95_ms=row['p95_ms'],
+                                       batch_size=row['batch_size'], threads=threads or None)
+        # ONNX Runtimeの行に、同じ条件のPyTorchに対する速度比を付ける
+        torch_mean = {(r['img_size'], r['batch_size']):r['mean_ms'] for r in rows if r['backend'] == 'torch'}
+        for row in rows:
+            base = torch_mean.get((row['img_size'], row['batch_size']))
+            row['speedup'] = round(base / row['mean_ms'], 2) if base and row['mean_ms'] else None
+        return {'success':rows}
@@ -0,0 +1,488 @@
+"""
+YOLOXの仮想環境(YOLOX/.venv)内で動作する常駐ワーカー
+
+このスクリプトはpth2onnx本体ではなくYOLOXの仮想環境のPythonで実行されるため、
+pth2onnxのモジュールはimportせず、標準ライブラリとYOLOXの依存パッケージのみを使用する。
+torch、YOLOX、onnxruntimeのimportとモデルのロードを一度だけ行い、
+JSON形式のリクエストを受け付けて処理する。
+
+起動方法:
+    # 常駐モード(ローカルホストのポートで待ち受ける)
+    python yolox_worker.py serve --state_file <状態ファイルのパス>
+    # 単発モード(標準入力のJSONリクエストを1件処理して結果を標準出力に書き出す)
+    python yolox_worker.py oneshot
+"""
+from multiprocessing.connection import Listener
+from pathlib import Path
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+AUTHKEY_ENV = 'PTH2ONNX_WORKER_AUTHKEY'
+
+logger = logging.getLogger('yolox_worker')
+
+
+class ModelCache(object):
+    def __init__(self):
+        """
+        ロード済みのPyTorchモデルとONNX Runtimeセッションを保持するキャッシュ
+        """
+        self.models = dict()
+        self.sessions = dict()
+        self.lock = threading.Lock()
+
+    def get_model(self, model_name:str, weight_file:str):
+        """
+        PyTorchモデルを取得する。未ロードの場合はロードしてキャッシュする。
+        重みファイルが更新されている場合はロードし直す。
+
+        Args:
+            model_name (str): モデル名
+            weight_file (str): 重みファイルのパス
+
+        Returns:
+            Tuple[Exp, torch.nn.Module]: YOLOXのExpオブジェクトとモデル
+        """
+        key = (model_name, str(Path(weight_file).resolve()))
+        mtime = os.stat(weight_file).st_mtime
+        with self.lock:
+            if key in self.models and self.models[key][0] == mtime:
+                return self.models[key][1], self.models[key][2]
+        import torch
+        from torch import nn
+        from yolox.exp import get_exp
+        from yolox.models.network_blocks import SiLU
+        from yolox.utils import replace_module
+        exp = get_exp(None, model_name)
+        model = exp.get_model()
+        ckpt = torch.load(weight_file, map_location='cpu')
+        if 'model' in ckpt:
+            ckpt = ckpt['model']
+        model.load_state_dict(ckpt)
+        model = replace_module(model, nn.SiLU, SiLU)
+        model.eval()
+        logger.info(f"Model loaded. model_name={model_name}, weight_file={weight_file}")
+        with self.lock:
+            self.models[key] = (mtime, exp, model)
+        return exp, model
+
+    def get_session(self, onnx_file:str):
+        """
+        ONNX Runtimeセッションを取得する。未作成の場合は作成してキャッシュする。
+        ONNXファイルが更新されている場合は作成し直す。
+
+        Args:
+            onnx_file (str): ONNXファイルのパス
+
+        Returns:
+            onnxruntime.InferenceSession: セッション
+        """
+        key = str(Path(onnx_file).resolve())
+        mtime = os.stat(onnx_file).st_mtime
+        with self.lock:
+            if key in self.sessions and self.sessions[key][0] == mtime:
+                return self.sessions[key][1]
+        import onnxruntime
+        session = onnxruntime.InferenceSession(onnx_file, providers=['CPUExecutionProvider'])
+        logger.info(f"Session created. onnx_file={onnx_file}")
+        with self.lock:
+            self.sessions[key] = (mtime, session)
+        return session
+
+    def status(self):
+        """
+        キャッシュの状態を返す
+
+        Returns:
+            dict: キャッシュされているモデルとセッションの一覧
+        """
+        with self.lock:
+            return dict(models=[f"{k[0]}:{k[1]}" for k in self.models.keys()],
+                        sessions=list(self.sessions.keys()))
+
+
+def op_convert(cache:ModelCache, req:dict):
+    """
+    PyTorchモデルをONNXにエクスポートする。
+    処理内容はYOLOXのtools/export_onnx.pyに合わせている。
+    exportsに複数の出力ファイルと入力サイズを指定すると、ロードしたモデルを使い回して続けてエクスポートする。
+
+    Args:
+        cache (ModelCache): モデルキャッシュ
+        req (dict): model_name, weight_file, output_file, img_size, opset, dynamic_batch, dynamic_hw を持つリクエスト。
+            複数エクスポートする場合はoutput_fileとimg_sizeの代わりにexports([{output_file, img_size}, ...])
+
+    Returns:
+        dict: 処理結果
+    """
+    import torch
+    exp, model = cache.get_model(req['model_name'], req['weight_file'])
+    exports = req.get('exports') or [dict(output_file=req['output_file'], img_size=req.get('img_size'))]
+    dynamic_axes = None
+    if req.get('dynamic_batch') or req.get('dynamic_hw'):
+        dynamic_axes = dict(images=dict(), output=dict())
+        if req.get('dynamic_batch'):
+            dynamic_axes['images'][0] = 'batch'
+            dynamic_axes['output'][0] = 'batch'
+        if req.get('dynamic_hw'):
+            dynamic_axes['images'].update({2:'height', 3:'width'})
+            dynamic_axes['output'][1] = 'anchors'
+    outfiles = []
+    for e in exports:
+        test_size = (int(e['img_size']), int(e['img_size'])) if e.get('img_size') else exp.test_size
+        dummy_input = torch.randn(1, 3, test_size[0], test_size[1])
+        with cache.lock:
+            model.head.decode_in_inference = False
+            torch.onnx.export(model, dummy_input, e['output_file'], input_names=['images'], output_names=['output'],
+                              dynamic_axes=dynamic_axes, opset_version=int(req.get('opset', 11)))
+        outfiles.append(e['output_file'])
+    return {'success':{'outfile':outfiles[0], 'outfiles':outfiles}}
+
+
+def op_demo(cache:ModelCache, req:dict):
+    """
+    PyTorchモデルで画像の物体検出を行い、結果を描画した画像を保存する。
+    処理内容はYOLOXのtools/demo.pyに合わせている。
+
+    Args:
+        cache (ModelCache): モデルキャッシュ
+        req (dict): model_name, weight_file, input_image, conf, nms, tsize, save_dir を持つリクエスト。
+            save_dirがない場合はYOLOX_outputs/<実験名>/vis_res/<日時>に保存する
+
+    Returns:
+        dict: 処理結果
+    """
+    import cv2
+    import torch
+    from yolox.data.data_augment import ValTransform
+    from yolox.data.datasets import COCO_CLASSES
+    from yolox.utils import postprocess, vis
+    exp, model = cache.get_model(req['model_name'], req['weight_file'])
+    tsize = int(req.get('tsize', exp.test_size[0]))
+    conf, nms = float(req.get('conf', 0.25)), float(req.get('nms', 0.45))
+    img = cv2.imread(req['input_image'])
+    if img is None:
+        return {'error':f"Image load failed. ({req['input_image']})"}
+    ratio = min(tsize / img.shape[0], tsize / img.shape[1])
+    img_t, _ = ValTransform(legacy=False)(img, None, (tsize, tsize))
+    with cache.lock, torch.no_grad():
+        model.head.decode_in_inference = True
+        outputs = model(torch.from_numpy(img_t).unsqueeze(0).float())
+        outputs = postprocess(outputs, exp.num_classes, conf, nms, class_agnostic=True)
+    if outputs[0] is not None:
+        output = outputs[0].cpu()
+        img = vis(img, output[:, 0:4] / ratio, output[:, 4] * output[:, 5], output[:, 6], conf, COCO_CLASSES)
+    save_dir = Path(req['save_dir']) if req.get('save_dir') else \
+        Path('YOLOX_outputs') / exp.exp_name / 'vis_res' / time.strftime('%Y_%m_%d_%H_%M_%S', time.localtime())
+    save_dir.mkdir(parents=True, exist_ok=True)
+    outfile = save_dir / Path(req['input_image']).name
+    cv2.imwrite(str(outfile), img)
+    return {'success':{'outfile':str(outfile)}}
+
+
+def op_inference(cache:ModelCache, req:dict):
+    """
+    ONNXモデルで画像の物体検出を行い、結果を描画した画像を保存する。
+    処理内容はYOLOXのdemo/ONNXRuntime/onnx_inference.pyに合わせている。
+
+    Args:
+        cache (ModelCache): モデルキャッシュ
+        req (dict): onnx_file, input_image, output_dir, score_th, input_size を持つリクエスト
+
+    Returns:
+        dict: 処理結果
+    """
+    import cv2
+    import numpy as np
+    from yolox.data.data_augment import preproc
+    from yolox.data.datasets import COCO_CLASSES
+    from yolox.utils import demo_postprocess, multiclass_nms, vis
+    session = cache.get_session(req['onnx_file'])
+    input_shape = (int(req.get('input_size', 416)), int(req.get('input_size', 416)))
+    score_th = float(req.get('score_th', 0.3))
+    origin_img = cv2.imread(req['input_image'])
+    if origin_img is None:
+        return {'error':f"Image load failed. ({req['input_image']})"}
+    img, ratio = preproc(origin_img, input_shape)
+    output = session.run(None, {session.get_inputs()[0].name: img[None, :, :, :]})
+    predictions = demo_postprocess(output[0], input_shape)[0]
+    boxes = predictions[:, :4]
+    scores = predictions[:, 4:5] * predictions[:, 5:]
+    boxes_xyxy = np.ones_like(boxes)
+    boxes_xyxy[:, 0] = boxes[:, 0] - boxes[:, 2] / 2.
+    boxes_xyxy[:, 1] = boxes[:, 1] - boxes[:, 3] / 2.
+    boxes_xyxy[:, 2] = boxes[:, 0] + boxes[:, 2] / 2.
+    boxes_xyxy[:, 3] = boxes[:, 1] + boxes[:, 3] / 2.
+    boxes_xyxy /= ratio
+    dets = multiclass_nms(boxes_xyxy, scores, nms_thr=0.45, score_thr=0.1)
+    if dets is not None:
+        origin_img = vis(origin_img, dets[:, :4], dets[:, 4], dets[:, 5], conf=score_th, class_names=COCO_CLASSES)
+    output_dir = Path(req['output_dir'])
+    output_dir.mkdir(parents=True, exist_ok=True)
+    outfile = output_dir / Path(req['input_image']).name
+    cv2.imwrite(str(outfile), origin_img)
+    return {'success':{'outfile':str(outfile)}}
+
+
+def peak_rss():
+    """
+    このプロセスのピークRSS(MB)を返す
+
+    Returns:
+        float: ピークRSS(MB)。取得できない場合はNone
+    """
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOSはバイト、それ以外はキロバイト単位
+        return round(rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024, 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / 1024 / 1024, 1)
+    except ImportError:
+        return None
+
+
+def op_bench(cache:ModelCache, req:dict):
+    """
+    PyTorchモデルまたはONNXモデルの推論時間を測定する。
+    ピークRSSを比較できるよう、測定するバックエンドのライブラリだけをimportし、
+    バックエンドごとに別プロセスの単発モードで実行することを想定している。
+
+    Args:
+        cache (ModelCache): モデルキャッシュ
+        req (dict): backend('torch'または'onnx'), model_name, weight_file, onnx_file,
+            img_sizes, batch_sizes, warmup, iterations, threads, seed を持つリクエスト
+
+    Returns:
+        dict: 処理結果。成功時は入力サイズとバッチサイズの組み合わせごとの推論時間(秒)のリスト
+    """
+    import numpy as np
+    backend = req.get('backend')
+    img_sizes = [int(s) for s in req.get('img_sizes') or []]
+    batch_sizes = [int(b) for b in req.get('batch_sizes') or [1]]
+    warmup, iterations = int(req.get('warmup', 5)), int(req.get('iterations', 50))
+    threads = int(req.get('threads') or 0)
+    rng = np.random.default_rng(int(req.get('seed', 0)))
+    static_size = None
+    if backend == 'torch':
+        import torch
+        if threads > 0:
+            torch.set_num_threads(threads)
+        exp, model = cache.get_model(req['model_name'], req['weight_file'])
+        # ONNXにエクスポートされるグラフと同じくデコード前の出力で比較する
+        model.head.decode_in_inference = False
+        img_sizes = img_sizes or [exp.test_size[0]]
+        def run(x):
+            with torch.no_grad():
+                model(torch.from_numpy(x))
+    elif backend == 'onnx':
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        session = onnxruntime.InferenceSession(req['onnx_file'], sess_options=options, providers=['CPUExecutionProvider'])
+        model_input = session.get_inputs()[0]
+        shape = model_input.shape
+        model_batch = shape[0] if isinstance(shape[0], int) else None
+        static_size = shape[2] if isinstance(shape[2], int) else None
+        img_sizes = img_sizes or [static_size or 416]
+        def run(x):
+            # 固定バッチでエクスポートされたモデルはそのバッチサイズに分けて実行する
+            step = model_batch or x.shape[0]
+            for i in range(0, x.shape[0], step):
+                session.run(None, {model_input.name: x[i:i + step]})
+    else:
+        return {'error':f"Unknown backend. ({backend})"}
+    rows = []
+    for img_size in img_sizes:
+        for batch_size in batch_sizes:
+            row = dict(backend=backend, img_size=img_size, batch_size=batch_size)
+            if static_size is not None and static_size != img_size:
+                row['error'] = f"Model input size is fixed to {static_size}."
+                rows.append(row)
+                continue
+            x = rng.uniform(0, 255, (batch_size, 3, img_size, img_size)).astype(np.float32)
+            for _ in range(warmup):
+                run(x)
+            latencies = []
+            for _ in range(iterations):
+                tm = time.perf_counter()
+                run(x)
+                latencies.append(time.perf_counter() - tm)
+            row.update(latencies=latencies, peak_rss_mb=peak_rss())
+            rows.append(row)
+    return {'success':rows}
+
+
+def op_verify(cache:ModelCache, req:dict):
+    """
+    同じ入力をPyTorchモデルとONNXモデルで推論し、出力テンソルの誤差と検出結果を求める。
+    入力は実画像とシード固定の乱数で生成した合成画像で、前処理はYOLOXのValTransformに合わせている。
+
+    Args:
+        cache (ModelCache): モデルキャッシュ
+        req (dict): model_name, weight_file, onnx_file, images, num_synthetic, seed, img_size,
+            atol, rtol, score_th, nms_th を持つリクエスト
+
+    Returns:
+        dict: 処理結果。成功時は出力テンソルごとの誤差と、画像ごとの両モデルの検出結果
+    """
+    import cv2
+    import numpy as np
+    import torch
+    from yolox.data.data_augment import preproc
+    from yolox.utils import demo_postprocess, multiclass_nms
+    exp, model = cache.get_model(req['model_name'], req['weight_file'])
+    session = cache.get_session(req['onnx_file'])
+    model_input = session.get_inputs()[0]
+    shape = model_input.shape
+    img_size = shape[2] if isinstance(shape[2], int) else int(req.get('img_size') or exp.test_size[0])
+    model_batch = shape[0] if isinstance(shape[0], int) else None
+    atol, rtol = float(req.get('atol', 1e-3)), float(req.get('rtol', 1e-3))
+    score_th, nms_th = float(req.get('score_th', 0.3)), float(req.get('nms_th', 0.45))
+    rng = np.random.default_rng(int(req.get('seed', 0)))
+    names, imgs = [], []
+    for image in req.get('images') or []:
+        img = cv2.imread(image)
+        if img is None:
+            return {'error':f"Image load failed. ({image})"}
+        names.append(image)
+        imgs.append(img)
+    for i in range(int(req.get('num_synthetic', 4))):
+        names.append(f"synthetic_{i}")
+        imgs.append(rng.integers(0, 256, (img_size, img_size, 3), dtype=np.uint8))
+    batch, ratios = [], []
+    for img in imgs:
+        x, r = preproc(img, (img_size, img_size))
+        batch.append(x)
+        ratios.append(r)
+    batch = np.ascontiguousarray(np.stack(batch, 0), dtype=np.float32)
+    with cache.lock, torch.no_grad():
+        model.head.decode_in_inference = False
+        torch_outputs = model(torch.from_numpy(batch))
+    torch_outputs = [t.numpy() for t in (torch_outputs if isinstance(torch_outputs, (list, tuple)) else [torch_outputs])]
+    step = model_batch or len(batch)
+    chunks = [session.run(None, {model_input.name: batch[i:i + step]}) for i in range(0, len(batch), step)]
+    onnx_outputs = [np.concatenate([c[k] for c in chunks], 0) for k in range(len(chunks[0]))]
+    if len(torch_outputs) != len(onnx_outputs):
+        return {'error':f"Number of outputs mismatch. torch={len(torch_outputs)}, onnx={len(onnx_outputs)}"}
+    tensors = []
+    for output, ref, out in zip(session.get_outputs(), torch_outputs, onnx_outputs):
+        if ref.shape != out.shape:
+            return {'error':f"Output shape mismatch. name={output.name}, torch={ref.shape}, onnx={out.shape}"}
+        diff = np.abs(ref.astype(np.float64) - out.astype(np.float64))
+        tensors.append(dict(name=output.name, max_abs=float(diff.max()), max_rel=float((diff / (np.abs(ref) + 1e-6)).max()),
+                            mismatch=int((diff > atol + rtol * np.abs(ref)).sum()), size=int(diff.size)))
+    def _dets(outputs, i):
+        predictions = demo_postprocess(outputs[i:i + 1].copy(), (img_size, img_size))[0]
+        boxes = predictions[:, :4]
+        scores = predictions[:, 4:5] * predictions[:, 5:]
+        boxes_xyxy = np.ones_like(boxes)
+        boxes_xyxy[:, 0] = boxes[:, 0] - boxes[:, 2] / 2.
+        boxes_xyxy[:, 1] = boxes[:, 1] - boxes[:, 3] / 2.
+        boxes_xyxy[:, 2] = boxes[:, 0] + boxes[:, 2] / 2.
+        boxes_xyxy[:, 3] = boxes[:, 1] + boxes[:, 3] / 2.
+        boxes_xyxy /= ratios[i]
+        dets = multiclass_nms(boxes_xyxy, scores, nms_thr=nms_th, score_thr=score_th)
+        return dets.tolist() if dets is not None else []
+    images = [dict(image=name, torch=_dets(torch_outputs[0], i), onnx=_dets(onnx_outputs[0], i)) for i, name in enumerate(names)]
+    return {'success':{'img_size':img_size, 'tensors':tensors, 'images':images}}
+
+
+OPS = dict(convert=op_convert, demo=op_demo, inference=op_inference, bench=op_bench, verify=op_verify)
+
+
+def handle(cache:ModelCache, req:dict):
+    """
+    リクエストを処理する
+
+    Args:
+        cache (ModelCache): モデルキャッシュ
+        req (dict): opキーに処理名を持つリクエスト
+
+    Returns:
+        dict: 処理結果
+    """
+    op = req.get('op')
+    if op == 'ping':
+        return {'success':dict(pid=os.getpid(), **cache.status())}
+    if op not in OPS:
+        return {'error':f"Unknown op. ({op})"}
+    tm = time.perf_counter()
+    try:
+        ret = OPS[op](cache, req)
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        ret = {'error':f"{op} failed. {e}"}
+    logger.info(f"op={op}, elapsed={time.perf_counter() - tm:.03f}")
+    return ret
+
+
+def serve(state_file:Path):
+    """
+    ローカルホストのポートで待ち受け、リクエストを1件ずつ処理する。
+    待ち受けたアドレスとプロセスIDを状態ファイルに書き出す。
+
+    Args:
+        state_file (Path): 状態ファイルのパス
+    """
+    authkey = os.environ.get(AUTHKEY_ENV, '').encode('utf-8')
+    if not authkey:
+        raise SystemExit(f"{AUTHKEY_ENV} is not set.")
+    cache = ModelCache()
+    with Listener(('127.0.0.1', 0), backlog=16, authkey=authkey) as listener:
+        tmp_file = state_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(dict(pid=os.getpid(), host=listener.address[0], port=listener.address[1], cwd=os.getcwd()), f)
+        os.replace(tmp_file, state_file)
+        logger.info(f"Worker started. address={listener.address}, pid={os.getpid()}")
+        running = True
+        while running:
+            try:
+                conn = listener.accept()
+            except Exception:
+                logger.warning(traceback.format_exc())
+                continue
+            with conn:
+                try:
+                    req = json.loads(conn.recv_bytes().decode('utf-8'))
+                except Exception:
+                    logger.warning(traceback.format_exc())
+                    continue
+                if req.get('op') == 'stop':
+                    running = False
+                    ret = {'success':{'pid':os.getpid(), 'stopped':True}}
+                else:
+                    ret = handle(cache, req)
+                conn.send_bytes(json.dumps(ret, default=str).encode('utf-8'))
+    if state_file.exists():
+        state_file.unlink()
+    logger.info(f"Worker stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='YOLOX worker running in the YOLOX venv.')
+    parser.add_argument('mode', choices=['serve', 'oneshot'])
+    parser.add_argument('--state_file', help='Setting the worker state file.', default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s', stream=sys.stderr)
+    if args.mode == 'serve':
+        if args.state_file is None:
+            parser.error('--state_file is required in serve mode.')
+        serve(Path(args.state_file))
+    else:
+        ret = handle(ModelCache(), json.loads(sys.stdin.read()))
+        print(json.dumps(ret, default=str))
+
+
+if __name__ == '__main__':
+    main()
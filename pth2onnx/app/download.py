@@ -0,0 +1,305 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from pth2onnx.app import common, trace
+from pth2onnx.app.cache import remove_file
+from typing import Dict, List, Tuple
+from urllib.parse import unquote, urlparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+_locks:dict = dict()
+_locks_lock = threading.Lock()
+
+
+def is_url(path) -> bool:
+    return str(path).startswith(('http://', 'https://'))
+
+
+def parse_url(url:str) -> Tuple[str, str]:
+    """
+    URLの末尾の「#sha256=<16進文字列>」を取り除き、期待するSHA-256と分けて返します。
+
+    Args:
+        url (str): ダウンロードするファイルのURL
+
+    Returns:
+        Tuple[str, str]: ハッシュを除いたURLと、SHA-256の16進文字列。指定が無い場合はNone
+    """
+    base, _, fragment = url.partition('#')
+    m = re.match(r'sha256=([0-9a-fA-F]{64})$', fragment)
+    return (base, m.group(1).lower()) if m else (url, None)
+
+
+def url_file_name(url:str) -> str:
+    """
+    URLのパスの末尾から、保存に使えるファイル名を返します。
+
+    Args:
+        url (str): ダウンロードするファイルのURL
+
+    Returns:
+        str: ファイル名
+    """
+    return re.sub(r'[^\w.\-]', '_', unquote(Path(urlparse(url).path).name)) or 'download'
+
+
+def _path_lock(path:Path) -> threading.Lock:
+    # 同じURLを複数のスレッドで同時にダウンロードすると途中のファイルが壊れるため、保存先ごとに排他する
+    with _locks_lock:
+        return _locks.setdefault(str(path), threading.Lock())
+
+
+class Downloader(object):
+    def __init__(self, logger:logging.Logger, data:Path, segments:int=1, chunk_size:int=1024 * 1024, retries:int=3,
+                 timeout:float=30, min_segment_size:int=1024 * 1024):
+        """
+        モデルファイルをダウンロードするダウンローダーのコンストラクタ。
+        ファイルは一定のサイズごとに読み込みながら書き込むため、大きなファイルでもメモリに全体を保持しません。
+        中断したダウンロードはHTTPのRangeヘッダで続きから再開し、サーバーがRangeに対応していれば複数の区間を並行してダウンロードします。
+        ダウンロードしたファイルはデータディレクトリのキャッシュに保存され、同じURLは再びダウンロードしません。
+
+        Args:
+            logger (logging.Logger): ロガー
+            data (Path): データディレクトリのパス
+            segments (int, optional): 並行してダウンロードする区間の数. Defaults to 1.
+            chunk_size (int, optional): 一度に読み込むバイト数. Defaults to 1MB.
+            retries (int, optional): 通信エラーで再試行する回数. Defaults to 3.
+            timeout (float, optional): 接続と読み込みのタイムアウト(秒). Defaults to 30.
+            min_segment_size (int, optional): 区間の最小サイズ。これより小さい区間には分割しない. Defaults to 1MB.
+        """
+        self.logger = logger
+        self.cache_dir = Path(data) / 'cache' / 'download'
+        self.segments = max(1, int(segments or 1))
+        self.chunk_size = int(chunk_size)
+        self.retries = max(0, int(retries))
+        self.timeout = timeout
+        self.min_segment_size = int(min_segment_size)
+
+    def cache_file(self, url:str) -> Path:
+        """
+        URLのファイルを保存するキャッシュのパスを返します。
+
+        Args:
+            url (str): ダウンロードするファイルのURL
+
+        Returns:
+            Path: キャッシュのファイルパス
+        """
+        return self.cache_dir / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]}_{url_file_name(url)}"
+
+    def fetch(self, url:str, sha256:str=None, output_file:Path=None, use_cache:bool=True) -> dict:
+        """
+        ファイルをキャッシュにダウンロードし、SHA-256を検証します。キャッシュにあればダウンロードしません。
+
+        Args:
+            url (str): ダウンロードするファイルのURL。末尾の「#sha256=<16進文字列>」は期待するSHA-256として扱う
+            sha256 (str, optional): 期待するSHA-256の16進文字列。Noneは検証しない. Defaults to None.
+            output_file (Path, optional): キャッシュのファイルをハードリンクまたはコピーで配置する出力先. Defaults to None.
+            use_cache (bool, optional): Falseの場合はキャッシュがあってもダウンロードし直す. Defaults to True.
+
+        Returns:
+            dict: ファイルのパス、サイズ、SHA-256、キャッシュにヒットしたか、再開したバイト数、区間の数、所要時間
+
+        Raises:
+            OSError: 再試行してもダウンロードできなかった場合
+            ValueError: SHA-256が一致しなかった場合
+        """
+        url, url_sha256 = parse_url(url)
+        sha256 = (sha256 or url_sha256 or '').lower() or None
+        cache_file = self.cache_file(url)
+        meta_file = cache_file.with_name(cache_file.name + '.json')
+        tm = time.perf_counter()
+        with _path_lock(cache_file), trace.span('download.fetch', url=url) as attrs:
+            meta = self._load_meta(meta_file)
+            hit = use_cache and cache_file.exists() and meta.get('url') == url and meta.get('size') == cache_file.stat().st_size \
+                  and (sha256 is None or meta.get('sha256') == sha256)
+            if hit:
+                ret = dict(url=url, path=str(cache_file), size=meta['size'], sha256=meta['sha256'], cached=True, resumed=0, segments=0)
+            else:
+                common.mkdirs(self.cache_dir)
+                ret = self._download(url, cache_file)
+                if sha256 is not None and ret['sha256'] != sha256:
+                    remove_file(cache_file)
+                    remove_file(meta_file)
+                    self.logger.error(f"Checksum mismatch. url={url}, expected={sha256}, actual={ret['sha256']}")
+                    raise ValueError(f"Checksum mismatch. (expected={sha256}, actual={ret['sha256']})")
+                self._save_meta(meta_file, dict(url=url, size=ret['size'], sha256=ret['sha256'], downloaded=time.time()))
+            if attrs is not None:
+                attrs.update(cached=ret['cached'], size=ret['size'], segments=ret['segments'])
+        if output_file is not None:
+            output_file = Path(output_file)
+            common.mkdirs(output_file.parent)
+            if not (output_file.exists() and os.path.samefile(output_file, cache_file)):
+                remove_file(output_file)
+                try:
+                    os.link(cache_file, output_file)
+                except OSError:
+                    shutil.copyfile(cache_file, output_file)
+            ret['path'] = str(output_file)
+        ret['elapsed'] = round(time.perf_counter() - tm, 3)
+        ret['mb_per_sec'] = round(ret['size'] / 1024 / 1024 / ret['elapsed'], 1) if not ret['cached'] and ret['elapsed'] > 0 else None
+        self.logger.info(f"Download {'cached' if ret['cached'] else 'completed'}. url={url}, path={ret['path']}, size={ret['size']}, "
+                         f"segments={ret['segments']}, resumed={ret['resumed']}, elapsed={ret['elapsed']}")
+        return ret
+
+    def _load_meta(self, meta_file:Path) -> dict:
+        if not meta_file.exists():
+            return dict()
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError:
+            return dict()
+
+    def _save_meta(self, meta_file:Path, meta:dict):
+        tmp_file = meta_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=4)
+        os.replace(tmp_file, meta_file)
+
+    def _retry(self, func, name:str):
+        import requests
+        for attempt in range(self.retries + 1):
+            try:
+                return func()
+            except (requests.RequestException, OSError) as e:
+                if attempt >= self.retries:
+                    raise OSError(f"Download failed. {name} {e}") from e
+                wait = 0.5 * 2 ** attempt
+                self.logger.warning(f"Download interrupted. Retry after {wait}s. ({attempt + 1}/{self.retries}) {name} {e}")
+                time.sleep(wait)
+
+    def _probe(self, session, url:str) -> Tuple[int, bool, str]:
+        # サイズ、Rangeに対応しているか、再開時に同じファイルか確かめるためのETagまたは更新日時を返す
+        with session.get(url, stream=True, timeout=self.timeout, headers={'Range':'bytes=0-0'}) as r:
+            r.raise_for_status()
+            validator = r.headers.get('ETag') or r.headers.get('Last-Modified')
+            if r.status_code == 206:
+                m = re.match(r'bytes \d+-\d+/(\d+)', r.headers.get('Content-Range', ''))
+                return (int(m.group(1)) if m else None), m is not None, validator
+            length = r.headers.get('Content-Length')
+            return (int(length) if length is not None and 'Content-Encoding' not in r.headers else None), False, validator
+
+    def _download(self, url:str, cache_file:Path) -> dict:
+        import requests
+        state_file = cache_file.with_name(cache_file.name + '.part.json')
+        # Rangeで続きから受け取ったために、受け取り直さずに済んだバイト数を区間ごとに記録する。
+        # 再試行のたびに同じバイトを数え直さないように、区間ごとに続きから受け取った位置の最大値だけを残す
+        resumed = dict()
+        with requests.Session() as session:
+            size, ranges, validator = self._retry(lambda: self._probe(session, url), url)
+            segments = self.segments if ranges and size is not None else 1
+            segments = max(1, min(segments, (size or 0) // max(1, self.min_segment_size)))
+            # 途中のファイルが同じ内容と区間のものでなければ最初からダウンロードし直す
+            state = dict(url=url, size=size, validator=validator, segments=segments)
+            if self._load_meta(state_file) != state:
+                for part in self._part_files(cache_file):
+                    remove_file(part)
+            self._save_meta(state_file, state)
+            if segments > 1:
+                bounds = [(size * i // segments, size * (i + 1) // segments) for i in range(segments)]
+                parts = [cache_file.with_name(f"{cache_file.name}.part{i}") for i in range(segments)]
+                with ThreadPoolExecutor(max_workers=segments) as pool:
+                    list(pool.map(lambda a: self._retry(lambda: self._fetch_range(session, url, *a, validator, resumed), url), zip(parts, bounds)))
+                # SHA-256は区間のファイルを順に連結しながら計算する
+                h = hashlib.sha256()
+                tmp_file = cache_file.with_name(cache_file.name + '.tmp')
+                with open(tmp_file, 'wb') as out:
+                    for part in parts:
+                        with open(part, 'rb') as f:
+                            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                                h.update(chunk)
+                                out.write(chunk)
+            else:
+                tmp_file = cache_file.with_name(cache_file.name + '.part')
+                hashed = dict(h=hashlib.sha256(), size=0)
+                self._retry(lambda: self._fetch_stream(session, url, tmp_file, hashed, size, validator if ranges else None, resumed), url)
+                h = hashed['h']
+        total = tmp_file.stat().st_size
+        if size is not None and total != size:
+            raise OSError(f"Download size mismatch. ({total} != {size}) {url}")
+        remove_file(cache_file)
+        os.replace(tmp_file, cache_file)
+        for part in self._part_files(cache_file):
+            remove_file(part)
+        return dict(url=url, path=str(cache_file), size=total, sha256=h.hexdigest(), cached=False, resumed=sum(resumed.values()), segments=segments)
+
+    def _part_files(self, cache_file:Path) -> List[Path]:
+        return [p for p in cache_file.parent.glob(f"{cache_file.name}.part*")] + [cache_file.with_name(cache_file.name + '.tmp')]
+
+    def _fetch_stream(self, session, url:str, part:Path, hashed:dict, size:int, validator:str, resumed:Dict[Path, int]):
+        # validatorがある場合はRangeで続きから受け取り、ハッシュは受け取りながら計算する
+        offset = part.stat().st_size if part.exists() and validator is not None else 0
+        if hashed['size'] != offset:
+            # 前回の実行や再試行の前に書き込んだ部分は、ハッシュに含めるために読み直す
+            hashed.update(h=hashlib.sha256(), size=0)
+            with open(part, 'rb') as f:
+                while hashed['size'] < offset:
+                    chunk = f.read(min(self.chunk_size, offset - hashed['size']))
+                    hashed['h'].update(chunk)
+                    hashed['size'] += len(chunk)
+        if size is not None and offset == size:
+            resumed[part] = max(resumed.get(part, 0), offset)
+            return
+        headers = {'Range':f"bytes={offset}-", 'If-Range':validator} if offset > 0 else {}
+        with session.get(url, stream=True, timeout=self.timeout, headers=headers) as r:
+            r.raise_for_status()
+            if r.status_code != 206 and offset > 0:
+                self.logger.info(f"Server does not resume. Download from the beginning. {url}")
+                hashed.update(h=hashlib.sha256(), size=0)
+            elif offset > 0:
+                resumed[part] = max(resumed.get(part, 0), offset)
+            with open(part, 'ab' if r.status_code == 206 else 'wb') as f:
+                for chunk in r.iter_content(self.chunk_size):
+                    f.write(chunk)
+                    hashed['h'].update(chunk)
+                    hashed['size'] += len(chunk)
+        if size is not None and part.stat().st_size < size:
+            raise OSError(f"Connection closed before the end. ({part.stat().st_size} < {size})")
+
+    def _fetch_range(self, session, url:str, part:Path, bounds:Tuple[int, int], validator:str, resumed:Dict[Path, int]):
+        # 区間を受け取る。区間のファイルが途中まであれば、その続きから受け取る
+        begin, end = bounds
+        done = part.stat().st_size if part.exists() else 0
+        resumed[part] = max(resumed.get(part, 0), done)
+        if begin + done >= end:
+            return
+        headers = {'Range':f"bytes={begin + done}-{end - 1}"}
+        if validator is not None:
+            headers['If-Range'] = validator
+        with session.get(url, stream=True, timeout=self.timeout, headers=headers) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise OSError(f"Server does not support the range request. status={r.status_code}")
+            with open(part, 'ab') as f:
+                for chunk in r.iter_content(self.chunk_size):
+                    chunk = chunk[:end - begin - done]
+                    f.write(chunk)
+                    done += len(chunk)
+        if begin + part.stat().st_size < end:
+            raise OSError(f"Connection closed before the end of the range. ({begin + part.stat().st_size} < {end})")
+
+
+def download(url:str, data:Path, sha256:str=None, output_file:Path=None, segments:int=1, logger:logging.Logger=None) -> dict:
+    """
+    ファイルをデータディレクトリのキャッシュにダウンロードします。Downloader.fetchの簡易版です。
+
+    Args:
+        url (str): ダウンロードするファイルのURL
+        data (Path): データディレクトリのパス
+        sha256 (str, optional): 期待するSHA-256の16進文字列. Defaults to None.
+        output_file (Path, optional): ファイルを配置する出力先. Defaults to None.
+        segments (int, optional): 並行してダウンロードする区間の数. Defaults to 1.
+        logger (logging.Logger, optional): ロガー. Defaults to None.
+
+    Returns:
+        dict: ダウンロードの結果
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    return Downloader(logger, data, segments=segments).fetch(url, sha256=sha256, output_file=output_file)
@@ -0,0 +1,173 @@
+from pathlib import Path
+from pth2onnx.app import postprocess, trace
+from typing import List, Tuple
+import cv2
+import numpy as np
+import onnxruntime
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp', '.npy')
+OPTIMIZED_SUFFIX = '.opt.onnx'
+
+def list_image_files(input_dir:Path) -> List[Path]:
+    """
+    ディレクトリ内の画像ファイルをサブディレクトリも含めてパス順に列挙します。
+
+    Args:
+        input_dir (Path): ディレクトリのパス
+
+    Returns:
+        List[Path]: 画像ファイルのパスのリスト
+    """
+    return sorted(p for p in Path(input_dir).glob('**/*') if p.is_file() and p.suffix.lower() in IMAGE_SUFFIXES)
+
+def session_options(onnx_file:Path, intra_op_threads:int=0, inter_op_threads:int=0) -> onnxruntime.SessionOptions:
+    """
+    推論セッションのオプションを作成します。
+    オフライン最適化済みのモデル(*.opt.onnx、*.ort)はセッション作成時のグラフの最適化を省略します。
+
+    Args:
+        onnx_file (Path): ONNXファイルのパス
+        intra_op_threads (int, optional): オペレータ内の並列スレッド数。0はONNX Runtimeの既定値. Defaults to 0.
+        inter_op_threads (int, optional): オペレータ間の並列スレッド数。0はONNX Runtimeの既定値. Defaults to 0.
+
+    Returns:
+        onnxruntime.SessionOptions: セッションのオプション
+    """
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = int(intra_op_threads or 0)
+    options.inter_op_num_threads = int(inter_op_threads or 0)
+    if int(inter_op_threads or 0) > 1:
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+    if str(onnx_file).endswith((OPTIMIZED_SUFFIX, '.ort')):
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+    return options
+
+
+class OnnxEngine(object):
+    def __init__(self, onnx_file:Path, input_size:int=416, batch_size:int=1, intra_op_threads:int=0, inter_op_threads:int=0):
+        """
+        ONNXモデルを一度だけロードし、画像をバッチで推論するエンジンのコンストラクタ
+
+        Args:
+            onnx_file (Path): ONNXファイルのパス
+            input_size (int, optional): モデルの入力サイズ。モデルの入力が固定サイズの場合はそちらを優先. Defaults to 416.
+            batch_size (int, optional): バッチサイズ. Defaults to 1.
+            intra_op_threads (int, optional): オペレータ内の並列スレッド数。0はONNX Runtimeの既定値. Defaults to 0.
+            inter_op_threads (int, optional): オペレータ間の並列スレッド数。0はONNX Runtimeの既定値. Defaults to 0.
+        """
+        options = session_options(onnx_file, intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+        with trace.span('engine.session_create', onnx_file=str(onnx_file)):
+            self.session = onnxruntime.InferenceSession(str(onnx_file), sess_options=options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        shape = model_input.shape
+        self.input_size = (shape[2] if isinstance(shape[2], int) else int(input_size),
+                           shape[3] if isinstance(shape[3], int) else int(input_size))
+        # 固定バッチでエクスポートされたモデルはそのバッチサイズでしか実行できない
+        self.model_batch = shape[0] if isinstance(shape[0], int) else None
+        self.batch_size = max(1, int(batch_size or 1))
+        self._buffer = np.empty((self.batch_size, self.input_size[0], self.input_size[1], 3), dtype=np.uint8)
+
+    def preprocess(self, imgs:List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        画像をレターボックス形式でモデルの入力サイズにリサイズし、NCHWのバッチにします。
+        パディング、転置、型変換はバッチ全体に対してまとめて行い、リサイズは入力のバッファに直接書き込みます。
+
+        Args:
+            imgs (List[np.ndarray]): BGR形式の画像(高さ, 幅, 3)のリスト
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: float32のバッチ(N, 3, 高さ, 幅)と画像ごとのリサイズ比率(N,)
+        """
+        n = len(imgs)
+        if n > self._buffer.shape[0]:
+            self._buffer = np.empty((n, *self._buffer.shape[1:]), dtype=np.uint8)
+        buf = self._buffer[:n]
+        buf.fill(114)
+        ih, iw = self.input_size
+        ratios = np.empty(n, dtype=np.float32)
+        for i, img in enumerate(imgs):
+            r = min(ih / img.shape[0], iw / img.shape[1])
+            nh, nw = int(img.shape[0] * r), int(img.shape[1] * r)
+            cv2.resize(img, (nw, nh), dst=buf[i, :nh, :nw], interpolation=cv2.INTER_LINEAR)
+            ratios[i] = r
+        return np.ascontiguousarray(buf.transpose(0, 3, 1, 2), dtype=np.float32), ratios
+
+    def run(self, batch:np.ndarray) -> np.ndarray:
+        """
+        バッチを推論します。モデルのバッチサイズが固定の場合はその単位に分けて実行します。
+
+        Args:
+            batch (np.ndarray): float32のバッチ(N, 3, 高さ, 幅)
+
+        Returns:
+            np.ndarray: モデルの出力(N, アンカー数, 5 + クラス数)
+        """
+        if self.model_batch is None or self.model_batch == batch.shape[0]:
+            return self.session.run(None, {self.input_name: batch})[0]
+        step = self.model_batch
+        outputs = []
+        for i in range(0, batch.shape[0], step):
+            chunk = batch[i:i + step]
+            n = chunk.shape[0]
+            if n < step:
+                chunk = np.concatenate([chunk, np.zeros((step - n, *chunk.shape[1:]), dtype=chunk.dtype)], 0)
+            outputs.append(self.session.run(None, {self.input_name: chunk})[0][:n])
+        return np.concatenate(outputs, 0)
+
+    def infer(self, imgs:List[np.ndarray], score_th:float=0.3, nms_th:float=0.45) -> List[np.ndarray]:
+        """
+        画像のリストを前処理、推論、後処理して検出結果を返します。
+
+        Args:
+            imgs (List[np.ndarray]): BGR形式の画像のリスト
+            score_th (float, optional): スコアの閾値. Defaults to 0.3.
+            nms_th (float, optional): NMSの閾値. Defaults to 0.45.
+
+        Returns:
+            List[np.ndarray]: 画像ごとの検出結果(K, 6)。x1, y1, x2, y2, スコア, クラスの順で元画像の座標
+        """
+        with trace.span('engine.preprocess', images=len(imgs)):
+            batch, ratios = self.preprocess(imgs)
+        with trace.span('engine.run', batch=len(imgs)):
+            outputs = self.run(batch)
+        with trace.span('engine.postprocess'):
+            return postprocess.postprocess(outputs, self.input_size, ratios, score_th=score_th, nms_th=nms_th)
+
+
+def check_batch(onnx_file:Path, batch_size:int=4, input_size:int=416, seed:int=0, rtol:float=1e-3, atol:float=1e-4,
+                score_th:float=0.3, nms_th:float=0.45) -> dict:
+    """
+    バッチの軸が可変のモデルで、バッチで推論した結果が1枚ずつ推論した結果と一致するかを確認します。
+    入力はシード固定の乱数で生成した大きさの異なる画像で、推論と同じ前処理を行います。
+    バッチで推論するとカーネルの選択や加算の順番が変わり出力に誤差が出るため、判定は検出結果で行い、出力の最大絶対誤差は参考として返します。
+
+    Args:
+        onnx_file (Path): ONNXファイルのパス
+        batch_size (int, optional): バッチサイズ. Defaults to 4.
+        input_size (int, optional): 入力サイズ。モデルの入力が固定サイズの場合はそちらを優先. Defaults to 416.
+        seed (int, optional): 乱数のシード. Defaults to 0.
+        rtol (float, optional): 検出結果(座標とスコア)の許容相対誤差. Defaults to 1e-3.
+        atol (float, optional): 検出結果(座標とスコア)の許容絶対誤差. Defaults to 1e-4.
+        score_th (float, optional): スコアの閾値. Defaults to 0.3.
+        nms_th (float, optional): NMSの閾値. Defaults to 0.45.
+
+    Returns:
+        dict: 出力の最大絶対誤差、検出結果が許容誤差内で一致するかどうか(passed)
+    """
+    eng = OnnxEngine(onnx_file, input_size=input_size, batch_size=batch_size)
+    if eng.model_batch is not None:
+        raise ValueError(f"Batch axis of the model is fixed to {eng.model_batch}. ({onnx_file})")
+    rng = np.random.default_rng(seed)
+    ih, iw = eng.input_size
+    imgs = [rng.integers(0, 256, (int(rng.integers(ih // 2, ih * 3 // 2)), int(rng.integers(iw // 2, iw * 3 // 2)), 3), dtype=np.uint8)
+            for _ in range(eng.batch_size)]
+    batch, ratios = eng.preprocess(imgs)
+    batched = eng.run(batch)
+    single = np.concatenate([eng.run(batch[i:i + 1]) for i in range(len(batch))], 0)
+    max_abs = float(np.abs(batched.astype(np.float64) - single).max())
+    dets_b = postprocess.postprocess(batched, eng.input_size, ratios, score_th=score_th, nms_th=nms_th)
+    dets_s = postprocess.postprocess(single, eng.input_size, ratios, score_th=score_th, nms_th=nms_th)
+    identical = all(a.shape == b.shape and np.allclose(a, b, rtol=rtol, atol=atol) for a, b in zip(dets_b, dets_s))
+    return dict(batch_size=eng.batch_size, input_size=eng.input_size[0], max_abs=max_abs, identical_detections=identical,
+                passed=identical)
@@ -0,0 +1,380 @@
+from pathlib import Path
+from pth2onnx.app import engine, imageio, pipeline, postprocess
+from typing import Dict, List, Sequence, Tuple
+import cv2
+import json
+import logging
+import numpy as np
+import time
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+RECALL_THRESHOLDS = np.linspace(0.0, 1.0, 101)
+MAX_DETS = 100
+
+
+class CocoDataset(object):
+    def __init__(self, ann_file:Path, image_dir:Path, labels:Sequence[str]=postprocess.COCO_CLASSES, max_images:int=0):
+        """
+        COCO形式のアノテーションファイルと画像ディレクトリからなる評価用のデータセット。
+        カテゴリ名がすべてモデルのラベルにある場合は名前で、それ以外はカテゴリIDの昇順でモデルのクラスと対応付けます。
+
+        Args:
+            ann_file (Path): COCO形式のアノテーションファイル(JSON)のパス
+            image_dir (Path): 画像ディレクトリのパス。画像のfile_nameはこのディレクトリからの相対パス
+            labels (Sequence[str], optional): モデルのクラスのラベル. Defaults to COCO_CLASSES.
+            max_images (int, optional): 評価する画像の最大数。0は全件. Defaults to 0.
+        """
+        with open(ann_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.ann_file = Path(ann_file)
+        self.image_dir = Path(image_dir)
+        categories = sorted(data.get('categories', []), key=lambda c:c['id'])
+        self.cat_ids = [c['id'] for c in categories]
+        self.cat_names = [c.get('name', str(c['id'])) for c in categories]
+        # モデルのクラス番号からカテゴリの番号(0からの連番)への対応。対応しないクラスは-1
+        self.class_to_cat = np.full(len(labels), -1, dtype=np.int64)
+        if len(categories) > 0 and all(name in labels for name in self.cat_names):
+            for i, name in enumerate(self.cat_names):
+                self.class_to_cat[list(labels).index(name)] = i
+        else:
+            n = min(len(labels), len(categories))
+            self.class_to_cat[:n] = np.arange(n)
+        images = sorted(data.get('images', []), key=lambda img:img['id'])
+        self.images = images[:int(max_images)] if max_images and int(max_images) > 0 else images
+        cat_index = {cat_id:i for i, cat_id in enumerate(self.cat_ids)}
+        anns = dict()
+        for ann in data.get('annotations', []):
+            if ann.get('category_id') in cat_index:
+                anns.setdefault(ann['image_id'], []).append(ann)
+        # 画像ごとの正解。ボックスはx1, y1, x2, y2の順
+        self.gts = dict()
+        for img in self.images:
+            items = anns.get(img['id'], [])
+            boxes = np.array([a['bbox'] for a in items], dtype=np.float64).reshape(-1, 4)
+            boxes[:, 2:] += boxes[:, :2]
+            # pycocotoolsと同じく、無視する正解は群衆の正解だけとする
+            crowd = np.array([bool(a.get('iscrowd', 0)) for a in items], dtype=bool)
+            cats = np.array([cat_index[a['category_id']] for a in items], dtype=np.int64)
+            self.gts[img['id']] = (boxes, cats, crowd, crowd.copy())
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def to_categories(self, dets:np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        モデルの検出結果をカテゴリの番号に対応付けます。カテゴリに対応しないクラスの検出は除きます。
+
+        Args:
+            dets (np.ndarray): 検出結果(K, 6)。x1, y1, x2, y2, スコア, クラスの順
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: ボックス(K, 4)、スコア(K,)、カテゴリの番号(K,)
+        """
+        dets = np.asarray(dets, dtype=np.float64).reshape(-1, 6)
+        classes = dets[:, 5].astype(np.int64)
+        valid = (classes >= 0) & (classes < len(self.class_to_cat))
+        cats = np.full(len(dets), -1, dtype=np.int64)
+        cats[valid] = self.class_to_cat[classes[valid]]
+        keep = cats >= 0
+        return dets[keep, :4], dets[keep, 4], cats[keep]
+
+
+def letterbox(img:np.ndarray, input_size:Tuple[int, int]) -> Tuple[np.ndarray, float]:
+    """
+    画像をOnnxEngine.preprocessと同じレターボックス形式でモデルの入力サイズにリサイズします。
+    画像ごとに独立して処理するため、複数のスレッドで並列に実行できます。
+
+    Args:
+        img (np.ndarray): BGR形式の画像(高さ, 幅, 3)
+        input_size (Tuple[int, int]): モデルの入力サイズ(高さ, 幅)
+
+    Returns:
+        Tuple[np.ndarray, float]: float32の入力(3, 高さ, 幅)とリサイズ比率
+    """
+    ih, iw = input_size
+    buf = np.full((ih, iw, 3), 114, dtype=np.uint8)
+    r = min(ih / img.shape[0], iw / img.shape[1])
+    nh, nw = int(img.shape[0] * r), int(img.shape[1] * r)
+    cv2.resize(img, (nw, nh), dst=buf[:nh, :nw], interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(buf.transpose(2, 0, 1), dtype=np.float32), r
+
+
+class CocoSource(object):
+    def __init__(self, dataset:CocoDataset, input_size:Tuple[int, int]):
+        """
+        データセットの画像を入力とするパイプラインのソース。デコードと前処理を並列に行います。
+        画像ごとにデコードを始めた時刻を記録し、書き出しまでの遅延の測定に使います。
+
+        Args:
+            dataset (CocoDataset): データセット
+            input_size (Tuple[int, int]): モデルの入力サイズ(高さ, 幅)
+        """
+        self.dataset = dataset
+        self.input_size = input_size
+        self.parallel = True
+        self.started = dict()
+
+    def tasks(self):
+        for img in self.dataset.images:
+            yield img['id'], (img['id'], self.dataset.image_dir / img['file_name'])
+
+    def decode(self, payload:Tuple[int, Path]) -> Tuple[np.ndarray, float]:
+        image_id, path = payload
+        self.started[image_id] = time.perf_counter()
+        img = imageio.imread(path)
+        if img is None:
+            return None
+        return letterbox(img, self.input_size)
+
+
+class EvalEngine(object):
+    def __init__(self, eng:engine.OnnxEngine):
+        """
+        前処理済みの入力をまとめて推論し、後処理をせずにモデルの出力を返すパイプライン用のエンジン。
+        前処理はソースのデコード、後処理はシンクのエンコードのスレッドで並列に行います。
+
+        Args:
+            eng (engine.OnnxEngine): 推論エンジン
+        """
+        self.eng = eng
+        self.batch_size = eng.batch_size
+        self.input_size = eng.input_size
+        self.latencies = []
+
+    def infer(self, items:List[Tuple[np.ndarray, float]], score_th:float=0.3, nms_th:float=0.45) -> List[Tuple[np.ndarray, float]]:
+        tm = time.perf_counter()
+        outputs = self.eng.run(np.stack([x for x, _ in items]))
+        self.latencies.append((time.perf_counter() - tm) / len(items))
+        return [(outputs[i:i + 1], r) for i, (_, r) in enumerate(items)]
+
+
+class EvalSink(object):
+    def __init__(self, source:CocoSource, input_size:Tuple[int, int], score_th:float=0.01, nms_th:float=0.65):
+        """
+        モデルの出力を後処理して画像ごとの検出結果を集めるパイプラインのシンク
+
+        Args:
+            source (CocoSource): 遅延の測定に使うソース
+            input_size (Tuple[int, int]): モデルの入力サイズ(高さ, 幅)
+            score_th (float, optional): スコアの閾値. Defaults to 0.01.
+            nms_th (float, optional): NMSの閾値. Defaults to 0.65.
+        """
+        self.source = source
+        self.input_size = input_size
+        self.score_th = float(score_th)
+        self.nms_th = float(nms_th)
+        self.dets = dict()
+        self.latencies = []
+
+    def encode(self, key:int, item:Tuple[np.ndarray, float], output:Tuple[np.ndarray, float]) -> np.ndarray:
+        outputs, ratio = output
+        return postprocess.postprocess(outputs, self.input_size, np.array([ratio], dtype=np.float32),
+                                       score_th=self.score_th, nms_th=self.nms_th)[0]
+
+    def write(self, key:int, dets:np.ndarray):
+        self.dets[key] = dets
+        self.latencies.append(time.perf_counter() - self.source.started.pop(key))
+
+    def close(self):
+        pass
+
+
+def top_detections(dets:np.ndarray, max_dets:int=MAX_DETS) -> np.ndarray:
+    """
+    検出結果をスコアの高い順に並べ、max_dets件までを返します。
+
+    Args:
+        dets (np.ndarray): 検出結果(K, 6)
+        max_dets (int, optional): 返す最大件数. Defaults to MAX_DETS.
+
+    Returns:
+        np.ndarray: 検出結果(min(K, max_dets), 6)
+    """
+    return dets[np.argsort(-dets[:, 4], kind='stable')[:max_dets]]
+
+
+def _iou(dt:np.ndarray, gt:np.ndarray, crowd:np.ndarray) -> np.ndarray:
+    # COCOと同じく、群衆の正解とのIoUは検出の面積に対する重なりの割合とする
+    area_dt = (dt[:, 2] - dt[:, 0]) * (dt[:, 3] - dt[:, 1])
+    area_gt = (gt[:, 2] - gt[:, 0]) * (gt[:, 3] - gt[:, 1])
+    lt = np.maximum(dt[:, None, :2], gt[None, :, :2])
+    rb = np.minimum(dt[:, None, 2:], gt[None, :, 2:])
+    wh = (rb - lt).clip(0)
+    inter = wh[..., 0] * wh[..., 1]
+    union = np.where(crowd[None, :], area_dt[:, None], area_dt[:, None] + area_gt[None, :] - inter)
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def match_image(dt:np.ndarray, scores:np.ndarray, gt:np.ndarray, crowd:np.ndarray, ignore:np.ndarray,
+                max_dets:int=MAX_DETS) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    1画像、1カテゴリの検出結果を正解と対応付けます。pycocotoolsのCOCOevalと同じ規則で、
+    スコアの高い順に、IoUの閾値ごとに未対応の正解のうちIoUが最も大きいものと対応付けます。
+    無視する正解(群衆など)は、無視しない正解と対応しなかった場合だけ対応付け、その検出も無視します。
+
+    Args:
+        dt (np.ndarray): 検出のボックス(D, 4)
+        scores (np.ndarray): 検出のスコア(D,)
+        gt (np.ndarray): 正解のボックス(G, 4)
+        crowd (np.ndarray): 正解が群衆かどうか(G,)
+        ignore (np.ndarray): 正解を無視するかどうか(G,)
+        max_dets (int, optional): 評価する検出の最大数. Defaults to MAX_DETS.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: スコアの高い順に並べた検出のスコア(D,)、
+            IoUの閾値ごとに正解と対応したかどうか(T, D)、無視するかどうか(T, D)
+    """
+    order = np.argsort(-scores, kind='mergesort')[:max_dets]
+    dt, scores = dt[order], scores[order]
+    num_t = len(IOU_THRESHOLDS)
+    matched = np.zeros((num_t, len(dt)), dtype=bool)
+    dt_ignore = np.zeros((num_t, len(dt)), dtype=bool)
+    if len(gt) == 0 or len(dt) == 0:
+        return scores, matched, dt_ignore
+    # 無視しない正解を先に並べる
+    g_order = np.argsort(ignore, kind='mergesort')
+    gt, crowd, ignore = gt[g_order], crowd[g_order], ignore[g_order]
+    ious = _iou(dt, gt, crowd)
+    gt_used = np.zeros((num_t, len(gt)), dtype=bool)
+    thresholds = np.minimum(IOU_THRESHOLDS, 1 - 1e-10)[:, None]
+    t_idx = np.arange(num_t)
+    for d in range(len(dt)):
+        cand = (ious[d][None, :] >= thresholds) & (~gt_used | crowd[None, :])
+        # 無視しない正解に対応できる閾値ではそちらを優先する
+        normal = cand & ~ignore[None, :]
+        use = np.where(normal.any(axis=1, keepdims=True), normal, cand)
+        has = use.any(axis=1)
+        if not has.any():
+            continue
+        # IoUが同じ場合はCOCOevalと同じく後ろの正解を選ぶ
+        masked = np.where(use, ious[d][None, :], -1.0)[:, ::-1]
+        g = len(gt) - 1 - masked.argmax(axis=1)
+        t = t_idx[has]
+        matched[t, d] = True
+        dt_ignore[t, d] = ignore[g[has]]
+        gt_used[t, g[has]] = True
+    return scores, matched, dt_ignore
+
+
+def average_precision(scores:List[np.ndarray], matched:List[np.ndarray], dt_ignore:List[np.ndarray], num_gt:int) -> np.ndarray:
+    """
+    1カテゴリのすべての画像の対応付けの結果から、IoUの閾値ごとに101点補間の適合率の平均(AP)を求めます。
+
+    Args:
+        scores (List[np.ndarray]): 画像ごとの検出のスコア
+        matched (List[np.ndarray]): 画像ごとの正解と対応したかどうか(T, D)
+        dt_ignore (List[np.ndarray]): 画像ごとの無視する検出かどうか(T, D)
+        num_gt (int): 無視しない正解の数
+
+    Returns:
+        np.ndarray: IoUの閾値ごとのAP(T,)
+    """
+    num_t = len(IOU_THRESHOLDS)
+    if len(scores) == 0:
+        return np.zeros(num_t)
+    order = np.argsort(-np.concatenate(scores), kind='mergesort')
+    matched = np.concatenate(matched, axis=1)[:, order]
+    dt_ignore = np.concatenate(dt_ignore, axis=1)[:, order]
+    tp = np.cumsum(matched & ~dt_ignore, axis=1, dtype=np.float64)
+    fp = np.cumsum(~matched & ~dt_ignore, axis=1, dtype=np.float64)
+    ap = np.zeros(num_t)
+    for t in range(num_t):
+        if tp.shape[1] == 0:
+            continue
+        recall = tp[t] / num_gt
+        precision = tp[t] / (tp[t] + fp[t] + np.spacing(1))
+        # 適合率を再現率に対して単調減少にする
+        precision = np.maximum.accumulate(precision[::-1])[::-1]
+        inds = np.searchsorted(recall, RECALL_THRESHOLDS, side='left')
+        q = np.zeros(len(RECALL_THRESHOLDS))
+        valid = inds < len(precision)
+        q[valid] = precision[inds[valid]]
+        ap[t] = q.mean()
+    return ap
+
+
+def coco_map(dataset:CocoDataset, dets:Dict[int, np.ndarray], max_dets:int=MAX_DETS) -> dict:
+    """
+    画像ごとの検出結果からCOCOのmAP@[.5:.95]、mAP@.5、mAP@.75とカテゴリごとのAPを求めます。
+    結果はpycocotoolsのCOCOevalのbbox、全面積の値と同じです。正解の無いカテゴリは平均に含めません。
+
+    Args:
+        dataset (CocoDataset): データセット
+        dets (Dict[int, np.ndarray]): 画像IDごとの検出結果(K, 6)
+        max_dets (int, optional): 画像、カテゴリごとに評価する検出の最大数. Defaults to MAX_DETS.
+
+    Returns:
+        dict: mAP、mAP50、mAP75と、カテゴリ名ごとのmAP@[.5:.95]
+    """
+    num_cats = len(dataset.cat_ids)
+    results = [([], [], []) for _ in range(num_cats)]
+    num_gt = np.zeros(num_cats, dtype=np.int64)
+    for img in dataset.images:
+        gt_boxes, gt_cats, crowd, ignore = dataset.gts[img['id']]
+        dt_boxes, dt_scores, dt_cats = dataset.to_categories(dets.get(img['id'], np.zeros((0, 6))))
+        np.add.at(num_gt, gt_cats[~ignore], 1)
+        for c in np.union1d(gt_cats, dt_cats).tolist():
+            g, d = gt_cats == c, dt_cats == c
+            ret = match_image(dt_boxes[d], dt_scores[d], gt_boxes[g], crowd[g], ignore[g], max_dets=max_dets)
+            for acc, v in zip(results[c], ret):
+                acc.append(v)
+    aps = np.full((num_cats, len(IOU_THRESHOLDS)), np.nan)
+    for c in range(num_cats):
+        if num_gt[c] > 0:
+            aps[c] = average_precision(*results[c], num_gt=int(num_gt[c]))
+    valid = ~np.isnan(aps[:, 0])
+    if not valid.any():
+        return dict(mAP=None, mAP50=None, mAP75=None, categories=0, per_class=dict())
+    return dict(mAP=round(float(aps[valid].mean()), 4), mAP50=round(float(aps[valid, 0].mean()), 4),
+                mAP75=round(float(aps[valid, 5].mean()), 4), categories=int(valid.sum()),
+                per_class={dataset.cat_names[c]:round(float(aps[c].mean()), 4) for c in np.nonzero(valid)[0].tolist()})
+
+
+def evaluate(onnx_file:Path, dataset:CocoDataset, input_size:int=416, batch_size:int=1, score_th:float=0.01, nms_th:float=0.65,
+             intra_op_threads:int=0, inter_op_threads:int=0, decode_threads:int=2, encode_threads:int=2, queue_size:int=16,
+             logger:logging.Logger=None) -> Tuple[dict, Dict[int, np.ndarray]]:
+    """
+    ONNXモデルでデータセットの画像を推論し、mAPと処理速度を求めます。
+    デコードと前処理、推論、後処理はパイプラインで並行して実行し、前処理と後処理はそれぞれ複数のスレッドで行います。
+
+    Args:
+        onnx_file (Path): ONNXファイルのパス
+        dataset (CocoDataset): データセット
+        input_size (int, optional): モデルの入力サイズ。モデルの入力が固定サイズの場合はそちらを優先. Defaults to 416.
+        batch_size (int, optional): バッチサイズ. Defaults to 1.
+        score_th (float, optional): スコアの閾値. Defaults to 0.01.
+        nms_th (float, optional): NMSの閾値. Defaults to 0.65.
+        intra_op_threads (int, optional): オペレータ内の並列スレッド数。0は既定値. Defaults to 0.
+        inter_op_threads (int, optional): オペレータ間の並列スレッド数。0は既定値. Defaults to 0.
+        decode_threads (int, optional): デコードと前処理のスレッド数. Defaults to 2.
+        encode_threads (int, optional): 後処理のスレッド数. Defaults to 2.
+        queue_size (int, optional): パイプラインの各段の間のキューの上限. Defaults to 16.
+        logger (logging.Logger, optional): ロガー. Defaults to None.
+
+    Returns:
+        Tuple[dict, Dict[int, np.ndarray]]: mAP、1秒あたりの画像数、画像ごとの遅延と推論時間のパーセンタイル(ミリ秒)などを示す辞書と、
+            画像IDごとの検出結果
+    """
+    from pth2onnx.app import common
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    eng = engine.OnnxEngine(onnx_file, input_size=input_size, batch_size=batch_size,
+                            intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+    # セッションの初回の推論は遅いため測定に含めない
+    eng.run(np.zeros((eng.model_batch or 1, 3, *eng.input_size), dtype=np.float32))
+    source = CocoSource(dataset, eng.input_size)
+    sink = EvalSink(source, eng.input_size, score_th=score_th, nms_th=nms_th)
+    model = EvalEngine(eng)
+    pipe = pipeline.Pipeline(model, decode_threads=decode_threads, encode_threads=encode_threads, queue_size=queue_size, logger=logger)
+    ret = pipe.run(source, sink)
+    if len(ret['errors_detail']) > 0:
+        raise RuntimeError(f"{ret['errors_detail']}")
+    tm = time.perf_counter()
+    metrics = coco_map(dataset, sink.dets)
+    logger.info(f"mAP computed. onnx_file={onnx_file}, elapsed={time.perf_counter() - tm:.03f}")
+    report = dict(model=str(onnx_file), images=ret['outputs'], errors=ret['errors'], input_size=list(eng.input_size),
+                  batch_size=eng.batch_size, mAP=metrics['mAP'], mAP50=metrics['mAP50'], mAP75=metrics['mAP75'],
+                  images_per_sec=round(ret['outputs'] / ret['elapsed'], 2) if ret['elapsed'] > 0 else None, elapsed=ret['elapsed'],
+                  latency_ms=common.percentiles(sink.latencies, scale=1000), infer_ms=common.percentiles(model.latencies, scale=1000),
+                  stages={stage['stage']:stage['items_per_sec'] for stage in ret['stages']},
+                  categories=metrics['categories'], per_class=metrics['per_class'])
+    return report, sink.dets
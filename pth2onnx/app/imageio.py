@@ -0,0 +1,89 @@
+from pathlib import Path
+from typing import List
+import cv2
+import numpy as np
+
+NPY_SUFFIX = '.npy'
+_imread_dst = [True]
+
+def imread(path:Path, flags:int=cv2.IMREAD_COLOR, dst:np.ndarray=None) -> np.ndarray:
+    """
+    画像ファイルを読み込みます。.npyファイルはメモリマップで読み込むため、読み込み時にはコピーしません。
+    dstを指定した場合、画像と同じ形状であればdstに直接デコードします。形状が異なる場合は新しい配列にデコードします。
+
+    Args:
+        path (Path): 画像ファイルまたは(高さ, 幅, 3)のBGR形式のuint8を保存した.npyファイルのパス
+        flags (int, optional): cv2.imreadのフラグ. Defaults to cv2.IMREAD_COLOR.
+        dst (np.ndarray, optional): デコード先の配列. Defaults to None.
+
+    Returns:
+        np.ndarray: 画像。.npyファイルの場合は読み取り専用。読み込めない場合はNone
+    """
+    path = Path(path)
+    if path.suffix.lower() == NPY_SUFFIX:
+        return np.load(path, mmap_mode='r')
+    if dst is not None and _imread_dst[0]:
+        # 出力先を指定できるcv2.imreadはOpenCV 4.10以降のため、使えない場合は以降は指定しない
+        try:
+            img = cv2.imread(str(path), dst, flags)
+            return img if img is not None and img.size > 0 else None
+        except (cv2.error, TypeError):
+            _imread_dst[0] = False
+    return cv2.imread(str(path), flags)
+
+def imwrite(path:Path, img:np.ndarray, params:List[int]=None) -> bool:
+    """
+    画像をファイルの拡張子の形式でエンコードし、バイト列を経由せずにファイルに直接書き込みます。
+
+    Args:
+        path (Path): 保存先の画像ファイルのパス
+        img (np.ndarray): BGR形式の画像
+        params (List[int], optional): cv2.imwriteのパラメータ。(cv2.IMWRITE_JPEG_QUALITY, 90)など. Defaults to None.
+
+    Returns:
+        bool: 書き込めた場合はTrue
+    """
+    return cv2.imwrite(str(path), img, params or [])
+
+
+class ImageReader(object):
+    def __init__(self, slots:int=1, flags:int=cv2.IMREAD_COLOR):
+        """
+        画像を使い回すバッファにデコードするリーダー。
+        同じサイズの画像が続く場合、slots個のバッファを順番に使い回すため、画像ごとに配列を確保しません。
+        返した画像はslots回後の読み込みで上書きされるため、それまでに使い終えてください。スレッドセーフではありません。
+
+        Args:
+            slots (int, optional): 使い回すバッファの数. Defaults to 1.
+            flags (int, optional): cv2.imreadのフラグ. Defaults to cv2.IMREAD_COLOR.
+        """
+        self.flags = flags
+        self.buffers:List[np.ndarray] = [None] * max(1, int(slots))
+        self.index = 0
+        self.allocations = 0
+        self.reused = 0
+
+    def read(self, path:Path) -> np.ndarray:
+        """
+        画像を読み込みます。.npyファイルはバッファを使わずにメモリマップで読み込みます。
+
+        Args:
+            path (Path): 画像ファイルまたは.npyファイルのパス
+
+        Returns:
+            np.ndarray: 画像。読み込めない場合はNone
+        """
+        if Path(path).suffix.lower() == NPY_SUFFIX:
+            return imread(path)
+        i = self.index
+        buf = self.buffers[i]
+        img = imread(path, self.flags, dst=buf)
+        if img is None:
+            return None
+        self.index = (i + 1) % len(self.buffers)
+        if buf is not None and img.ctypes.data == buf.ctypes.data:
+            self.reused += 1
+        else:
+            self.allocations += 1
+            self.buffers[i] = img
+        return img
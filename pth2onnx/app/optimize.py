@@ -0,0 +1,129 @@
+from pathlib import Path
+from pth2onnx.app import engine
+from typing import List
+import logging
+import numpy as np
+import onnxruntime
+import time
+
+LEVELS = dict(basic=onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+              extended=onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+              all=onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL)
+
+def count_nodes(onnx_file:Path) -> int:
+    """
+    ONNXモデルのノード数を数えます。onnxがインストールされていない場合や、ORT形式の場合は数えません。
+
+    Args:
+        onnx_file (Path): ONNXファイルのパス
+
+    Returns:
+        int: ノード数。数えられない場合はNone
+    """
+    if Path(onnx_file).suffix == '.ort':
+        return None
+    try:
+        import onnx
+    except ImportError:
+        return None
+    return len(onnx.load(str(onnx_file), load_external_data=False).graph.node)
+
+def measure(onnx_file:Path, repeat:int=3, iterations:int=10) -> dict:
+    """
+    ONNXモデルのノード数、ファイルサイズ、セッションの作成時間と推論時間を測定します。
+    セッションはpth2onnxの推論と同じ設定で作成するため、最適化済みのモデルはグラフの最適化を省略します。
+
+    Args:
+        onnx_file (Path): ONNXファイルのパス
+        repeat (int, optional): セッションを作成する回数。最小値を採用します. Defaults to 3.
+        iterations (int, optional): 推論時間を測定する回数. Defaults to 10.
+
+    Returns:
+        dict: 測定結果
+    """
+    onnx_file = Path(onnx_file)
+    session_sec = []
+    for _ in range(max(1, repeat)):
+        tm = time.perf_counter()
+        session = onnxruntime.InferenceSession(str(onnx_file), sess_options=engine.session_options(onnx_file),
+                                               providers=['CPUExecutionProvider'])
+        session_sec.append(time.perf_counter() - tm)
+    model_input = session.get_inputs()[0]
+    shape = [d if isinstance(d, int) else (1 if i == 0 else 416) for i, d in enumerate(model_input.shape)]
+    x = np.zeros(shape, dtype=np.float32)
+    session.run(None, {model_input.name: x})
+    latencies = []
+    for _ in range(max(1, iterations)):
+        tm = time.perf_counter()
+        session.run(None, {model_input.name: x})
+        latencies.append(time.perf_counter() - tm)
+    return dict(file=str(onnx_file), nodes=count_nodes(onnx_file), size_mb=round(onnx_file.stat().st_size / 1024 / 1024, 2),
+                session_ms=round(min(session_sec) * 1000, 2), latency_ms=round(float(np.mean(latencies)) * 1000, 2))
+
+def simplify(onnx_file:Path, output_file:Path, logger:logging.Logger=None) -> bool:
+    """
+    onnx-simplifierで定数の畳み込みと冗長なノードの削除を行います。
+
+    Args:
+        onnx_file (Path): 入力のONNXファイルのパス
+        output_file (Path): 出力のONNXファイルのパス
+        logger (logging.Logger, optional): ロガー. Defaults to None.
+
+    Returns:
+        bool: 簡略化した場合はTrue。onnx-simplifierがインストールされていない場合や、検証に失敗した場合はFalse
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    try:
+        import onnx
+        import onnxsim
+    except ImportError:
+        logger.info(f"onnx-simplifier is not installed. Skip simplification.")
+        return False
+    model, check = onnxsim.simplify(onnx.load(str(onnx_file)))
+    if not check:
+        logger.warning(f"Simplified model check failed. Skip simplification. ({onnx_file})")
+        return False
+    onnx.save(model, str(output_file))
+    return True
+
+def optimize_model(onnx_file:Path, use_simplify:bool=True, ort_format:bool=False, level:str='extended',
+                   logger:logging.Logger=None) -> List[dict]:
+    """
+    ONNXモデルを簡略化し、ONNX Runtimeでオフライン最適化したモデルを元のファイルと同じディレクトリに保存します。
+    最適化済みのモデルは<名前>.opt.onnx、ORT形式の場合は<名前>.ortとして保存します。
+    ONNX Runtimeの最適化には定数の畳み込みが含まれるため、onnx-simplifierが無くても定数は畳み込まれます。
+
+    Args:
+        onnx_file (Path): ONNXファイルのパス
+        use_simplify (bool, optional): onnx-simplifierで簡略化するかどうか. Defaults to True.
+        ort_format (bool, optional): ORT形式で保存するかどうか. Defaults to False.
+        level (str, optional): ONNX Runtimeの最適化レベル。'basic'、'extended'または'all'.
+            'all'はハードウェア依存のレイアウトに変換されるため、同じ環境でのみ使用してください. Defaults to 'extended'.
+        logger (logging.Logger, optional): ロガー. Defaults to None.
+
+    Returns:
+        List[dict]: 元のモデルと、生成したモデルごとの測定結果
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    onnx_file = Path(onnx_file)
+    if level not in LEVELS:
+        raise ValueError(f"Unknown optimization level. ({level})")
+    stem = onnx_file.name[:-len(onnx_file.suffix)] if onnx_file.suffix else onnx_file.name
+    rows = [dict(stage='original', **measure(onnx_file))]
+    src = onnx_file
+    if use_simplify:
+        sim_file = onnx_file.with_name(f"{stem}.sim.onnx")
+        if simplify(onnx_file, sim_file, logger=logger):
+            rows.append(dict(stage='simplified', **measure(sim_file)))
+            src = sim_file
+    output_file = onnx_file.with_name(f"{stem}.ort" if ort_format else f"{stem}{engine.OPTIMIZED_SUFFIX}")
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = LEVELS[level]
+    options.optimized_model_filepath = str(output_file)
+    if ort_format:
+        options.add_session_config_entry('session.save_model_format', 'ORT')
+    onnxruntime.InferenceSession(str(src), sess_options=options, providers=['CPUExecutionProvider'])
+    rows.append(dict(stage=f"optimized({level})", **measure(output_file)))
+    for row in rows:
+        logger.info(f"Optimize {row}")
+    return rows
@@ -0,0 +1,369 @@
+from pathlib import Path
+from pth2onnx.app import engine, imageio, postprocess, render
+from typing import Any, Iterator, Tuple
+import contextvars
+import cv2
+import json
+import logging
+import numpy as np
+import queue
+import threading
+import time
+
+_END = object()
+
+def draw_detections(img:np.ndarray, dets:np.ndarray, labels:Tuple[str, ...]=postprocess.COCO_CLASSES) -> np.ndarray:
+    """
+    画像に検出結果のバウンディングボックスとラベルを描画します。画像は直接書き換えられます。
+
+    Args:
+        img (np.ndarray): BGR形式の画像
+        dets (np.ndarray): 検出結果(K, 6)。x1, y1, x2, y2, スコア, クラスの順
+        labels (Tuple[str, ...], optional): クラスのラベル. Defaults to COCO_CLASSES.
+
+    Returns:
+        np.ndarray: 描画した画像
+    """
+    return render.get_renderer(labels=labels).draw(img, dets)
+
+
+class StageCounter(object):
+    def __init__(self, name:str):
+        """
+        パイプラインの段ごとの処理件数と処理時間を数えるカウンター
+
+        Args:
+            name (str): 段の名前
+        """
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items:int, elapsed:float):
+        with self.lock:
+            self.items += items
+            self.busy += elapsed
+
+    def to_dict(self) -> dict:
+        """
+        処理件数、処理時間(秒)、処理時間あたりのスループット(件/秒)を返します。
+
+        Returns:
+            dict: カウンターの値
+        """
+        with self.lock:
+            return dict(stage=self.name, items=self.items, busy_sec=round(self.busy, 3),
+                        items_per_sec=round(self.items / self.busy, 2) if self.busy > 0 else None)
+
+
+class ImageDirSource(object):
+    def __init__(self, input_dir:Path):
+        """
+        ディレクトリ内の画像ファイルを入力とするソース。画像のデコードは並列に行えます。
+
+        Args:
+            input_dir (Path): 入力画像のディレクトリのパス
+        """
+        self.input_dir = Path(input_dir)
+        self.parallel = True
+
+    def tasks(self) -> Iterator[Tuple[Any, Any]]:
+        for fp in engine.list_image_files(self.input_dir):
+            yield fp, fp
+
+    def decode(self, payload:Path) -> np.ndarray:
+        return imageio.imread(payload)
+
+
+class VideoSource(object):
+    def __init__(self, input_video:str):
+        """
+        動画ファイルのフレームを入力とするソース。フレームは読み込み時に順番にデコードされます。
+
+        Args:
+            input_video (str): 動画ファイルのパス
+        """
+        self.input_video = str(input_video)
+        self.cap = cv2.VideoCapture(self.input_video)
+        if not self.cap.isOpened():
+            raise ValueError(f"Video open failed. ({self.input_video})")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.size = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.parallel = False
+
+    def tasks(self) -> Iterator[Tuple[Any, Any]]:
+        frame_idx = 0
+        try:
+            while True:
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                yield frame_idx, frame
+                frame_idx += 1
+        finally:
+            self.cap.release()
+
+    def decode(self, payload:np.ndarray) -> np.ndarray:
+        return payload
+
+
+class ImageDirSink(object):
+    def __init__(self, input_dir:Path, output_dir:Path, output_jsonl:Path, labels:Tuple[str, ...]=postprocess.COCO_CLASSES):
+        """
+        検出結果を描画した画像を入力と同じ相対パスで保存し、検出結果をJSONLに書き出すシンク
+
+        Args:
+            input_dir (Path): 入力画像のディレクトリのパス
+            output_dir (Path): 出力画像のディレクトリのパス。Noneの場合は画像を保存しない
+            output_jsonl (Path): 検出結果を保存するJSONLファイルのパス
+            labels (Tuple[str, ...], optional): クラスのラベル. Defaults to COCO_CLASSES.
+        """
+        self.input_dir = Path(input_dir)
+        self.output_dir = Path(output_dir) if output_dir is not None else None
+        self.labels = labels
+        self.jsonl = open(output_jsonl, 'w', encoding='utf-8')
+
+    def encode(self, key:Path, img:np.ndarray, dets:np.ndarray) -> dict:
+        record = postprocess.dets2dict(key, dets, labels=self.labels)
+        if self.output_dir is not None:
+            outfile = self.output_dir / Path(key).relative_to(self.input_dir)
+            if outfile.suffix.lower() == imageio.NPY_SUFFIX:
+                # .npyはメモリマップの読み取り専用の画像のため、コピーに描画してJPEGで保存する
+                outfile, img = outfile.with_suffix('.jpg'), np.array(img)
+            outfile.parent.mkdir(parents=True, exist_ok=True)
+            imageio.imwrite(outfile, draw_detections(img, dets, labels=self.labels))
+            record['output'] = str(outfile)
+        return record
+
+    def write(self, key:Path, record:dict):
+        self.jsonl.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self.jsonl.close()
+
+
+class VideoSink(object):
+    def __init__(self, output_video:Path, fps:float, size:Tuple[int, int], output_jsonl:Path, labels:Tuple[str, ...]=postprocess.COCO_CLASSES):
+        """
+        検出結果を描画したフレームを動画ファイルに書き出し、検出結果をJSONLに書き出すシンク
+
+        Args:
+            output_video (Path): 出力動画ファイルのパス。Noneの場合は動画を保存しない
+            fps (float): 出力動画のフレームレート
+            size (Tuple[int, int]): 出力動画のサイズ(幅, 高さ)
+            output_jsonl (Path): 検出結果を保存するJSONLファイルのパス
+            labels (Tuple[str, ...], optional): クラスのラベル. Defaults to COCO_CLASSES.
+        """
+        self.labels = labels
+        self.writer = None
+        if output_video is not None:
+            self.writer = cv2.VideoWriter(str(output_video), cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+        self.jsonl = open(output_jsonl, 'w', encoding='utf-8')
+
+    def encode(self, key:int, img:np.ndarray, dets:np.ndarray) -> Tuple[np.ndarray, dict]:
+        record = postprocess.dets2dict(key, dets, labels=self.labels)
+        del record['image']
+        record = dict(frame=key, **record)
+        if self.writer is not None:
+            draw_detections(img, dets, labels=self.labels)
+        return img, record
+
+    def write(self, key:int, record:Tuple[np.ndarray, dict]):
+        img, record = record
+        if self.writer is not None and img is not None:
+            self.writer.write(img)
+        self.jsonl.write(json.dumps(record) + '\n')
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+        self.jsonl.close()
+
+
+class Pipeline(object):
+    def __init__(self, eng:engine.OnnxEngine, score_th:float=0.3, nms_th:float=0.45, decode_threads:int=2, encode_threads:int=2,
+                 queue_size:int=16, logger:logging.Logger=None):
+        """
+        読み込み、デコード、推論、描画とエンコード、書き出しの各段を上限付きのキューでつないだパイプライン。
+        デコードと描画は複数スレッド、推論は1スレッドでバッチにまとめて行います。
+        キューが一杯になると前段は待たされるため、メモリ使用量は一定の範囲に収まります。
+        書き出しは入力と同じ順番で行われます。
+
+        Args:
+            eng (engine.OnnxEngine): 推論エンジン
+            score_th (float, optional): スコアの閾値. Defaults to 0.3.
+            nms_th (float, optional): NMSの閾値. Defaults to 0.45.
+            decode_threads (int, optional): デコードのスレッド数. Defaults to 2.
+            encode_threads (int, optional): 描画とエンコードのスレッド数. Defaults to 2.
+            queue_size (int, optional): 各段の間のキューの上限. Defaults to 16.
+            logger (logging.Logger, optional): ロガー. Defaults to None.
+        """
+        self.eng = eng
+        self.score_th = float(score_th)
+        self.nms_th = float(nms_th)
+        self.decode_threads = max(1, int(decode_threads or 1))
+        self.encode_threads = max(1, int(encode_threads or 1))
+        self.queue_size = max(1, int(queue_size or 1))
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.counters = {name:StageCounter(name) for name in ('read', 'decode', 'infer', 'encode', 'write')}
+        self.errors = []
+        self._stop = threading.Event()
+
+    def _stage(self, name:str, func, *args):
+        def _run():
+            try:
+                func(*args)
+            except Exception as e:
+                self.logger.error(f"Pipeline stage {name} failed. {e}", exc_info=True)
+                self.errors.append(f"{name}: {e}")
+                self._stop.set()
+        # 推論のトレースのスパンが呼び出し元のスパンの子になるように、スレッドごとにコンテキストを引き継ぐ
+        return threading.Thread(target=contextvars.copy_context().run, args=(_run,), name=f"pipeline-{name}", daemon=True)
+
+    def _put(self, q:queue.Queue, item):
+        # いずれかの段が失敗した場合に、一杯のキューで待ち続けないようにする
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q:queue.Queue):
+        # いずれかの段が失敗した場合は終了の印を返して各段を終わらせる
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _END
+
+    def _read(self, source, task_q:queue.Queue):
+        try:
+            tm = time.perf_counter()
+            for seq, (key, payload) in enumerate(source.tasks()):
+                self.counters['read'].add(1, time.perf_counter() - tm)
+                self._put(task_q, (seq, key, payload))
+                tm = time.perf_counter()
+        finally:
+            for _ in range(self.decode_threads):
+                self._put(task_q, _END)
+
+    def _decode(self, source, task_q:queue.Queue, decoded_q:queue.Queue):
+        try:
+            while True:
+                item = self._get(task_q)
+                if item is _END:
+                    break
+                seq, key, payload = item
+                tm = time.perf_counter()
+                img = source.decode(payload)
+                self.counters['decode'].add(1, time.perf_counter() - tm)
+                self._put(decoded_q, (seq, key, img))
+        finally:
+            self._put(decoded_q, _END)
+
+    def _infer(self, decoded_q:queue.Queue, infer_q:queue.Queue):
+        try:
+            ends = 0
+            batch = []
+            while ends < self.decode_threads:
+                item = self._get(decoded_q)
+                if item is _END:
+                    ends += 1
+                elif item[2] is None:
+                    self._put(infer_q, (*item, None))
+                else:
+                    batch.append(item)
+                # 前段にデータが溜まっていなければバッチが揃うのを待たずに推論する
+                if len(batch) >= self.eng.batch_size or (len(batch) > 0 and (decoded_q.empty() or ends >= self.decode_threads)):
+                    tm = time.perf_counter()
+                    results = self.eng.infer([img for _, _, img in batch], score_th=self.score_th, nms_th=self.nms_th)
+                    self.counters['infer'].add(len(batch), time.perf_counter() - tm)
+                    for (seq, key, img), dets in zip(batch, results):
+                        self._put(infer_q, (seq, key, img, dets))
+                    batch = []
+        finally:
+            for _ in range(self.encode_threads):
+                self._put(infer_q, _END)
+
+    def _encode(self, sink, infer_q:queue.Queue, encoded_q:queue.Queue):
+        try:
+            while True:
+                item = self._get(infer_q)
+                if item is _END:
+                    break
+                seq, key, img, dets = item
+                if img is None:
+                    self._put(encoded_q, (seq, key, None))
+                    continue
+                tm = time.perf_counter()
+                record = sink.encode(key, img, dets)
+                self.counters['encode'].add(1, time.perf_counter() - tm)
+                self._put(encoded_q, (seq, key, record))
+        finally:
+            self._put(encoded_q, _END)
+
+    def _write(self, sink, encoded_q:queue.Queue, result:dict):
+        ends = 0
+        pending = dict()
+        next_seq = 0
+        while ends < self.encode_threads:
+            item = self._get(encoded_q)
+            if item is _END:
+                ends += 1
+                continue
+            pending[item[0]] = item
+            # 入力の順番どおりに書き出すため、次の番号が届くまで保留する
+            while next_seq in pending:
+                _, key, record = pending.pop(next_seq)
+                tm = time.perf_counter()
+                if record is None:
+                    result['errors'] += 1
+                    self.logger.warning(f"Image load failed. ({key})")
+                else:
+                    sink.write(key, record)
+                    result['outputs'] += 1
+                self.counters['write'].add(1, time.perf_counter() - tm)
+                next_seq += 1
+
+    def run(self, source, sink) -> dict:
+        """
+        ソースのすべての入力を推論し、結果をシンクに書き出します。
+
+        Args:
+            source: 入力のソース(ImageDirSourceまたはVideoSource)
+            sink: 出力のシンク(ImageDirSinkまたはVideoSink)
+
+        Returns:
+            dict: 出力件数、エラー件数、経過時間、段ごとのカウンター
+        """
+        task_q = queue.Queue(maxsize=self.queue_size)
+        decoded_q = queue.Queue(maxsize=self.queue_size)
+        infer_q = queue.Queue(maxsize=self.queue_size)
+        encoded_q = queue.Queue(maxsize=self.queue_size)
+        result = dict(outputs=0, errors=0)
+        if not source.parallel:
+            self.decode_threads = 1
+        threads = [self._stage('read', self._read, source, task_q)]
+        threads += [self._stage('decode', self._decode, source, task_q, decoded_q) for _ in range(self.decode_threads)]
+        threads += [self._stage('infer', self._infer, decoded_q, infer_q)]
+        threads += [self._stage('encode', self._encode, sink, infer_q, encoded_q) for _ in range(self.encode_threads)]
+        tm = time.perf_counter()
+        for t in threads:
+            t.start()
+        try:
+            self._write(sink, encoded_q, result)
+        except Exception as e:
+            self.logger.error(f"Pipeline stage write failed. {e}", exc_info=True)
+            self.errors.append(f"write: {e}")
+            self._stop.set()
+        finally:
+            sink.close()
+        for t in threads:
+            t.join()
+        result['elapsed'] = round(time.perf_counter() - tm, 3)
+        result['stages'] = [c.to_dict() for c in self.counters.values()]
+        result['errors_detail'] = self.errors
+        return result
@@ -0,0 +1,344 @@
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Tuple
+import numpy as np
+
+COCO_CLASSES = (
+    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat', 'traffic light',
+    'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow',
+    'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee',
+    'skis', 'snowboard', 'sports ball', 'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket', 'bottle',
+    'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple', 'sandwich', 'orange',
+    'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch', 'potted plant', 'bed',
+    'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard', 'cell phone', 'microwave', 'oven',
+    'toaster', 'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear', 'hair drier', 'toothbrush',
+)
+
+STRIDES = (8, 16, 32)
+
+@lru_cache(maxsize=16)
+def _grids(input_size:Tuple[int, int], strides:Tuple[int, ...]=STRIDES) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    入力サイズとストライドからグリッド座標とストライドの配列を作成します。
+
+    Args:
+        input_size (Tuple[int, int]): モデルの入力サイズ(高さ, 幅)
+        strides (Tuple[int, ...], optional): ストライド. Defaults to (8, 16, 32).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: グリッド座標(1, A, 2)とストライド(1, A, 1)
+    """
+    grids = []
+    expanded_strides = []
+    for stride in strides:
+        hsize, wsize = input_size[0] // stride, input_size[1] // stride
+        xv, yv = np.meshgrid(np.arange(wsize), np.arange(hsize))
+        grid = np.stack((xv, yv), 2).reshape(1, -1, 2)
+        grids.append(grid)
+        expanded_strides.append(np.full((*grid.shape[:2], 1), stride))
+    return np.concatenate(grids, 1).astype(np.float32), np.concatenate(expanded_strides, 1).astype(np.float32)
+
+def decode_outputs(outputs:np.ndarray, input_size:Tuple[int, int], strides:Tuple[int, ...]=STRIDES) -> np.ndarray:
+    """
+    YOLOXのONNXモデルの出力をグリッドとストライドで入力画像の座標にデコードします。
+    出力は(バッチ, アンカー数, 5 + クラス数)で、先頭4要素が中心座標と幅高さです。
+
+    Args:
+        outputs (np.ndarray): ONNXモデルの出力
+        input_size (Tuple[int, int]): モデルの入力サイズ(高さ, 幅)
+        strides (Tuple[int, ...], optional): ストライド. Defaults to (8, 16, 32).
+
+    Returns:
+        np.ndarray: デコードした出力
+    """
+    grids, expanded_strides = _grids(tuple(input_size), tuple(strides))
+    outputs = outputs.copy()
+    outputs[..., :2] = (outputs[..., :2] + grids) * expanded_strides
+    outputs[..., 2:4] = np.exp(outputs[..., 2:4]) * expanded_strides
+    return outputs
+
+def nms(boxes:np.ndarray, scores:np.ndarray, nms_th:float) -> List[int]:
+    """
+    1クラス分のバウンディングボックスにNMSを適用します。
+
+    Args:
+        boxes (np.ndarray): バウンディングボックス(N, 4)。x1, y1, x2, y2の順
+        scores (np.ndarray): スコア(N,)
+        nms_th (float): NMSの閾値
+
+    Returns:
+        List[int]: 残すバウンディングボックスのインデックス
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
+        inter = w * h
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+        inds = np.where(ovr <= nms_th)[0]
+        order = order[inds + 1]
+    return keep
+
+def multiclass_nms(boxes:np.ndarray, scores:np.ndarray, nms_th:float, score_th:float) -> np.ndarray:
+    """
+    クラスごとにスコアの閾値とNMSを適用します。
+
+    Args:
+        boxes (np.ndarray): バウンディングボックス(N, 4)。x1, y1, x2, y2の順
+        scores (np.ndarray): クラスごとのスコア(N, クラス数)
+        nms_th (float): NMSの閾値
+        score_th (float): スコアの閾値
+
+    Returns:
+        np.ndarray: 検出結果(K, 6)。x1, y1, x2, y2, スコア, クラスの順。検出なしの場合はNone
+    """
+    final_dets = []
+    for cls_ind in range(scores.shape[1]):
+        cls_scores = scores[:, cls_ind]
+        valid_score_mask = cls_scores > score_th
+        if valid_score_mask.sum() == 0:
+            continue
+        valid_scores = cls_scores[valid_score_mask]
+        valid_boxes = boxes[valid_score_mask]
+        keep = nms(valid_boxes, valid_scores, nms_th)
+        if len(keep) > 0:
+            cls_inds = np.ones((len(keep), 1)) * cls_ind
+            final_dets.append(np.concatenate([valid_boxes[keep], valid_scores[keep, None], cls_inds], 1))
+    if len(final_dets) == 0:
+        return None
+    return np.concatenate(final_dets, 0)
+
+def batched_nms(boxes:np.ndarray, scores:np.ndarray, groups:np.ndarray, nms_th:float, tile:int=64) -> np.ndarray:
+    """
+    グループごとのNMSを全グループまとめて適用します。
+    結果はグループごとにnmsを適用した場合と同じです。
+
+    候補をグループ、左端のx座標の順に並べ、x方向に重なり得る候補どうしだけIoUを
+    タイル単位で計算して抑制ペアを求めます。
+    「スコアが上位の残った候補に抑制されない候補を残す」という貪欲法の条件を
+    抑制ペアに繰り返し適用し、結果が変わらなくなった時点で確定します。
+
+    Args:
+        boxes (np.ndarray): バウンディングボックス(N, 4)。x1, y1, x2, y2の順
+        scores (np.ndarray): スコア(N,)
+        groups (np.ndarray): グループ番号(N,)
+        nms_th (float): NMSの閾値
+        tile (int, optional): 一度にIoUを計算する行数. Defaults to 64.
+
+    Returns:
+        np.ndarray: 残す候補のインデックス。グループの昇順、スコアの降順
+    """
+    num = len(boxes)
+    if num == 0:
+        return np.zeros(0, dtype=np.int64)
+    order = np.lexsort((-scores, groups))
+    rank = np.empty(num, dtype=np.int64)
+    rank[order] = np.arange(num)
+
+    sweep = np.lexsort((boxes[:, 0], groups))
+    boxes, groups, rank = boxes[sweep], groups[sweep], rank[sweep]
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    starts = np.searchsorted(groups, groups, side='left')
+    ends = np.searchsorted(groups, groups, side='right')
+    index = np.arange(num)
+    src, dst = [], []
+    for i0 in range(0, num, tile):
+        i1 = min(i0 + tile, num)
+        # 最後の行と同じグループの列は、左端がタイル内の右端より右にあれば重ならない
+        gs, ge = starts[i1 - 1], ends[i1 - 1]
+        reach = x2[max(i0, gs):i1].max() + 1
+        j1 = max(i1, gs + int(np.searchsorted(x1[gs:ge], reach, side='left')))
+        if i0 + 1 >= j1:
+            continue
+        w = np.minimum(x2[i0:i1, None], x2[None, i0:j1])
+        w -= np.maximum(x1[i0:i1, None], x1[None, i0:j1])
+        w += 1
+        np.maximum(w, 0.0, out=w)
+        h = np.minimum(y2[i0:i1, None], y2[None, i0:j1])
+        h -= np.maximum(y1[i0:i1, None], y1[None, i0:j1])
+        h += 1
+        np.maximum(h, 0.0, out=h)
+        inter = np.multiply(w, h, out=w)
+        union = np.add(areas[i0:i1, None], areas[None, i0:j1], out=h)
+        union -= inter
+        ovr = np.divide(inter, union, out=inter)
+        suppress = ovr > nms_th
+        suppress &= (index[None, i0:j1] > index[i0:i1, None]) & (index[None, i0:j1] < ends[i0:i1, None])
+        ii, jj = np.nonzero(suppress)
+        ri, rj = rank[ii + i0], rank[jj + i0]
+        src.append(np.minimum(ri, rj))
+        dst.append(np.maximum(ri, rj))
+    src = np.concatenate(src) if len(src) > 0 else np.zeros(0, dtype=np.int64)
+    dst = np.concatenate(dst) if len(dst) > 0 else np.zeros(0, dtype=np.int64)
+    # src、dstはスコア順の位置。srcが残る場合にdstが抑制される
+    keep = np.ones(num, dtype=bool)
+    while True:
+        suppressed = np.zeros(num, dtype=bool)
+        suppressed[dst[keep[src]]] = True
+        if np.array_equal(~suppressed, keep):
+            break
+        keep = ~suppressed
+    return order[keep]
+
+def postprocess(outputs:np.ndarray, input_size:Tuple[int, int], ratios:np.ndarray, score_th:float=0.3, nms_th:float=0.45) -> List[np.ndarray]:
+    """
+    YOLOXのONNXモデルの出力から画像ごとの検出結果を求めます。
+    デコード、スコアの閾値、クラスごとのNMSをバッチ全体にまとめて適用します。
+    結果はpostprocess_referenceと同じです。
+
+    Args:
+        outputs (np.ndarray): ONNXモデルの出力(バッチ, アンカー数, 5 + クラス数)
+        input_size (Tuple[int, int]): モデルの入力サイズ(高さ, 幅)
+        ratios (np.ndarray): 画像ごとのリサイズ比率(バッチ,)
+        score_th (float, optional): スコアの閾値. Defaults to 0.3.
+        nms_th (float, optional): NMSの閾値. Defaults to 0.45.
+
+    Returns:
+        List[np.ndarray]: 画像ごとの検出結果(K, 6)。x1, y1, x2, y2, スコア, クラスの順で元画像の座標
+    """
+    predictions = decode_outputs(outputs, input_size)
+    num_images, num_classes = predictions.shape[0], predictions.shape[2] - 5
+    boxes = np.empty_like(predictions[..., :4])
+    boxes[..., 0] = predictions[..., 0] - predictions[..., 2] / 2.
+    boxes[..., 1] = predictions[..., 1] - predictions[..., 3] / 2.
+    boxes[..., 2] = predictions[..., 0] + predictions[..., 2] / 2.
+    boxes[..., 3] = predictions[..., 1] + predictions[..., 3] / 2.
+    boxes /= np.asarray(ratios, dtype=boxes.dtype)[:, None, None]
+    scores = predictions[..., 4:5] * predictions[..., 5:]
+
+    img_inds, anchor_inds, cls_inds = np.nonzero(scores > score_th)
+    cand_scores = scores[img_inds, anchor_inds, cls_inds]
+    cand_boxes = boxes[img_inds, anchor_inds]
+    keep = batched_nms(cand_boxes, cand_scores, img_inds * num_classes + cls_inds, nms_th)
+
+    dets = np.concatenate([cand_boxes[keep], cand_scores[keep, None], cls_inds[keep, None]], 1)
+    splits = np.searchsorted(img_inds[keep], np.arange(1, num_images))
+    return np.split(dets, splits)
+
+def postprocess_reference(outputs:np.ndarray, input_size:Tuple[int, int], ratios:np.ndarray, score_th:float=0.3, nms_th:float=0.45) -> List[np.ndarray]:
+    """
+    YOLOXのONNXモデルの出力から画像ごとの検出結果を求めます。
+    YOLOXのdemo_postprocessとmulticlass_nmsと同じ手順で画像ごと、クラスごとに処理する参照実装です。
+
+    Args:
+        outputs (np.ndarray): ONNXモデルの出力(バッチ, アンカー数, 5 + クラス数)
+        input_size (Tuple[int, int]): モデルの入力サイズ(高さ, 幅)
+        ratios (np.ndarray): 画像ごとのリサイズ比率(バッチ,)
+        score_th (float, optional): スコアの閾値. Defaults to 0.3.
+        nms_th (float, optional): NMSの閾値. Defaults to 0.45.
+
+    Returns:
+        List[np.ndarray]: 画像ごとの検出結果(K, 6)。x1, y1, x2, y2, スコア, クラスの順で元画像の座標
+    """
+    predictions = decode_outputs(outputs, input_size)
+    results = []
+    for pred, ratio in zip(predictions, ratios):
+        boxes = pred[:, :4]
+        scores = pred[:, 4:5] * pred[:, 5:]
+        boxes_xyxy = np.ones_like(boxes)
+        boxes_xyxy[:, 0] = boxes[:, 0] - boxes[:, 2] / 2.
+        boxes_xyxy[:, 1] = boxes[:, 1] - boxes[:, 3] / 2.
+        boxes_xyxy[:, 2] = boxes[:, 0] + boxes[:, 2] / 2.
+        boxes_xyxy[:, 3] = boxes[:, 1] + boxes[:, 3] / 2.
+        boxes_xyxy /= ratio
+        dets = multiclass_nms(boxes_xyxy, scores, nms_th=nms_th, score_th=score_th)
+        results.append(dets if dets is not None else np.zeros((0, 6), dtype=np.float32))
+    return results
+
+def box_iou(boxes_a:np.ndarray, boxes_b:np.ndarray) -> np.ndarray:
+    """
+    2組のバウンディングボックスのすべての組み合わせのIoUを求めます。
+
+    Args:
+        boxes_a (np.ndarray): バウンディングボックス(N, 4)。x1, y1, x2, y2の順
+        boxes_b (np.ndarray): バウンディングボックス(M, 4)。x1, y1, x2, y2の順
+
+    Returns:
+        np.ndarray: IoU(N, M)
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]).clip(0) * (boxes_a[:, 3] - boxes_a[:, 1]).clip(0)
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]).clip(0) * (boxes_b[:, 3] - boxes_b[:, 1]).clip(0)
+    lt = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    rb = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    wh = (rb - lt).clip(0)
+    inter = wh[..., 0] * wh[..., 1]
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+def match_detections(dets_ref:np.ndarray, dets:np.ndarray, iou_th:float=0.5) -> int:
+    """
+    2つの検出結果を同じクラスでIoUが閾値以上のもの同士、スコアの高い順に1対1で対応付けます。
+
+    Args:
+        dets_ref (np.ndarray): 基準とする検出結果(N, 6)
+        dets (np.ndarray): 比較する検出結果(M, 6)
+        iou_th (float, optional): 対応付けるIoUの閾値. Defaults to 0.5.
+
+    Returns:
+        int: 対応付けられた検出の数
+    """
+    dets_ref = np.asarray(dets_ref, dtype=np.float64).reshape(-1, 6)
+    dets = np.asarray(dets, dtype=np.float64).reshape(-1, 6)
+    if len(dets_ref) == 0 or len(dets) == 0:
+        return 0
+    ious = box_iou(dets_ref[:, :4], dets[:, :4])
+    ious[dets_ref[:, None, 5] != dets[None, :, 5]] = 0
+    used = np.zeros(len(dets), dtype=bool)
+    matched = 0
+    for i in np.argsort(-dets_ref[:, 4], kind='stable'):
+        cand = np.where(~used & (ious[i] >= iou_th))[0]
+        if len(cand) == 0:
+            continue
+        used[cand[ious[i, cand].argmax()]] = True
+        matched += 1
+    return matched
+
+def detection_agreement(dets_ref:List[np.ndarray], dets:List[np.ndarray], iou_th:float=0.5) -> Tuple[float, int]:
+    """
+    画像ごとの2つの検出結果の一致率を求めます。
+    match_detectionsで対応付けられた数の合計を、画像ごとに多い方の検出数の合計で割ります。
+
+    Args:
+        dets_ref (List[np.ndarray]): 画像ごとの基準とする検出結果
+        dets (List[np.ndarray]): 画像ごとの比較する検出結果
+        iou_th (float, optional): 対応付けるIoUの閾値. Defaults to 0.5.
+
+    Returns:
+        Tuple[float, int]: 一致率(検出が無い場合は1.0)と、分母の検出数
+    """
+    matched = total = 0
+    for a, b in zip(dets_ref, dets):
+        matched += match_detections(a, b, iou_th=iou_th)
+        total += max(len(a), len(b))
+    return (matched / total if total > 0 else 1.0), total
+
+def dets2dict(image_file:Path, dets:np.ndarray, labels:Tuple[str, ...]=COCO_CLASSES) -> dict:
+    """
+    検出結果をJSONに変換できる辞書にします。
+
+    Args:
+        image_file (Path): 画像ファイルのパス
+        dets (np.ndarray): 検出結果(K, 6)
+        labels (Tuple[str, ...], optional): クラスのラベル. Defaults to COCO_CLASSES.
+
+    Returns:
+        dict: 画像ファイルのパスと検出結果のリストを持つ辞書
+    """
+    detections = []
+    for x1, y1, x2, y2, score, cls in dets.tolist():
+        cls = int(cls)
+        detections.append(dict(box=[round(x1, 2), round(y1, 2), round(x2, 2), round(y2, 2)], score=round(score, 5),
+                               class_id=cls, label=labels[cls] if labels is not None and cls < len(labels) else str(cls)))
+    return dict(image=str(image_file), detections=detections)
@@ -0,0 +1,117 @@
+from pathlib import Path
+from pth2onnx.app import engine, imageio
+from typing import List, Tuple
+import logging
+import numpy as np
+import time
+
+MODES = ('static', 'dynamic')
+CALIB_METHODS = ('minmax', 'entropy', 'percentile')
+
+def split_images(image_files:List[Path], holdout_ratio:float=0.2) -> Tuple[List[Path], List[Path]]:
+    """
+    画像ファイルのリストをキャリブレーション用と評価用に分けます。
+    間隔を空けて評価用に取り出すため、連番の画像でも偏りが少なくなります。
+
+    Args:
+        image_files (List[Path]): 画像ファイルのリスト
+        holdout_ratio (float, optional): 評価用に取り出す割合. Defaults to 0.2.
+
+    Returns:
+        Tuple[List[Path], List[Path]]: キャリブレーション用と評価用の画像ファイルのリスト
+    """
+    if len(image_files) < 2 or holdout_ratio <= 0:
+        return list(image_files), []
+    step = max(2, int(round(1 / holdout_ratio)))
+    calib = [f for i, f in enumerate(image_files) if i % step != step - 1]
+    holdout = [f for i, f in enumerate(image_files) if i % step == step - 1]
+    return calib, holdout
+
+
+class ImageCalibrationReader(object):
+    def __init__(self, eng:engine.OnnxEngine, image_files:List[Path]):
+        """
+        画像ファイルを推論と同じ前処理でモデルの入力にして、1枚ずつ返すキャリブレーションデータのリーダー。
+        onnxruntime.quantization.CalibrationDataReaderと同じインターフェースを持ちます。
+
+        Args:
+            eng (engine.OnnxEngine): 前処理に使う推論エンジン
+            image_files (List[Path]): 画像ファイルのリスト
+        """
+        self.eng = eng
+        self.image_files = list(image_files)
+        self.index = 0
+        self.reader = imageio.ImageReader()
+
+    def get_next(self) -> dict:
+        while self.index < len(self.image_files):
+            img = self.reader.read(self.image_files[self.index])
+            self.index += 1
+            if img is None:
+                continue
+            batch, _ = self.eng.preprocess([img])
+            return {self.eng.input_name: batch}
+        return None
+
+    def rewind(self):
+        self.index = 0
+
+
+def quantize_model(onnx_file:Path, output_file:Path, mode:str='static', calib_reader:ImageCalibrationReader=None,
+                   calib_method:str='minmax', per_channel:bool=False, logger:logging.Logger=None) -> Path:
+    """
+    ONNXモデルをINT8に量子化します。
+
+    Args:
+        onnx_file (Path): FP32のONNXファイルのパス
+        output_file (Path): 量子化したONNXファイルのパス
+        mode (str, optional): 'static'は活性化もキャリブレーションで量子化、'dynamic'は重みのみ量子化. Defaults to 'static'.
+        calib_reader (ImageCalibrationReader, optional): staticの場合のキャリブレーションデータ. Defaults to None.
+        calib_method (str, optional): キャリブレーションの方法。'minmax'、'entropy'または'percentile'. Defaults to 'minmax'.
+        per_channel (bool, optional): 重みをチャネルごとに量子化するかどうか. Defaults to False.
+        logger (logging.Logger, optional): ロガー. Defaults to None.
+
+    Returns:
+        Path: 量子化したONNXファイルのパス
+    """
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    if mode == 'dynamic':
+        quantize_dynamic(str(onnx_file), str(output_file), per_channel=per_channel, weight_type=QuantType.QInt8)
+    elif mode == 'static':
+        if calib_reader is None:
+            raise ValueError(f"Calibration data is required for static quantization.")
+        methods = dict(minmax=CalibrationMethod.MinMax, entropy=CalibrationMethod.Entropy, percentile=CalibrationMethod.Percentile)
+        if calib_method not in methods:
+            raise ValueError(f"Unknown calibration method. ({calib_method})")
+        quantize_static(str(onnx_file), str(output_file), calib_reader, quant_format=QuantFormat.QDQ, per_channel=per_channel,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, calibrate_method=methods[calib_method])
+    else:
+        raise ValueError(f"Unknown quantization mode. ({mode})")
+    logger.info(f"Quantized. mode={mode}, output_file={output_file}")
+    return Path(output_file)
+
+def evaluate(eng:engine.OnnxEngine, image_files:List[Path], score_th:float=0.3, nms_th:float=0.45,
+             warmup:int=2) -> Tuple[List[np.ndarray], List[float]]:
+    """
+    画像を1枚ずつ推論し、検出結果と推論時間を返します。
+
+    Args:
+        eng (engine.OnnxEngine): 推論エンジン
+        image_files (List[Path]): 画像ファイルのリスト
+        score_th (float, optional): スコアの閾値. Defaults to 0.3.
+        nms_th (float, optional): NMSの閾値. Defaults to 0.45.
+        warmup (int, optional): 測定前に推論する回数. Defaults to 2.
+
+    Returns:
+        Tuple[List[np.ndarray], List[float]]: 画像ごとの検出結果と推論時間(秒)
+    """
+    imgs = [img for img in (imageio.imread(f) for f in image_files) if img is not None]
+    for img in imgs[:warmup]:
+        eng.infer([img], score_th=score_th, nms_th=nms_th)
+    results, latencies = [], []
+    for img in imgs:
+        tm = time.perf_counter()
+        results.append(eng.infer([img], score_th=score_th, nms_th=nms_th)[0])
+        latencies.append(time.perf_counter() - tm)
+    return results, latencies
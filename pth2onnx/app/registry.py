@@ -0,0 +1,230 @@
+from pathlib import Path
+from pth2onnx.app import common
+from typing import List
+import logging
+import platform
+import sqlite3
+import threading
+import time
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    arch TEXT,
+    input_size INTEGER,
+    weight_sha256 TEXT,
+    site TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS models_name ON models(name, input_size);
+CREATE INDEX IF NOT EXISTS models_arch ON models(arch);
+CREATE TABLE IF NOT EXISTS variants (
+    id INTEGER PRIMARY KEY,
+    model_id INTEGER NOT NULL REFERENCES models(id) ON DELETE CASCADE,
+    variant TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    size_mb REAL,
+    mtime REAL,
+    latency_ms REAL,
+    p95_ms REAL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS variants_model ON variants(model_id);
+CREATE INDEX IF NOT EXISTS variants_latency ON variants(latency_ms);
+CREATE TABLE IF NOT EXISTS benchmarks (
+    id INTEGER PRIMARY KEY,
+    variant_id INTEGER NOT NULL REFERENCES variants(id) ON DELETE CASCADE,
+    batch_size INTEGER NOT NULL,
+    latency_ms REAL NOT NULL,
+    p95_ms REAL,
+    threads INTEGER,
+    host TEXT,
+    measured REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS benchmarks_variant ON benchmarks(variant_id, batch_size);
+"""
+COLUMNS = """m.name, m.arch, m.input_size, substr(m.weight_sha256, 1, 12) AS weight_sha256, v.variant, v.path, v.size_mb,
+             v.latency_ms, v.p95_ms"""
+
+
+class ModelRegistry(object):
+    def __init__(self, logger:logging.Logger, data:Path):
+        """
+        モデルとONNXファイル、最適化や量子化したバリエーション、推論時間の測定結果を記録するレジストリ。
+        データディレクトリのSQLiteデータベースに保存し、モデル名や推論時間の索引で検索します。
+        バリエーションにはバッチサイズ1の最新の推論時間を持たせ、推論時間の上限での検索は索引だけで行います。
+
+        Args:
+            logger (logging.Logger): ロガー
+            data (Path): データディレクトリのパス
+        """
+        self.logger = logger
+        self.db_file = Path(data) / 'registry' / 'models.db'
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(self.db_file), timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA foreign_keys = ON")
+        with self.lock:
+            if con.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                con.execute("PRAGMA journal_mode = WAL")
+                con.executescript(SCHEMA)
+                self._seed(con)
+                con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return con
+
+    def _seed(self, con:sqlite3.Connection):
+        # 以前のcommon.BASE_MODELSはファイルを持たないモデルとして登録する
+        for key, m in common.BASE_MODELS.items():
+            if con.execute("SELECT 1 FROM models WHERE name = ?", (key,)).fetchone() is None:
+                con.execute("INSERT INTO models (name, arch, input_size, site, created) VALUES (?, ?, ?, ?, ?)",
+                            (key, key.split('_', 1)[-1], m['image_width'], m['site'], time.time()))
+
+    def _model_id(self, con:sqlite3.Connection, name:str, arch:str, input_size:int, weight_sha256:str) -> int:
+        row = con.execute("SELECT id FROM models WHERE name = ? AND input_size IS ? AND weight_sha256 IS ?",
+                          (name, input_size, weight_sha256)).fetchone()
+        if row is not None:
+            return row['id']
+        return con.execute("INSERT INTO models (name, arch, input_size, weight_sha256, created) VALUES (?, ?, ?, ?, ?)",
+                           (name, arch, input_size, weight_sha256, time.time())).lastrowid
+
+    def register(self, name:str, path:Path, variant:str='fp32', arch:str=None, input_size:int=None, weight_sha256:str=None,
+                 parent:Path=None) -> int:
+        """
+        ONNXファイルをモデルのバリエーションとして登録します。
+        同じパスのファイルが変わっていない場合は測定結果を残し、変わっている場合は測定結果を消して登録し直します。
+
+        Args:
+            name (str): モデル名
+            path (Path): ONNXファイルのパス
+            variant (str, optional): バリエーションの名前. Defaults to 'fp32'.
+            arch (str, optional): アーキテクチャ. Defaults to None.
+            input_size (int, optional): 入力サイズ. Defaults to None.
+            weight_sha256 (str, optional): 元の重みファイルのSHA-256. Defaults to None.
+            parent (Path, optional): 変換元のONNXファイルのパス。登録済みの場合は同じモデルのバリエーションにします. Defaults to None.
+
+        Returns:
+            int: バリエーションのID
+        """
+        path = Path(path).resolve()
+        st = path.stat()
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute("SELECT model_id FROM variants WHERE path = ?", (str(Path(parent).resolve()),)).fetchone() \
+                  if parent is not None else None
+            model_id = row['model_id'] if row is not None else self._model_id(con, name, arch, input_size, weight_sha256)
+            old = con.execute("SELECT id, size_mb, mtime FROM variants WHERE path = ?", (str(path),)).fetchone()
+            size_mb = round(st.st_size / 1024 / 1024, 2)
+            if old is not None and old['mtime'] == st.st_mtime and old['size_mb'] == size_mb:
+                con.execute("UPDATE variants SET model_id = ?, variant = ? WHERE id = ?", (model_id, variant, old['id']))
+                variant_id = old['id']
+            else:
+                if old is not None:
+                    con.execute("DELETE FROM variants WHERE id = ?", (old['id'],))
+                variant_id = con.execute("INSERT INTO variants (model_id, variant, path, size_mb, mtime, created) VALUES (?, ?, ?, ?, ?, ?)",
+                                         (model_id, variant, str(path), size_mb, st.st_mtime, time.time())).lastrowid
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        self.logger.debug(f"Registry registered. name={name}, variant={variant}, path={path}")
+        return variant_id
+
+    def record_bench(self, path:Path, latency_ms:float, p95_ms:float=None, batch_size:int=1, threads:int=None) -> bool:
+        """
+        登録済みのONNXファイルの推論時間を記録します。バッチサイズ1の場合はバリエーションの推論時間も更新します。
+
+        Args:
+            path (Path): ONNXファイルのパス
+            latency_ms (float): 1回の推論の平均時間(ミリ秒)
+            p95_ms (float, optional): 推論時間の95パーセンタイル(ミリ秒). Defaults to None.
+            batch_size (int, optional): バッチサイズ. Defaults to 1.
+            threads (int, optional): 推論のスレッド数. Defaults to None.
+
+        Returns:
+            bool: 記録した場合はTrue。ファイルが登録されていない場合はFalse
+        """
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute("SELECT id FROM variants WHERE path = ?", (str(Path(path).resolve()),)).fetchone()
+            if row is None:
+                con.execute("ROLLBACK")
+                return False
+            con.execute("INSERT INTO benchmarks (variant_id, batch_size, latency_ms, p95_ms, threads, host, measured) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (row['id'], int(batch_size), latency_ms, p95_ms, threads, platform.node(), time.time()))
+            if int(batch_size) == 1:
+                con.execute("UPDATE variants SET latency_ms = ?, p95_ms = ? WHERE id = ?", (latency_ms, p95_ms, row['id']))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        return True
+
+    def query(self, name:str=None, arch:str=None, input_size:int=None, variant:str=None, max_latency:float=None,
+              limit:int=None) -> List[dict]:
+        """
+        条件に合うモデルとバリエーションを検索します。ファイルを持たないモデルはバリエーションの列が空になります。
+
+        Args:
+            name (str, optional): モデル名。*や?を含む場合はワイルドカードとして扱います. Defaults to None.
+            arch (str, optional): アーキテクチャ. Defaults to None.
+            input_size (int, optional): 入力サイズ. Defaults to None.
+            variant (str, optional): バリエーションの名前。*や?を含む場合はワイルドカードとして扱います. Defaults to None.
+            max_latency (float, optional): 推論時間の上限(ミリ秒)。指定した場合は測定済みのバリエーションだけを返します. Defaults to None.
+            limit (int, optional): 返す件数の上限. Defaults to None.
+
+        Returns:
+            List[dict]: モデル名、入力サイズ、推論時間の順に並べた検索結果
+        """
+        where, params = [], []
+        for col, val in (('m.name', name), ('v.variant', variant)):
+            if val is not None:
+                where.append(f"{col} GLOB ?" if any(c in val for c in '*?[') else f"{col} = ?")
+                params.append(val)
+        for col, val in (('m.arch', arch), ('m.input_size', input_size)):
+            if val is not None:
+                where.append(f"{col} = ?")
+                params.append(val)
+        if max_latency is not None:
+            where.append("v.latency_ms <= ?")
+            params.append(float(max_latency))
+        sql = f"SELECT {COLUMNS} FROM models m LEFT JOIN variants v ON v.model_id = m.id"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY m.name, m.input_size, v.latency_ms IS NULL, v.latency_ms"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        con = self._connect()
+        try:
+            return [dict(row) for row in con.execute(sql, params)]
+        finally:
+            con.close()
+
+    def fastest(self, latency_budget:float, name:str=None, input_size:int=None) -> List[dict]:
+        """
+        推論時間の上限以内で、モデル名ごとに最も速いバリエーションを選びます。
+
+        Args:
+            latency_budget (float): 推論時間の上限(ミリ秒)
+            name (str, optional): モデル名。*や?を含む場合はワイルドカードとして扱います. Defaults to None.
+            input_size (int, optional): 入力サイズ. Defaults to None.
+
+        Returns:
+            List[dict]: モデル名ごとに選んだバリエーションを速い順に並べたリスト
+        """
+        rows = self.query(name=name, input_size=input_size, max_latency=latency_budget)
+        best = dict()
+        for row in rows:
+            if row['name'] not in best or row['latency_ms'] < best[row['name']]['latency_ms']:
+                best[row['name']] = row
+        return sorted(best.values(), key=lambda r: r['latency_ms'])
@@ -0,0 +1,148 @@
+from functools import lru_cache
+from pth2onnx.app import postprocess
+from typing import List, Sequence, Tuple
+import cv2
+import numpy as np
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def class_colors(num_classes:int, seed:int=0) -> np.ndarray:
+    """
+    クラスごとの描画色を返します。同じシードからは常に同じ色になります。
+
+    Args:
+        num_classes (int): クラス数
+        seed (int, optional): 乱数のシード. Defaults to 0.
+
+    Returns:
+        np.ndarray: uint8の色の配列(クラス数, 3)
+    """
+    return np.random.default_rng(seed).integers(64, 256, size=(num_classes, 3)).astype(np.uint8)
+
+
+class Renderer(object):
+    def __init__(self, labels:Sequence[str]=postprocess.COCO_CLASSES, colors:np.ndarray=None, thickness:int=2,
+                 font_scale:float=0.4, show_score:bool=True):
+        """
+        画像に検出結果のバウンディングボックスとラベルを描画するレンダラー。
+        ボックスの座標は全件まとめて丸めて画像の範囲に収めてから描画します。
+        ラベルはクラスとスコア(0.1%単位)の組み合わせごとに一度だけ描画した色付きの画像とマスクを使い回し、画像に直接コピーします。
+
+        Args:
+            labels (Sequence[str], optional): クラスのラベル。Noneはクラス番号を表示. Defaults to COCO_CLASSES.
+            colors (np.ndarray, optional): クラスごとの色(クラス数, 3)。Noneはclass_colorsの色. Defaults to None.
+            thickness (int, optional): 線の太さ. Defaults to 2.
+            font_scale (float, optional): 文字の大きさ. Defaults to 0.4.
+            show_score (bool, optional): スコアを表示するかどうか. Defaults to True.
+        """
+        self.labels = tuple(labels) if labels is not None else None
+        num_classes = len(self.labels) if self.labels is not None else len(postprocess.COCO_CLASSES)
+        self.colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3) if colors is not None else class_colors(num_classes)
+        self.color_tuples = [tuple(c) for c in self.colors.tolist()]
+        self.thickness = int(thickness)
+        self.font_scale = float(font_scale)
+        self.show_score = show_score
+        (_, self.text_h), self.text_base = cv2.getTextSize('Ag', FONT, self.font_scale, 1)
+        self.glyph = lru_cache(maxsize=8192)(self._glyph)
+
+    def _label(self, cls:int) -> str:
+        if self.labels is not None and 0 <= cls < len(self.labels):
+            return self.labels[cls]
+        return str(cls)
+
+    def _glyph(self, cls:int, score:int) -> Tuple[np.ndarray, np.ndarray]:
+        text = f"{self._label(cls)}:{score // 10}.{score % 10}%" if self.show_score else self._label(cls)
+        (w, _), _ = cv2.getTextSize(text, FONT, self.font_scale, 1)
+        # 高さを揃えて描画し、ベースラインの位置を全てのラベルで同じにする
+        mask = np.zeros((self.text_h + self.text_base, w + 1), dtype=np.uint8)
+        cv2.putText(mask, text, (0, self.text_h), FONT, self.font_scale, 255, 1, cv2.LINE_AA)
+        # アンチエイリアスの半透明な画素は合成せず、濃い画素だけをコピーする
+        mask = np.where(mask >= 96, 255, 0).astype(np.uint8)
+        patch = np.empty((*mask.shape, 3), dtype=np.uint8)
+        patch[...] = self.colors[cls % len(self.colors)]
+        return patch, mask
+
+    def boxes(self, dets:np.ndarray, shape:Tuple[int, int]) -> np.ndarray:
+        """
+        検出結果の座標を四捨五入して整数にし、画像の範囲に収めます。
+
+        Args:
+            dets (np.ndarray): 検出結果(K, 6)。x1, y1, x2, y2, スコア, クラスの順
+            shape (Tuple[int, int]): 画像の(高さ, 幅)
+
+        Returns:
+            np.ndarray: int32の座標(K, 4)
+        """
+        limit = np.array([shape[1] - 1, shape[0] - 1] * 2, dtype=np.float64)
+        return np.clip(np.floor(np.asarray(dets[:, :4], dtype=np.float64) + 0.5), 0, limit).astype(np.int32)
+
+    def draw(self, img:np.ndarray, dets:np.ndarray) -> np.ndarray:
+        """
+        画像に検出結果を描画します。画像は直接書き換えられます。
+
+        Args:
+            img (np.ndarray): uint8の画像(高さ, 幅, 3)
+            dets (np.ndarray): 検出結果(K, 6)。x1, y1, x2, y2, スコア, クラスの順
+
+        Returns:
+            np.ndarray: 描画した画像
+        """
+        if dets is None or len(dets) == 0:
+            return img
+        xyxy = self.boxes(dets, img.shape[:2])
+        classes = dets[:, 5].astype(np.int64)
+        # ラベルの左下をボックスの左上の少し上に置き、画像の上端では内側に寄せる
+        tops = np.maximum(xyxy[:, 1] - 4, 10) - self.text_h
+        scores = np.round(dets[:, 4].astype(np.float64) * 1000).astype(np.int64) if self.show_score else np.zeros(len(dets), dtype=np.int64)
+        ih, iw = img.shape[:2]
+        colors, thickness, glyph = self.color_tuples, self.thickness, self.glyph
+        for (x1, y1, x2, y2), y, cls, score in zip(xyxy.tolist(), tops.tolist(), classes.tolist(), scores.tolist()):
+            cv2.rectangle(img, (x1, y1), (x2, y2), colors[cls % len(colors)], thickness)
+            patch, mask = glyph(cls, score)
+            h, w = mask.shape
+            # 画像からはみ出す部分を除いたラベルの範囲
+            left, top, right, bottom = max(-x1, 0), max(-y, 0), min(w, iw - x1), min(h, ih - y)
+            if left < right and top < bottom:
+                # 画像のスライスに直接書き込む
+                cv2.copyTo(patch[top:bottom, left:right], mask[top:bottom, left:right],
+                           img[y + top:y + bottom, x1 + left:x1 + right])
+        return img
+
+    def draw_batch(self, imgs:List[np.ndarray], dets_list:List[np.ndarray]) -> List[np.ndarray]:
+        """
+        複数の画像にそれぞれの検出結果を描画します。色と文字のマスクは画像の間で共有します。
+
+        Args:
+            imgs (List[np.ndarray]): uint8の画像のリスト
+            dets_list (List[np.ndarray]): 画像ごとの検出結果のリスト
+
+        Returns:
+            List[np.ndarray]: 描画した画像のリスト
+        """
+        return [self.draw(img, dets) for img, dets in zip(imgs, dets_list)]
+
+
+@lru_cache(maxsize=16)
+def _shared(labels:Tuple[str, ...], colors:Tuple[Tuple[int, int, int], ...], thickness:int, font_scale:float, show_score:bool) -> Renderer:
+    return Renderer(labels=labels, colors=colors, thickness=thickness, font_scale=font_scale, show_score=show_score)
+
+
+def get_renderer(labels:Sequence[str]=postprocess.COCO_CLASSES, colors:Sequence[Sequence[int]]=None, thickness:int=2,
+                 font_scale:float=0.4, show_score:bool=True) -> Renderer:
+    """
+    同じ設定のレンダラーを使い回して返します。描画した文字のマスクは呼び出しの間で共有されます。
+
+    Args:
+        labels (Sequence[str], optional): クラスのラベル。Noneはクラス番号を表示. Defaults to COCO_CLASSES.
+        colors (Sequence[Sequence[int]], optional): クラスごとの色。Noneはclass_colorsの色. Defaults to None.
+        thickness (int, optional): 線の太さ. Defaults to 2.
+        font_scale (float, optional): 文字の大きさ. Defaults to 0.4.
+        show_score (bool, optional): スコアを表示するかどうか. Defaults to True.
+
+    Returns:
+        Renderer: レンダラー
+    """
+    return _shared(tuple(labels) if labels is not None else None,
+                   tuple(tuple(int(v) for v in c) for c in colors) if colors is not None else None,
+                   int(thickness), float(font_scale), bool(show_score))
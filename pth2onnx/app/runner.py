@@ -0,0 +1,169 @@
+from collections import deque
+from pathlib import Path
+from pth2onnx.app import trace
+from typing import List
+import asyncio
+import codecs
+import functools
+import locale
+import logging
+import os
+import platform
+import shlex
+import signal
+import time
+
+MAX_LOG_LINES = 2000
+KILL_GRACE = 3.0
+RSS_INTERVAL = 0.2
+
+def split(cmd:str) -> List[str]:
+    """
+    コマンドの文字列を引数のリストに分割します。Windowsではパスの区切り文字をエスケープとして扱いません。
+
+    Args:
+        cmd (str): コマンドの文字列
+
+    Returns:
+        List[str]: コマンドと引数のリスト
+    """
+    return shlex.split(cmd, posix=platform.system() != 'Windows')
+
+@functools.lru_cache(maxsize=1)
+def _encoding() -> str:
+    # 子プロセスの出力はOSの既定のエンコーディングとみなし、一度だけ求める
+    return locale.getpreferredencoding(False) or 'utf-8'
+
+def _tree_rss(pid:int) -> int:
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        proc = psutil.Process(pid)
+        procs = [proc] + proc.children(recursive=True)
+    except psutil.Error:
+        return None
+    rss = 0
+    for p in procs:
+        try:
+            rss += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+def _kill_tree(proc:asyncio.subprocess.Process, sig:int=None):
+    if proc.returncode is not None:
+        return
+    if platform.system() == 'Windows':
+        os.system(f"taskkill /F /T /PID {proc.pid} >NUL 2>&1")
+        return
+    try:
+        os.killpg(proc.pid, sig if sig is not None else signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+async def _read_stream(stream:asyncio.StreamReader, name:str, log:deque, counter:dict, logger:logging.Logger, outlog:bool):
+    decoder = codecs.getincrementaldecoder(_encoding())(errors='replace')
+    buf = ''
+    while True:
+        chunk = await stream.read(65536)
+        buf += decoder.decode(chunk, final=not chunk)
+        if chunk:
+            *lines, buf = buf.split('\n')
+        else:
+            lines, buf = ([buf] if buf else []), ''
+        for line in lines:
+            line = line.rstrip('\r')
+            counter['lines'] += 1
+            log.append(line)
+            if outlog:
+                logger.debug(f"{name}:{line}")
+        if not chunk:
+            break
+
+async def run_async(argv:List[str], logger:logging.Logger, cwd:Path=Path('.'), timeout:float=None, env:dict=None,
+                    outlog:bool=True, max_log_lines:int=MAX_LOG_LINES) -> dict:
+    """
+    コマンドをシェルを介さずに実行し、標準出力と標準エラー出力を読み込みながら終了を待ちます。
+    タイムアウトした場合はプロセスグループごと終了させます。
+
+    Args:
+        argv (List[str]): コマンドと引数のリスト
+        logger (logging.Logger): ロガー
+        cwd (Path, optional): 実行するディレクトリ. Defaults to '.'.
+        timeout (float, optional): タイムアウト(秒)。Noneは無制限. Defaults to None.
+        env (dict, optional): 環境変数。Noneは現在の環境変数. Defaults to None.
+        outlog (bool, optional): 出力をログに出力するかどうか. Defaults to True.
+        max_log_lines (int, optional): 結果に残す出力の最大行数。超えた場合は古い行から捨てます. Defaults to 2000.
+
+    Returns:
+        dict: 戻り値(returncode)、出力(output)、捨てた行数(truncated_lines)、経過時間(elapsed)、
+              子プロセスのピークRSS(peak_rss_mb。psutilが無く測定できない場合はNone)、タイムアウトしたかどうか(timeout)
+    """
+    argv = [str(a) for a in argv]
+    if outlog: logger.debug(f"cmd:{argv}")
+    if platform.system() == 'Windows':
+        import subprocess
+        kwargs = dict(creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+    else:
+        kwargs = dict(start_new_session=True)
+    with trace.span('runner.run', cmd=' '.join(argv[:3])) as sp:
+        tm = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(*argv, cwd=str(cwd), env=env, stdin=asyncio.subprocess.DEVNULL,
+                                                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **kwargs)
+        log = deque(maxlen=max_log_lines)
+        counter = dict(lines=0)
+        readers = asyncio.gather(_read_stream(proc.stdout, 'stdout', log, counter, logger, outlog),
+                                 _read_stream(proc.stderr, 'stderr', log, counter, logger, outlog))
+        peak = dict(rss=None)
+
+        async def _watch_rss():
+            while proc.returncode is None:
+                rss = _tree_rss(proc.pid)
+                if rss is not None and (peak['rss'] is None or rss > peak['rss']):
+                    peak['rss'] = rss
+                await asyncio.sleep(RSS_INTERVAL)
+        watcher = asyncio.ensure_future(_watch_rss())
+
+        timed_out = False
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            logger.warning(f"Command timeout. ({timeout}s) cmd={argv}")
+            _kill_tree(proc)
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=KILL_GRACE)
+            except asyncio.TimeoutError:
+                _kill_tree(proc, getattr(signal, 'SIGKILL', None))
+                await proc.wait()
+        # 孫プロセスが出力を開いたままの場合に読み込みが終わらないよう、待つ時間を区切る
+        try:
+            await asyncio.wait_for(readers, timeout=KILL_GRACE if timed_out else None)
+        except asyncio.TimeoutError:
+            pass
+        watcher.cancel()
+        ret = dict(argv=argv, returncode=proc.returncode, output='\n'.join(log), truncated_lines=counter['lines'] - len(log),
+                   elapsed=round(time.perf_counter() - tm, 3),
+                   peak_rss_mb=round(peak['rss'] / 1024 / 1024, 1) if peak['rss'] is not None else None, timeout=timed_out)
+        if sp is not None:
+            sp.update(pid=proc.pid, returncode=proc.returncode, peak_rss_mb=ret['peak_rss_mb'], timeout=timed_out)
+    return ret
+
+def run(argv:List[str], logger:logging.Logger, cwd:Path=Path('.'), timeout:float=None, env:dict=None, outlog:bool=True) -> dict:
+    """
+    コマンドを実行し、終了するまで待ちます。引数と戻り値はrun_asyncと同じです。
+
+    Args:
+        argv (List[str]): コマンドと引数のリスト
+        logger (logging.Logger): ロガー
+        cwd (Path, optional): 実行するディレクトリ. Defaults to '.'.
+        timeout (float, optional): タイムアウト(秒)。Noneは無制限. Defaults to None.
+        env (dict, optional): 環境変数。Noneは現在の環境変数. Defaults to None.
+        outlog (bool, optional): 出力をログに出力するかどうか. Defaults to True.
+
+    Returns:
+        dict: 実行結果
+    """
+    return asyncio.run(run_async(argv, logger, cwd=cwd, timeout=timeout, env=env, outlog=outlog))
@@ -0,0 +1,201 @@
+from pathlib import Path
+from pth2onnx.app import common
+from typing import List
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL UNIQUE,
+    cmd TEXT NOT NULL,
+    model TEXT,
+    status TEXT NOT NULL,
+    run_dir TEXT NOT NULL,
+    manifest TEXT NOT NULL,
+    inputs INTEGER NOT NULL,
+    detections INTEGER,
+    elapsed REAL,
+    summary TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_created ON runs(created);
+CREATE INDEX IF NOT EXISTS runs_cmd ON runs(cmd, created);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    input TEXT NOT NULL,
+    output TEXT,
+    detections INTEGER
+);
+CREATE INDEX IF NOT EXISTS items_input ON items(input);
+"""
+
+
+class Run(object):
+    def __init__(self, cmd:str, base_dir:Path, manifest_file:Path=None):
+        """
+        1回の実行の出力先と、入力ごとの出力、検出結果、処理時間を記録するマニフェスト(JSONL)。
+        出力先は日時と乱数から作る実行ごとに異なるディレクトリのため、同時に実行しても出力が混ざりません。
+
+        Args:
+            cmd (str): コマンド名
+            base_dir (Path): 実行ごとのディレクトリを作成する親ディレクトリ
+            manifest_file (Path, optional): マニフェストのパス。Noneの場合は<実行ディレクトリ>/manifest.jsonl. Defaults to None.
+        """
+        self.cmd = cmd
+        self.run_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{common.random_string(6).lower()}"
+        self.run_dir = Path(base_dir) / self.run_id
+        self.manifest_file = Path(manifest_file) if manifest_file is not None else self.run_dir / 'manifest.jsonl'
+        self.created = time.time()
+        self.tm = time.perf_counter()
+
+    def write(self, record:dict):
+        """
+        マニフェストに1件追記します。
+
+        Args:
+            record (dict): image(入力)、output(出力)、detections(検出結果のリスト)などを持つ辞書
+        """
+        common.mkdirs(self.manifest_file.parent)
+        with open(self.manifest_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+    def items(self, input_file:Path=None, output_file:Path=None) -> List[dict]:
+        """
+        マニフェストから索引に登録する入力ごとの出力と検出数を求めます。
+        画像のレコードは画像ごと、動画のフレームのレコードはinput_fileとoutput_fileの1件にまとめます。
+
+        Args:
+            input_file (Path, optional): フレームをまとめるときの入力ファイルのパス. Defaults to None.
+            output_file (Path, optional): フレームをまとめるときの出力ファイルのパス. Defaults to None.
+
+        Returns:
+            List[dict]: input、output、detectionsを持つ辞書のリスト
+        """
+        items, frames, total = [], 0, None
+        if self.manifest_file.exists():
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    r = json.loads(line)
+                    count = len(r['detections']) if isinstance(r.get('detections'), list) else None
+                    if 'image' in r:
+                        items.append(dict(input=r['image'], output=r.get('output'), detections=count))
+                    else:
+                        frames += 1
+                        total = (total or 0) + count if count is not None else total
+        if frames > 0 or (len(items) == 0 and input_file is not None):
+            items.append(dict(input=str(input_file), output=str(output_file) if output_file is not None else None, detections=total))
+        return items
+
+
+class RunIndex(object):
+    def __init__(self, logger:logging.Logger, data:Path):
+        """
+        実行の一覧と、入力ごとの出力を記録する索引。
+        データディレクトリのSQLiteデータベースに追記だけを行い、実行日時や入力ファイルの索引で検索します。
+
+        Args:
+            logger (logging.Logger): ロガー
+            data (Path): データディレクトリのパス
+        """
+        self.logger = logger
+        self.db_file = Path(data) / 'runs' / 'runs.db'
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(self.db_file), timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        with self.lock:
+            if con.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                con.execute("PRAGMA journal_mode = WAL")
+                con.executescript(SCHEMA)
+                con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return con
+
+    @staticmethod
+    def _key(path) -> str:
+        return str(Path(path).resolve())
+
+    def record(self, run:Run, status:str, items:List[dict], model:str=None, **summary) -> int:
+        """
+        実行と入力ごとの出力を追記します。
+
+        Args:
+            run (Run): 実行
+            status (str): 'success'または'error'
+            items (List[dict]): input、output、detectionsを持つ辞書のリスト
+            model (str, optional): 実行に使ったモデルのパスまたは名前. Defaults to None.
+            **summary: 実行の処理時間などの集計。JSONにして記録します
+
+        Returns:
+            int: 実行のID
+        """
+        counts = [i['detections'] for i in items if i.get('detections') is not None]
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            row_id = con.execute("INSERT INTO runs (run_id, cmd, model, status, run_dir, manifest, inputs, detections, elapsed, summary, created) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (run.run_id, run.cmd, str(model) if model is not None else None, status, self._key(run.run_dir),
+                                  self._key(run.manifest_file), len(items), sum(counts) if counts else None,
+                                  round(time.perf_counter() - run.tm, 3), json.dumps(summary, default=str) if summary else None,
+                                  run.created)).lastrowid
+            con.executemany("INSERT INTO items (run_id, input, output, detections) VALUES (?, ?, ?, ?)",
+                            [(row_id, self._key(i['input']), self._key(i['output']) if i.get('output') is not None else None,
+                              i.get('detections')) for i in items])
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        self.logger.debug(f"Run recorded. run_id={run.run_id}, cmd={run.cmd}, status={status}, inputs={len(items)}")
+        return row_id
+
+    def list(self, cmd:str=None, limit:int=20) -> List[dict]:
+        """
+        実行を新しい順に返します。
+
+        Args:
+            cmd (str, optional): コマンド名で絞り込む. Defaults to None.
+            limit (int, optional): 返す件数の上限. Defaults to 20.
+
+        Returns:
+            List[dict]: 実行のリスト
+        """
+        where, params = ("WHERE cmd = ?", [cmd]) if cmd is not None else ("", [])
+        con = self._connect()
+        try:
+            rows = con.execute(f"SELECT run_id, cmd, model, status, inputs, detections, elapsed, run_dir, manifest, created FROM runs {where} "
+                               f"ORDER BY created DESC, id DESC LIMIT ?", params + [int(limit)]).fetchall()
+        finally:
+            con.close()
+        return [dict(r, created=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r['created']))) for r in rows]
+
+    def find(self, input_file:Path, limit:int=20) -> List[dict]:
+        """
+        入力ファイルの出力を新しい順に返します。
+
+        Args:
+            input_file (Path): 入力ファイルのパス
+            limit (int, optional): 返す件数の上限. Defaults to 20.
+
+        Returns:
+            List[dict]: 実行、出力ファイル、検出数のリスト
+        """
+        con = self._connect()
+        try:
+            rows = con.execute("SELECT r.run_id, r.cmd, r.model, r.status, i.input, i.output, i.detections, r.created FROM items i "
+                               "JOIN runs r ON r.id = i.run_id WHERE i.input = ? ORDER BY r.created DESC, r.id DESC LIMIT ?",
+                               (self._key(input_file), int(limit))).fetchall()
+        finally:
+            con.close()
+        return [dict(r, created=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r['created']))) for r in rows]
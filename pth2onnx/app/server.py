@@ -0,0 +1,320 @@
+from collections import Counter, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pth2onnx.app import codec, common, sessions, postprocess
+from pathlib import Path
+from typing import Callable, ContextManager, Dict, List
+from urllib.parse import parse_qs, urlparse
+import cv2
+import json
+import logging
+import numpy as np
+import queue
+import threading
+import time
+
+METRICS_WINDOW = 2048
+INDEX_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>pth2onnx</title></head>
+<body>
+<h1>pth2onnx</h1>
+<input type="file" id="file" accept="image/*">
+<pre id="result"></pre>
+<script>
+document.getElementById('file').addEventListener('change', async (e) => {
+  const res = await fetch('/infer', {method: 'POST', body: e.target.files[0]});
+  document.getElementById('result').textContent = JSON.stringify(await res.json(), null, 2);
+});
+</script>
+</body></html>
+"""
+
+
+class MicroBatcher(object):
+    def __init__(self, acquire:Callable[[], ContextManager], workers:int=1, max_batch_size:int=8, max_wait:float=5.0, max_queue:int=256,
+                 score_th:float=0.3, nms_th:float=0.45, logger:logging.Logger=None):
+        """
+        同時に届いた推論要求をまとめて推論するマイクロバッチャー。
+        最初の要求が届いてからmax_wait(ミリ秒)が経つか、max_batch_size件たまった時点でまとめて推論します。
+        推論エンジンはバッチごとにacquireで借りるため、使われていない間はセッションプールから破棄できます。
+
+        Args:
+            acquire (Callable[[], ContextManager]): 推論エンジンを借りるコンテキストマネージャーを返す関数
+            workers (int, optional): 並行して推論するスレッド数。セッションプールのモデルごとのエンジン数に合わせます. Defaults to 1.
+            max_batch_size (int, optional): まとめる要求の最大数. Defaults to 8.
+            max_wait (float, optional): 最初の要求が届いてから推論を始めるまでの最大の待ち時間(ミリ秒). Defaults to 5.0.
+            max_queue (int, optional): 待たせる要求の上限。超えた要求は受け付けません. Defaults to 256.
+            score_th (float, optional): スコアの閾値. Defaults to 0.3.
+            nms_th (float, optional): NMSの閾値. Defaults to 0.45.
+            logger (logging.Logger, optional): ロガー. Defaults to None.
+        """
+        self.acquire = acquire
+        self.max_batch_size = max(1, int(max_batch_size or 1))
+        self.max_wait = max(0.0, float(max_wait or 0)) / 1000
+        self.score_th = float(score_th)
+        self.nms_th = float(nms_th)
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.queue = queue.Queue(maxsize=max(1, int(max_queue or 1)))
+        self.lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=METRICS_WINDOW)
+        self.waits = deque(maxlen=METRICS_WINDOW)
+        self.infer_times = deque(maxlen=METRICS_WINDOW)
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.stop_event = threading.Event()
+        self.threads = [threading.Thread(target=self._loop, daemon=True) for _ in range(max(1, int(workers or 1)))]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+
+    def submit(self, img:np.ndarray) -> Future:
+        """
+        画像の推論を要求します。
+
+        Args:
+            img (np.ndarray): BGR形式の画像
+
+        Returns:
+            Future: 検出結果(K, 6)を返すFuture
+
+        Raises:
+            queue.Full: 待っている要求が上限に達している場合
+        """
+        fut = Future()
+        try:
+            self.queue.put_nowait((img, time.perf_counter(), fut))
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            raise
+        return fut
+
+    def _collect(self) -> List[tuple]:
+        try:
+            items = [self.queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = items[0][1] + self.max_wait
+        while len(items) < self.max_batch_size:
+            remain = deadline - time.perf_counter()
+            try:
+                items.append(self.queue.get(timeout=remain) if remain > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            items = self._collect()
+            if len(items) == 0:
+                continue
+            tm = time.perf_counter()
+            try:
+                with self.acquire() as eng:
+                    results = eng.infer([img for img, _, _ in items], score_th=self.score_th, nms_th=self.nms_th)
+            except Exception as e:
+                self.logger.error(f"Inference failed. {e}", exc_info=True)
+                with self.lock:
+                    self.errors += len(items)
+                for _, _, fut in items:
+                    fut.set_exception(e)
+                continue
+            done = time.perf_counter()
+            with self.lock:
+                self.requests += len(items)
+                self.batch_sizes[len(items)] += 1
+                self.infer_times.append(done - tm)
+                for _, ts, _ in items:
+                    self.waits.append(tm - ts)
+                    self.latencies.append(done - ts)
+            for (_, _, fut), dets in zip(items, results):
+                fut.set_result(dets)
+
+    def metrics(self) -> dict:
+        """
+        キューの長さ、バッチサイズのヒストグラム、直近の要求の遅延のパーセンタイルを返します。
+
+        Returns:
+            dict: メトリクス
+        """
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            return dict(queue_depth=self.queue.qsize(), requests=self.requests, rejected=self.rejected, errors=self.errors,
+                        batches=sum(self.batch_sizes.values()), max_batch_size=self.max_batch_size, max_wait_ms=self.max_wait * 1000,
+                        batch_size_histogram={str(k):v for k, v in sorted(self.batch_sizes.items())},
+                        requests_per_sec=round(self.requests / elapsed, 2) if elapsed > 0 else None,
+                        latency_ms=common.percentiles(list(self.latencies), scale=1000, ndigits=2),
+                        queue_wait_ms=common.percentiles(list(self.waits), scale=1000, ndigits=2),
+                        infer_ms=common.percentiles(list(self.infer_times), scale=1000, ndigits=2))
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    batchers:Dict[str, MicroBatcher] = None
+    pool:sessions.SessionPool = None
+    boot_path = '/index.html'
+    timeout_sec = 30.0
+    max_body_size = 16 * 1024 * 1024
+
+    def log_message(self, format, *args):
+        self.pool.logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send(self, status:int, body:bytes, content_type:str='application/json', close:bool=False):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if close:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status:int, data:dict):
+        self._send(status, json.dumps(data).encode('utf-8'))
+
+    def _reject(self, status:int, error:str):
+        # 本文を読まずに応答するため、残った本文が次の要求として読まれないように接続を閉じる
+        self._send(status, json.dumps({'error':error}).encode('utf-8'), close=True)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            self._send_json(200, metrics(self.batchers, self.pool))
+        elif path in ('/', self.boot_path):
+            self._send(200, INDEX_HTML.encode('utf-8'), 'text/html; charset=utf-8')
+        else:
+            self._send_json(404, {'error':f"Not found. ({path})"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        path = url.path
+        if path != '/infer':
+            self._reject(404, f"Not found. ({path})")
+            return
+        model = parse_qs(url.query).get('model', [self.headers.get('X-Model', '')])[0] or next(iter(self.batchers))
+        batcher = self.batchers.get(model)
+        if batcher is None:
+            self._reject(404, f"Model not found. ({model})")
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._reject(400, f"Invalid Content-Length. ({self.headers.get('Content-Length')})")
+            return
+        if length > self.max_body_size:
+            self._reject(413, f"Request body too large. content_length={length}, max_body_size={self.max_body_size}")
+            return
+        body = self.rfile.read(length) if length > 0 else b''
+        try:
+            if self.headers.get('Content-Type', '').startswith(codec.CONTENT_TYPE):
+                img = codec.decode(body)
+            else:
+                img = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        except (ValueError, cv2.error):
+            img = None
+        if img is None or img.ndim != 3 or img.shape[2] != 3:
+            self._send_json(400, {'error':f"Image decode failed."})
+            return
+        # 空の画像やuint8以外の配列は前処理で失敗し、同じバッチの他の要求まで失敗させるため、キューに入れる前に断る
+        if img.size == 0 or img.dtype != np.uint8:
+            self._send_json(400, {'error':f"Invalid image. shape={img.shape}, dtype={img.dtype}"})
+            return
+        try:
+            dets = batcher.submit(img).result(timeout=self.timeout_sec)
+        except queue.Full:
+            self._send_json(503, {'error':f"Server busy. queue_depth={batcher.queue.qsize()}"})
+            return
+        except Exception as e:
+            self._send_json(500, {'error':f"Inference failed. {e}"})
+            return
+        if codec.CONTENT_TYPE in self.headers.get('Accept', ''):
+            self._send(200, codec.encode(dets), codec.CONTENT_TYPE)
+        else:
+            self._send_json(200, postprocess.dets2dict(self.headers.get('X-Image-Name', ''), dets))
+
+
+def metrics(batchers:Dict[str, MicroBatcher], pool:sessions.SessionPool) -> dict:
+    """
+    モデルごとのマイクロバッチャーのメトリクスと、セッションプールのヒット、ミス、破棄の回数を返します。
+
+    Args:
+        batchers (Dict[str, MicroBatcher]): モデル名とマイクロバッチャーの辞書
+        pool (sessions.SessionPool): セッションプール
+
+    Returns:
+        dict: メトリクス
+    """
+    return dict(models={name:b.metrics() for name, b in batchers.items()}, pool=pool.stats())
+
+
+def serve(pool:sessions.SessionPool, models:Dict[str, Path], host:str='127.0.0.1', port:int=8080, max_batch_size:int=8, max_wait:float=5.0,
+          max_queue:int=256, score_th:float=0.3, nms_th:float=0.45, boot_path:str='/index.html', max_body_size:int=16,
+          logger:logging.Logger=None, ready:threading.Event=None, stop:threading.Event=None) -> dict:
+    """
+    画像をPOSTすると検出結果を返すHTTPサーバーを起動し、終了するまで待ちます。
+    モデルは最初の要求が届いたときにセッションプールでロードします。
+    - POST /infer: 画像ファイルのバイト列、またはContent-Typeがcodec.CONTENT_TYPEの配列を送ると検出結果を返します。
+      推論するモデルはクエリのmodel、またはX-Modelヘッダーで指定し、省略した場合は最初のモデルを使います。
+      Acceptにcodec.CONTENT_TYPEを指定した場合は検出結果(K, 6)を配列で返します。
+      パスとモデルは本文を読む前に確認し、本文がmax_body_sizeを超える要求には本文を読まずに413を返します。
+    - GET /metrics: モデルごとのキューの長さ、バッチサイズのヒストグラム、遅延のパーセンタイルと、セッションプールの状態を返します。
+    - GET boot_path: 画像をアップロードする画面を返します。
+
+    Args:
+        pool (sessions.SessionPool): セッションプール
+        models (Dict[str, Path]): モデル名とONNXファイルのパスの辞書
+        host (str, optional): 待ち受けるアドレス. Defaults to '127.0.0.1'.
+        port (int, optional): 待ち受けるポート。0は空いているポート. Defaults to 8080.
+        max_batch_size (int, optional): まとめる要求の最大数. Defaults to 8.
+        max_wait (float, optional): 最初の要求が届いてから推論を始めるまでの最大の待ち時間(ミリ秒). Defaults to 5.0.
+        max_queue (int, optional): モデルごとに待たせる要求の上限. Defaults to 256.
+        score_th (float, optional): スコアの閾値. Defaults to 0.3.
+        nms_th (float, optional): NMSの閾値. Defaults to 0.45.
+        boot_path (str, optional): アップロード画面のパス. Defaults to '/index.html'.
+        max_body_size (int, optional): POSTの本文の最大サイズ(MB). Defaults to 16.
+        logger (logging.Logger, optional): ロガー. Defaults to None.
+        ready (threading.Event, optional): 待ち受けを始めたときにセットするイベント。ready.addressに待ち受けるアドレスを設定します. Defaults to None.
+        stop (threading.Event, optional): セットされるとサーバーを終了するイベント。Noneの場合はCtrl+Cで終了します. Defaults to None.
+
+    Returns:
+        dict: 終了時のメトリクス
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    batchers = {name:MicroBatcher(lambda onnx_file=onnx_file: pool.acquire(onnx_file), workers=pool.sessions_per_model,
+                                  max_batch_size=max_batch_size, max_wait=max_wait, max_queue=max_queue,
+                                  score_th=score_th, nms_th=nms_th, logger=logger) for name, onnx_file in models.items()}
+    handler = type('Handler', (InferenceHandler,), dict(batchers=batchers, pool=pool, boot_path=boot_path or '/index.html',
+                                                        max_body_size=int(max_body_size or 16) * 1024 * 1024))
+    httpd = ThreadingHTTPServer((host, int(port)), handler)
+    httpd.daemon_threads = True
+    for batcher in batchers.values():
+        batcher.start()
+    address = httpd.server_address
+    logger.info(f"Server started. http://{address[0]}:{address[1]}{boot_path} models={list(batchers)}, max_batch_size={max_batch_size}, "
+                f"max_wait_ms={max_wait}, sessions_per_model={pool.sessions_per_model}")
+    if stop is not None:
+        threading.Thread(target=lambda: (stop.wait(), httpd.shutdown()), daemon=True).start()
+    if ready is not None:
+        ready.address = address
+        ready.set()
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        logger.info(f"Server interrupted.")
+    finally:
+        httpd.server_close()
+        for batcher in batchers.values():
+            batcher.stop()
+    ret = metrics(batchers, pool)
+    pool.close()
+    return ret
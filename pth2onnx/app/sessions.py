@@ -0,0 +1,207 @@
+from contextlib import contextmanager
+from pathlib import Path
+from pth2onnx.app import engine
+from typing import Dict, List
+import logging
+import os
+import threading
+import time
+
+
+def _rss() -> int:
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+class _Model(object):
+    def __init__(self, onnx_file:str):
+        self.onnx_file = onnx_file
+        self.engines:List[engine.OnnxEngine] = []
+        self.free:List[engine.OnnxEngine] = []
+        self.loading = 0
+        self.mem_estimate = None
+
+
+class SessionPool(object):
+    def __init__(self, memory_budget:int=0, sessions_per_model:int=1, idle_timeout:float=0, input_size:int=416, batch_size:int=1,
+                 intra_op_threads:int=0, inter_op_threads:int=0, logger:logging.Logger=None):
+        """
+        複数のONNXモデルの推論エンジンを、最初に使われたときにロードして使い回すプール。
+        メモリ使用量の合計が上限を超える場合や、一定時間使われていない場合は、使われていないエンジンを最後に使われた日時が古いものから破棄します。
+        メモリ使用量はエンジンの作成前後のRSSの差(ONNXファイルのサイズ以上)で求め、psutilが無い場合はONNXファイルのサイズの2倍と見積もります。
+
+        Args:
+            memory_budget (int, optional): エンジンのメモリ使用量の合計の上限(MB)。0は無制限. Defaults to 0.
+            sessions_per_model (int, optional): 並行して推論するためにモデルごとに作成するエンジンの最大数. Defaults to 1.
+            idle_timeout (float, optional): 使われていないエンジンを破棄するまでの時間(秒)。0は破棄しない. Defaults to 0.
+            input_size (int, optional): モデルの入力サイズ。モデルの入力が固定サイズの場合はそちらを優先. Defaults to 416.
+            batch_size (int, optional): バッチサイズ. Defaults to 1.
+            intra_op_threads (int, optional): オペレータ内の並列スレッド数。0はONNX Runtimeの既定値. Defaults to 0.
+            inter_op_threads (int, optional): オペレータ間の並列スレッド数。0はONNX Runtimeの既定値. Defaults to 0.
+            logger (logging.Logger, optional): ロガー. Defaults to None.
+        """
+        self.memory_budget = int(memory_budget or 0) * 1024 * 1024
+        self.sessions_per_model = max(1, int(sessions_per_model or 1))
+        self.idle_timeout = float(idle_timeout or 0)
+        self.engine_options = dict(input_size=input_size, batch_size=batch_size, intra_op_threads=intra_op_threads,
+                                   inter_op_threads=inter_op_threads)
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.cond = threading.Condition()
+        self.load_lock = threading.Lock()
+        self.models:Dict[str, _Model] = dict()
+        self.owner:Dict[int, _Model] = dict()
+        self.memory:Dict[int, int] = dict()
+        self.idle_since:Dict[int, float] = dict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.waits = 0
+        # リクエストが来なくても破棄されるように、使われていないエンジンを定期的に確認する
+        self.stop_event = threading.Event()
+        self.sweeper = None
+        if self.idle_timeout > 0:
+            self.sweeper = threading.Thread(target=self._sweep, name='session-sweeper', daemon=True)
+            self.sweeper.start()
+
+    @contextmanager
+    def acquire(self, onnx_file:Path):
+        """
+        モデルの推論エンジンを借ります。使われていないエンジンが無く、モデルごとの最大数に達している場合は返却されるまで待ちます。
+
+        Args:
+            onnx_file (Path): ONNXファイルのパス
+
+        Yields:
+            engine.OnnxEngine: 推論エンジン。withブロックを抜けるとプールに返却されます
+        """
+        eng = self._get(str(Path(onnx_file).resolve()))
+        try:
+            yield eng
+        finally:
+            self._release(eng)
+
+    def _get(self, key:str) -> engine.OnnxEngine:
+        with self.cond:
+            self._evict_idle()
+            while True:
+                m = self.models.setdefault(key, _Model(key))
+                if len(m.free) > 0:
+                    eng = m.free.pop()
+                    self.idle_since.pop(id(eng), None)
+                    self.hits += 1
+                    return eng
+                if len(m.engines) + m.loading < self.sessions_per_model:
+                    m.loading += 1
+                    self.misses += 1
+                    estimate = m.mem_estimate or Path(key).stat().st_size * 2
+                    break
+                self.waits += 1
+                self.cond.wait()
+            self._evict_for_budget(estimate)
+        try:
+            eng, mem = self._load(key)
+        except BaseException:
+            with self.cond:
+                m.loading -= 1
+                if len(m.engines) == 0 and m.loading == 0:
+                    self.models.pop(key, None)
+                self.cond.notify_all()
+            raise
+        with self.cond:
+            m.loading -= 1
+            m.engines.append(eng)
+            m.mem_estimate = mem
+            self.owner[id(eng)] = m
+            self.memory[id(eng)] = mem
+            self._evict_for_budget(0)
+        return eng
+
+    def _load(self, key:str):
+        # RSSの差が他のモデルのロードと混ざらないように、ロードは1つずつ行う
+        with self.load_lock:
+            before = _rss()
+            tm = time.perf_counter()
+            eng = engine.OnnxEngine(key, **self.engine_options)
+            after = _rss()
+        size = Path(key).stat().st_size
+        # アロケータが解放済みの領域を再利用するとRSSの差が小さくなるため、少なくとも重みのサイズはあるとみなす
+        mem = max(after - before, size) if before is not None and after is not None else size * 2
+        self.logger.info(f"Session loaded. onnx_file={key}, memory_mb={mem / 1024 / 1024:.1f}, elapsed={time.perf_counter() - tm:.03f}")
+        return eng, mem
+
+    def _release(self, eng:engine.OnnxEngine):
+        with self.cond:
+            m = self.owner.get(id(eng))
+            if m is not None:
+                m.free.append(eng)
+                self.idle_since[id(eng)] = time.perf_counter()
+                self._evict_for_budget(0)
+            self.cond.notify_all()
+
+    def _evict(self, eng:engine.OnnxEngine, reason:str):
+        m = self.owner.pop(id(eng))
+        m.engines.remove(eng)
+        m.free.remove(eng)
+        mem = self.memory.pop(id(eng), 0)
+        self.idle_since.pop(id(eng), None)
+        if len(m.engines) == 0 and m.loading == 0:
+            self.models.pop(m.onnx_file, None)
+        self.evictions += 1
+        self.logger.info(f"Session evicted. reason={reason}, onnx_file={m.onnx_file}, memory_mb={mem / 1024 / 1024:.1f}")
+
+    def _idle(self) -> List[engine.OnnxEngine]:
+        # 使われていないエンジンを最後に使われた日時が古い順に並べる
+        return sorted((eng for m in self.models.values() for eng in m.free), key=lambda e: self.idle_since.get(id(e), 0))
+
+    def _evict_idle(self):
+        if self.idle_timeout <= 0:
+            return
+        now = time.perf_counter()
+        for eng in self._idle():
+            if now - self.idle_since.get(id(eng), now) >= self.idle_timeout:
+                self._evict(eng, 'idle')
+
+    def _sweep(self):
+        # 破棄されるまでの時間がidle_timeoutの1.5倍を超えないように、その半分の間隔で確認する
+        while not self.stop_event.wait(self.idle_timeout / 2):
+            with self.cond:
+                self._evict_idle()
+
+    def _evict_for_budget(self, incoming:int):
+        if self.memory_budget <= 0:
+            return
+        for eng in self._idle():
+            if sum(self.memory.values()) + incoming <= self.memory_budget:
+                break
+            self._evict(eng, 'budget')
+        if sum(self.memory.values()) + incoming > self.memory_budget:
+            self.logger.warning(f"Session memory exceeds the budget. No idle session to evict. "
+                                f"memory_mb={(sum(self.memory.values()) + incoming) / 1024 / 1024:.1f}, "
+                                f"budget_mb={self.memory_budget / 1024 / 1024:.1f}")
+
+    def stats(self) -> dict:
+        """
+        プールの状態とヒット、ミス、破棄の回数を返します。
+
+        Returns:
+            dict: プールの状態
+        """
+        with self.cond:
+            return dict(models=len(self.models), sessions=len(self.owner), in_use=len(self.owner) - sum(len(m.free) for m in self.models.values()),
+                        memory_mb=round(sum(self.memory.values()) / 1024 / 1024, 1),
+                        memory_budget_mb=round(self.memory_budget / 1024 / 1024, 1) if self.memory_budget > 0 else None,
+                        hits=self.hits, misses=self.misses, evictions=self.evictions, waits=self.waits)
+
+    def close(self):
+        """
+        使われていないエンジンをすべて破棄し、定期的な確認を止めます。
+        """
+        self.stop_event.set()
+        if self.sweeper is not None and self.sweeper is not threading.current_thread():
+            self.sweeper.join()
+        with self.cond:
+            for eng in self._idle():
+                self._evict(eng, 'close')
@@ -0,0 +1,159 @@
+from pth2onnx.app import common, engine
+from typing import Tuple
+import cv2
+import logging
+import threading
+import time
+
+
+class LatestFrame(object):
+    def __init__(self):
+        """
+        キャプチャした最新のフレームだけを保持する入れ物。
+        推論が追いつかない場合、まだ取り出されていないフレームは新しいフレームで上書きされ、破棄された数を数えます。
+        """
+        self.cond = threading.Condition()
+        self.item = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, seq:int, ts:float, frame):
+        with self.cond:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = (seq, ts, frame)
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def get(self):
+        """
+        最新のフレームを取り出します。フレームが無い場合は届くまで待ちます。
+
+        Returns:
+            Tuple[int, float, np.ndarray]: フレーム番号、キャプチャ時刻、フレーム。終了した場合はNone
+        """
+        with self.cond:
+            while self.item is None and not self.closed:
+                self.cond.wait()
+            item, self.item = self.item, None
+            return item
+
+
+class StreamSource(object):
+    def __init__(self, input_video:str):
+        """
+        動画ファイルまたはカメラからフレームを読み込むソース。
+        数字だけの場合はカメラの番号として扱います。
+
+        Args:
+            input_video (str): 動画ファイルのパス、またはカメラの番号
+        """
+        self.name = str(input_video)
+        self.realtime = self.name.isdigit()
+        self.cap = cv2.VideoCapture(int(self.name) if self.realtime else self.name)
+        if not self.cap.isOpened():
+            raise ValueError(f"Video open failed. ({input_video})")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.size:Tuple[int, int] = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def read(self):
+        return self.cap.read()
+
+    def release(self):
+        self.cap.release()
+
+
+class StreamRunner(object):
+    def __init__(self, eng:engine.OnnxEngine, score_th:float=0.3, nms_th:float=0.45, target_latency:float=None,
+                 logger:logging.Logger=None):
+        """
+        動画ファイルまたはカメラの映像をリアルタイムに推論するランナー。
+        推論が追いつかない場合はフレームをキューに溜めずに破棄し、最新のフレームを推論します。
+
+        Args:
+            eng (engine.OnnxEngine): 推論エンジン
+            score_th (float, optional): スコアの閾値. Defaults to 0.3.
+            nms_th (float, optional): NMSの閾値. Defaults to 0.45.
+            target_latency (float, optional): 目標とするフレームごとの遅延(ミリ秒)。
+                キャプチャからの経過時間がこれを超えたフレームは推論せずに破棄します. Defaults to None.
+            logger (logging.Logger, optional): ロガー. Defaults to None.
+        """
+        self.eng = eng
+        self.score_th = float(score_th)
+        self.nms_th = float(nms_th)
+        self.target_latency = float(target_latency) / 1000 if target_latency else None
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+    def _capture(self, source:StreamSource, latest:LatestFrame, stop:threading.Event, max_frames:int, result:dict):
+        # 動画ファイルはカメラと同じようにフレームレートに合わせて読み込む
+        seq = 0
+        try:
+            start = time.perf_counter()
+            while not stop.is_set() and (max_frames <= 0 or seq < max_frames):
+                if not source.realtime:
+                    wait = start + seq / source.fps - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                ret, frame = source.read()
+                if not ret:
+                    break
+                latest.put(seq, time.perf_counter(), frame)
+                seq += 1
+        finally:
+            result['captured'] = seq
+            latest.close()
+
+    def run(self, source:StreamSource, sink, output_preview:bool=False, max_frames:int=0) -> dict:
+        """
+        映像の各フレームを推論し、結果をシンクに書き出します。
+
+        Args:
+            source (StreamSource): 入力のソース
+            sink: 出力のシンク(pipeline.VideoSink)
+            output_preview (bool, optional): 推論結果をウインドウに表示するかどうか。qキーで終了します. Defaults to False.
+            max_frames (int, optional): キャプチャする最大フレーム数。0は無制限. Defaults to 0.
+
+        Returns:
+            dict: キャプチャ、推論、破棄したフレーム数、達成したFPS、フレームごとの遅延(ミリ秒)のパーセンタイル
+        """
+        latest = LatestFrame()
+        stop = threading.Event()
+        result = dict(captured=0)
+        capture = threading.Thread(target=self._capture, args=(source, latest, stop, int(max_frames or 0), result), daemon=True)
+        latencies = []
+        late = 0
+        tm = time.perf_counter()
+        capture.start()
+        try:
+            while True:
+                item = latest.get()
+                if item is None:
+                    break
+                seq, ts, frame = item
+                if self.target_latency is not None and time.perf_counter() - ts > self.target_latency:
+                    late += 1
+                    continue
+                dets = self.eng.infer([frame], score_th=self.score_th, nms_th=self.nms_th)[0]
+                sink.write(seq, sink.encode(seq, frame, dets))
+                latencies.append(time.perf_counter() - ts)
+                if output_preview:
+                    cv2.imshow(source.name, frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+        except KeyboardInterrupt:
+            self.logger.info(f"Stream interrupted.")
+        finally:
+            stop.set()
+            capture.join()
+            source.release()
+            sink.close()
+            if output_preview:
+                cv2.destroyAllWindows()
+        elapsed = time.perf_counter() - tm
+        return dict(captured=result['captured'], processed=len(latencies), dropped=latest.dropped + late,
+                    source_fps=round(source.fps, 2), fps=round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+                    **{f"latency_{k}_ms":v for k, v in common.percentiles(latencies, scale=1000, ndigits=2).items()})
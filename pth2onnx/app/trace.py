@@ -0,0 +1,227 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import List
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+# inspect.CO_COROUTINEと同じ値
+CO_COROUTINE = 0x80
+_tracer = None
+_current = ContextVar('pth2onnx_span', default=None)
+
+
+class _Span(object):
+    __slots__ = ('id', 'parent', 'name', 'attrs', 'tid', 'start', 'child_time')
+
+    def __init__(self, id:int, parent:'_Span', name:str, attrs:dict, tid:int):
+        self.id = id
+        self.parent = parent
+        self.name = name
+        self.attrs = attrs
+        self.tid = tid
+        self.start = time.perf_counter()
+        self.child_time = 0.0
+
+
+class Tracer(object):
+    def __init__(self, trace_file:Path, trace_format:str=None):
+        """
+        処理の区間(スパン)の開始時刻と所要時間を記録するトレーサー。
+        JSON Lines形式は終了したスパンを1行ずつ追記するため、途中で異常終了しても終了済みのスパンは残ります。
+        Chromeのトレース形式はstopしたときにまとめて書き出し、chrome://tracingやPerfettoで表示できます。
+
+        Args:
+            trace_file (Path): 出力するファイルのパス
+            trace_format (str, optional): 'jsonl'または'chrome'。Noneの場合は拡張子が.jsonならchrome、それ以外はjsonl. Defaults to None.
+        """
+        self.trace_file = Path(trace_file)
+        self.trace_format = trace_format or ('chrome' if self.trace_file.suffix.lower() == '.json' else 'jsonl')
+        if self.trace_format not in ('jsonl', 'chrome'):
+            raise ValueError(f"Unknown trace format. ({self.trace_format})")
+        self.trace_file.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.lanes = dict()
+        self.origin = time.perf_counter()
+        self.epoch = time.time()
+        self.pid = os.getpid()
+        self.spans:List[dict] = []
+        self.fp = open(self.trace_file, 'w', encoding='utf-8') if self.trace_format == 'jsonl' else None
+        self.root = None
+        self.root_token = None
+
+    def _tid(self) -> int:
+        # 同じスレッドで並行して動くasyncioのタスクは、重ならないように別のレーンに分ける
+        tid = threading.get_native_id()
+        # asyncioを読み込んでいない場合はタスクも無いため、起動を遅くしないようにここでは読み込まない
+        asyncio = sys.modules.get('asyncio')
+        try:
+            task = asyncio.current_task() if asyncio is not None else None
+        except RuntimeError:
+            task = None
+        if task is None:
+            return tid
+        with self.lock:
+            return self.lanes.setdefault(id(task), tid * 1000 + len(self.lanes) + 1)
+
+    def begin(self, name:str, attrs:dict) -> _Span:
+        return _Span(next(self.ids), _current.get(), name, attrs, self._tid())
+
+    def end(self, span:_Span):
+        end = time.perf_counter()
+        dur = end - span.start
+        if span.parent is not None:
+            span.parent.child_time += dur
+        rec = dict(id=span.id, parent=span.parent.id if span.parent is not None else None, name=span.name,
+                   start_ms=round((span.start - self.origin) * 1000, 3), dur_ms=round(dur * 1000, 3),
+                   self_ms=round(max(0.0, dur - span.child_time) * 1000, 3), pid=self.pid, tid=span.tid, attrs=span.attrs)
+        with self.lock:
+            self.spans.append(rec)
+            if self.fp is not None:
+                self.fp.write(json.dumps(rec, default=str) + '\n')
+                self.fp.flush()
+
+    def close(self):
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
+            elif self.trace_format == 'chrome':
+                events = [dict(name=s['name'], cat='pth2onnx', ph='X', ts=round(s['start_ms'] * 1000, 1), dur=round(s['dur_ms'] * 1000, 1),
+                               pid=s['pid'], tid=s['tid'], args=s['attrs']) for s in self.spans]
+                self.trace_file.write_text(json.dumps(dict(traceEvents=events, displayTimeUnit='ms',
+                                                           otherData=dict(epoch=self.epoch)), default=str), encoding='utf-8')
+
+    def summary(self, top:int=15) -> List[dict]:
+        """
+        スパンを名前ごとに集計し、自身の処理時間(子のスパンを除いた時間)の合計が大きい順に返します。
+        割合はすべてのスパンの自身の処理時間の合計に対する割合で、スレッドで並行して動いたスパンも重ねて数えます。
+
+        Args:
+            top (int, optional): 返す件数. Defaults to 15.
+
+        Returns:
+            List[dict]: 名前、回数、所要時間の合計、自身の処理時間の合計と割合、平均、最大(ミリ秒)のリスト
+        """
+        with self.lock:
+            spans = list(self.spans)
+        total = sum(s['self_ms'] for s in spans) or 1.0
+        rows = dict()
+        for s in spans:
+            r = rows.setdefault(s['name'], dict(name=s['name'], count=0, total_ms=0.0, self_ms=0.0, max_ms=0.0))
+            r['count'] += 1
+            r['total_ms'] += s['dur_ms']
+            r['self_ms'] += s['self_ms']
+            r['max_ms'] = max(r['max_ms'], s['dur_ms'])
+        ret = []
+        for r in sorted(rows.values(), key=lambda r: r['self_ms'], reverse=True)[:top]:
+            ret.append(dict(name=r['name'], count=r['count'], total_ms=round(r['total_ms'], 3), self_ms=round(r['self_ms'], 3),
+                            self_pct=round(r['self_ms'] / total * 100, 1), mean_ms=round(r['total_ms'] / r['count'], 3),
+                            max_ms=round(r['max_ms'], 3)))
+        return ret
+
+
+def start(trace_file:Path, trace_format:str=None, name:str='main', **attrs) -> Tracer:
+    """
+    トレースを開始し、stopするまでのルートのスパンを開きます。開始するまではspanは何も記録しません。
+
+    Args:
+        trace_file (Path): 出力するファイルのパス
+        trace_format (str, optional): 'jsonl'または'chrome'。Noneの場合は拡張子で決めます. Defaults to None.
+        name (str, optional): ルートのスパンの名前. Defaults to 'main'.
+        **attrs: ルートのスパンに記録する属性
+
+    Returns:
+        Tracer: トレーサー
+    """
+    global _tracer
+    _tracer = Tracer(trace_file, trace_format=trace_format)
+    _tracer.root = _tracer.begin(name, attrs)
+    _tracer.root_token = _current.set(_tracer.root)
+    return _tracer
+
+
+def stop(top:int=15, out=None) -> List[dict]:
+    """
+    トレースを終了してファイルを閉じ、処理時間の大きいスパンの集計を表形式で出力します。
+
+    Args:
+        top (int, optional): 出力する件数. Defaults to 15.
+        out (optional): 出力先。Noneの場合は標準エラー出力. Defaults to None.
+
+    Returns:
+        List[dict]: スパンの集計。トレースしていない場合は空のリスト
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return []
+    _current.reset(tracer.root_token)
+    tracer.end(tracer.root)
+    from tabulate import tabulate
+    tracer.close()
+    rows = tracer.summary(top=top)
+    out = out if out is not None else sys.stderr
+    print(f"Trace saved. ({tracer.trace_file}) spans={len(tracer.spans)}", file=out)
+    print(tabulate(rows, headers='keys'), file=out)
+    return rows
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+@contextmanager
+def span(name:str, **attrs):
+    """
+    withブロックの処理をスパンとして記録します。スパンは入れ子にでき、スレッドやasyncioのタスクごとに親子関係を追跡します。
+    トレースしていない場合は何もしません。
+
+    Args:
+        name (str): スパンの名前
+        **attrs: スパンに記録する属性
+
+    Yields:
+        dict: 属性の辞書。ブロックの中で結果などを追加できます。トレースしていない場合はNone
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    s = tracer.begin(name, attrs)
+    token = _current.set(s)
+    try:
+        yield s.attrs
+    finally:
+        _current.reset(token)
+        tracer.end(s)
+
+
+def traced(name:str):
+    """
+    関数の呼び出しをスパンとして記録するデコレーター。コルーチン関数にも使えます。
+
+    Args:
+        name (str): スパンの名前
+    """
+    def _decorator(func):
+        # クラスの定義時に呼ばれるため、asyncioやinspectを読み込まずにコルーチン関数かを判定する
+        if getattr(getattr(func, '__code__', None), 'co_flags', 0) & CO_COROUTINE:
+            @functools.wraps(func)
+            async def _async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return _async_wrapper
+
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return _wrapper
+    return _decorator
@@ -13,6 +13,7 @@ VERSION = version.__version__
 PYTHON_REQUIRES = '>=3.8'
 INSTALL_REQUIRES = [
     'numpy',
+    'onnxruntime',
     'opencv-python',
     'Pillow',
     'PyYAML',